@@ -0,0 +1,75 @@
+"""Read zip archives on sys.path, such as zipped eggs and wheels, in place."""
+
+import os
+
+import hashlib
+import time
+import zipfile
+
+
+def is_archive(path):
+    """Whether path is a zip archive, rather than a directory."""
+    return os.path.isfile(path) and zipfile.is_zipfile(path)
+
+
+class ZipArchive(object):
+    """A read-only view of a zip archive as a directory tree.
+
+    Paths inside the archive are the archive's own path joined with the
+    member's, eg. "/lib/foo.egg/foo/__init__.py", which is also how
+    zipimport names them. Members are read straight out of the archive, and
+    nothing is extracted.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self._zip = zipfile.ZipFile(filename)
+        # Maps directory paths to lists of (name, path, is_dir, is_file).
+        self._dirs = {filename: []}
+        self._members = {}
+        for info in self._zip.infolist():
+            parts = [part for part in info.filename.split('/') if part]
+            is_dir = info.filename.endswith('/')
+            dir = filename
+            for i, part in enumerate(parts):
+                path = os.path.join(dir, part)
+                if i == len(parts) - 1 and not is_dir:
+                    if path not in self._members:
+                        self._members[path] = info
+                        self._dirs[dir].append((part, path, False, True))
+                elif path not in self._dirs:
+                    self._dirs[path] = []
+                    self._dirs[dir].append((part, path, True, False))
+                dir = path
+
+    def scan(self, dir):
+        """List a directory, like index._scan().
+
+        :raises OSError: If there is no such directory in the archive.
+        """
+        try:
+            return list(self._dirs[dir])
+        except KeyError:
+            raise OSError('no directory %s in %s' % (dir, self.filename))
+
+    def isfile(self, path):
+        return path in self._members
+
+    def read(self, path):
+        """Read a member.
+
+        :returns: A tuple of ([mtime, size, sha1 of content], source).
+        """
+        info = self._members[path]
+        source = self._zip.read(info)
+        mtime = time.mktime(info.date_time + (0, 0, -1))
+        return [mtime, info.file_size, hashlib.sha1(source).hexdigest()], source
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
@@ -0,0 +1,221 @@
+"""Build an index in a child process.
+
+Parsing is CPU bound, so a build running on a thread of an editor's plugin
+host holds the GIL for as long as it takes, and a module that crashes the
+interpreter takes the host with it. Run as "python -m importmagic.build",
+this module reads a JSON build config from stdin, lowers its own priority,
+builds the index and writes it to the config's index_file. It reports on
+stdout with one JSON object per line:
+
+    {"phase": "local", "snapshot": "<index_file>.partial"}
+    {"report": {...}}
+
+A "phase" line is written after each of BUILD_PHASES but the last, with
+the filename of a snapshot of the index so far if the config asks for
+them. The "report" line is BuildReport.as_dict(), written once the index
+file is in place. The exit status is non-zero if the build failed.
+
+The config is a JSON object of:
+
+- index_file: Where to write the index.
+- paths: The search paths to index.
+- locations, lazy, scanner, metadata, exclude, generated: SymbolIndex
+  options.
+- blacklist_re: A regular expression for SymbolIndex's blacklist_re.
+- processes: build_index()'s processes.
+- shared_cache, refresh, shared_cache_dir: Whether to use a SubtreeCache,
+  whether to refresh it, and where caches are kept.
+- subtree_store: Whether to write large entries to a SubtreeStore, which
+  the index then has to be read back with.
+- max_store_size: How many bytes of entries the SubtreeStore keeps, or 0
+  for no limit.
+- symbol_cache_size: Maximum entries in the SymbolCache, or 0 for none.
+- max_module_size, max_parse_seconds: Quarantine budgets, or a
+  max_module_size of 0 for no quarantine.
+- introspection_workers: Introspector workers, or 0 to import extension
+  modules in the builder.
+- report_file: Where to write the BuildReport as JSON, if anywhere.
+- snapshots: Whether to write snapshots after each phase.
+- niceness: How much to lower the builder's priority by.
+"""
+
+import os
+import sys
+
+import json
+import logging
+import re
+import tempfile
+
+from importmagic.cache import Quarantine, SubtreeCache, SubtreeStore, SymbolCache
+from importmagic.index import BUILD_PHASES, LIB_LOCATIONS, SymbolIndex
+from importmagic.introspect import Introspector
+from importmagic.report import BuildReport
+
+
+logger = logging.getLogger(__name__)
+
+# Windows has priority classes rather than nice values.
+BELOW_NORMAL_PRIORITY_CLASS = 0x00004000
+
+
+def build(config, progress=None, introspector=None, load=True):
+    """Build the index described by config and write it to its index_file.
+
+    The index is spilled to a temporary file next to index_file as it is
+    built, which then replaces index_file, so only the top-level package
+    being indexed is held in memory rather than the whole index.
+
+    :param progress: An optional callable, called with the name of each
+        phase, as build_index()'s progress is, and a function that writes
+        the index built so far to a file.
+    :param introspector: The Introspector to use. Defaults to one running
+        the current interpreter, if the config asks for workers.
+    :param load: Whether to read the index back to return it.
+    :returns: A tuple of (SymbolIndex, BuildReport). The SymbolIndex is
+        None if load is false.
+    """
+    blacklist_re = config.get('blacklist_re')
+    blacklist_re = blacklist_re and re.compile(blacklist_re)
+    index = SymbolIndex(blacklist_re=blacklist_re,
+                        locations=config.get('locations') or LIB_LOCATIONS,
+                        lazy=config.get('lazy', False), scanner=config.get('scanner', 'ast'),
+                        metadata=config.get('metadata', False), exclude=config.get('exclude'),
+                        generated=config.get('generated'), store=open_store(config))
+    cache, symbol_cache, quarantine = open_caches(config)
+    if introspector is None and config.get('introspection_workers', 0):
+        introspector = Introspector(workers=config['introspection_workers'])
+    report = BuildReport()
+
+    def write(spill):
+        on_phase = None
+        if progress is not None:
+            def on_phase(phase):
+                spill.flush()
+                progress(phase, lambda fp: _write_spilled(index, spill.name, fp))
+        index.build_index(config['paths'], processes=config.get('processes', 0), cache=cache,
+                          introspector=introspector, symbol_cache=symbol_cache, report=report,
+                          progress=on_phase, spill=spill, quarantine=quarantine)
+
+    _replace(config['index_file'], write)
+    if index.store is not None:
+        index.store.prune()
+    if config.get('report_file'):
+        report.write(config['report_file'])
+    if not load:
+        return None, report
+    with open(config['index_file']) as fd:
+        return SymbolIndex.deserialize(fd, blacklist_re, index.store), report
+
+
+def open_caches(config):
+    """Open the caches config asks for.
+
+    :returns: A tuple of (SubtreeCache, SymbolCache, Quarantine), any of
+        which may be None.
+    """
+    cache = None
+    if config.get('shared_cache', True):
+        cache = SubtreeCache(_cache_subdir(config, 'subtrees'),
+                             refresh=config.get('refresh', False))
+    symbol_cache = None
+    if config.get('symbol_cache_size', 50000):
+        symbol_cache = SymbolCache(_cache_subdir(config, 'symbols'),
+                                   max_entries=config.get('symbol_cache_size', 50000))
+    quarantine = None
+    if config.get('max_module_size', 2 * 1024 * 1024):
+        quarantine = Quarantine(_cache_subdir(config, 'quarantine'),
+                                max_size=config.get('max_module_size', 2 * 1024 * 1024),
+                                max_seconds=config.get('max_parse_seconds', 2.0))
+    return cache, symbol_cache, quarantine
+
+
+def open_store(config):
+    """Return the SubtreeStore config asks for, or None."""
+    if not config.get('subtree_store', True):
+        return None
+    return SubtreeStore(_cache_subdir(config, 'store'),
+                        max_size=config.get('max_store_size', 1024 * 1024 * 1024))
+
+
+def save_index(index, filename):
+    """Atomically replace filename with index."""
+    _replace(filename, index.serialize)
+
+
+def rewrite_index(index, filename, names):
+    """Atomically replace filename with index, copying its unchanged entries.
+
+    :param names: The top-level entries of index that changed since it was
+        written to filename, as SymbolIndex.rebuild_locations() returns.
+    """
+    if not os.path.exists(filename):
+        save_index(index, filename)
+        return
+
+    def write(fp):
+        with open(filename) as old:
+            index.rewrite(old, fp, names)
+
+    _replace(filename, write)
+
+
+def _write_spilled(index, spilled, fp):
+    with open(spilled) as fd:
+        index.serialize_spilled(fd, fp)
+
+
+def _cache_subdir(config, name):
+    cache_dir = config.get('shared_cache_dir')
+    return cache_dir and os.path.join(cache_dir, name)
+
+
+def _replace(filename, write):
+    fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)), suffix='.tmp')
+    try:
+        os.close(fd)
+        # Opened by name, so that write() can read back what it has written.
+        with open(tmp, 'w') as fp:
+            write(fp)
+        if os.path.exists(filename) and sys.platform == 'win32':
+            os.unlink(filename)
+        os.rename(tmp, filename)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def lower_priority(niceness):
+    """Lower the priority of the current process, where that is supported."""
+    if hasattr(os, 'nice'):
+        try:
+            os.nice(niceness)
+        except OSError as e:
+            logger.debug('failed to lower priority: %s', e)
+
+
+def main():
+    logging.basicConfig(stream=sys.stderr, level=logging.WARNING)
+    config = json.load(sys.stdin)
+    lower_priority(config.get('niceness', 10))
+    output = sys.stdout
+    # Keep anything imported modules print away from the protocol.
+    sys.stdout = sys.stderr
+
+    def progress(phase, write):
+        if phase == BUILD_PHASES[-1]:
+            return
+        message = {'phase': phase}
+        if config.get('snapshots'):
+            message['snapshot'] = config['index_file'] + '.partial'
+            _replace(message['snapshot'], write)
+        output.write(json.dumps(message) + '\n')
+        output.flush()
+
+    _, report = build(config, progress, load=False)
+    output.write(json.dumps({'report': report.as_dict()}) + '\n')
+    output.flush()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,77 @@
+from __future__ import absolute_import
+
+import json
+import os
+import subprocess
+import sys
+
+from importmagic.build import build
+from importmagic.index import SymbolIndex
+from importmagic.report import BuildReport
+from importmagic.six import StringIO
+
+
+def run_builder(config):
+    env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.dirname(__file__)))
+    process = subprocess.Popen([sys.executable, '-m', 'importmagic.build'], env=env,
+                               stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, universal_newlines=True)
+    stdout, stderr = process.communicate(json.dumps(config))
+    return process.returncode, [json.loads(line) for line in stdout.splitlines()], stderr
+
+
+def test_builder_writes_index_and_reports(tmpdir):
+    tmpdir.mkdir('project').join('app.py').write('def main():\n pass\n')
+    index_file = str(tmpdir.join('index'))
+    returncode, messages, stderr = run_builder({
+        'index_file': index_file,
+        'paths': [str(tmpdir.join('project'))],
+        'shared_cache': False,
+        'subtree_store': False,
+        'symbol_cache_size': 0,
+        'max_module_size': 0,
+        'snapshots': True,
+        'blacklist_re': '^$',
+    })
+    assert returncode == 0, stderr
+    assert [message['phase'] for message in messages[:-1]] == ['local', 'builtins', 'stdlib']
+    with open(messages[0]['snapshot']) as fd:
+        assert SymbolIndex.deserialize(fd).find('app') is not None
+    report = BuildReport.from_dict(messages[-1]['report'])
+    assert report.parsed == 1
+    assert report.as_dict() == messages[-1]['report']
+    with open(index_file) as fd:
+        assert sorted(SymbolIndex.deserialize(fd).find('app')._tree) == ['main']
+
+
+def test_builder_fails_without_writing_index(tmpdir):
+    index_file = str(tmpdir.join('index'))
+    returncode, messages, stderr = run_builder({'index_file': index_file})
+    assert returncode != 0
+    assert 'paths' in stderr
+    assert not os.path.exists(index_file)
+
+
+def test_build_spills_to_index_file(tmpdir):
+    tmpdir.mkdir('project').join('app.py').write('def main():\n pass\n')
+    index_file = tmpdir.join('index')
+    index_file.write('old')
+    snapshots = {}
+
+    def progress(phase, write):
+        fd = StringIO()
+        write(fd)
+        fd.seek(0)
+        snapshots[phase] = SymbolIndex.deserialize(fd)
+        assert index_file.read() == 'old'
+
+    index, report = build({'index_file': str(index_file), 'paths': [str(tmpdir.join('project'))],
+                           'shared_cache': False, 'subtree_store': False, 'symbol_cache_size': 0,
+                           'max_module_size': 0, 'blacklist_re': '^$'}, progress)
+    # Packages spilled in earlier phases are in later snapshots too.
+    assert snapshots['builtins'].find('app') is not None
+    assert snapshots['builtins'].find('sys') is not None
+    assert sorted(index.find('app')._tree) == ['main']
+    with open(str(index_file)) as fd:
+        assert sorted(SymbolIndex.deserialize(fd).find('app')._tree) == ['main']
+    assert sorted(os.listdir(str(tmpdir))) == ['index', 'project']
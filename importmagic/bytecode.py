@@ -0,0 +1,313 @@
+"""Extract top-level symbols from the bytecode CPython caches for modules.
+
+Most installed modules have an up to date .pyc in __pycache__, written when
+they were installed or first imported. bytecode_symbols() loads the module's
+code object from there with marshal and reads the names it binds from its
+instructions, which is much cheaper than parsing the source.
+
+It approximates what SymbolVisitor records from the AST. Bytecode has no
+statements, so the bodies of if statements, which SymbolVisitor ignores, are
+recovered from the conditional jumps around them, and the targets of
+imports, loops, with and except clauses, tuple unpacking, augmented and
+annotated assignments are recognised from the instructions that store them.
+Anything it can't be sure about raises Ambiguous, as does a missing or stale
+.pyc, and the caller is expected to fall back to a full parse.
+"""
+
+import os
+import sys
+
+import dis
+import inspect
+import marshal
+import struct
+
+from importmagic.scanner import Ambiguous
+
+
+try:
+    from importlib.util import MAGIC_NUMBER, cache_from_source, source_hash
+except ImportError:
+    MAGIC_NUMBER = cache_from_source = source_hash = None
+
+
+# Instructions after which the next store binds the target of an import, a
+# for loop, a with statement or an except clause.
+_BINDING = frozenset(['IMPORT_NAME', 'IMPORT_FROM', 'FOR_ITER', 'SETUP_WITH', 'BEFORE_WITH',
+                      'CHECK_EXC_MATCH', 'JUMP_IF_NOT_EXC_MATCH'])
+# Instructions that may come between those and the store.
+_BINDING_SKIPPED = frozenset(['POP_TOP', 'NOP', 'SWAP', 'ROT_TWO', 'IMPORT_FROM'])
+# Instructions that reorder values for "a, b = c, d" instead of unpacking a
+# tuple, and the number of targets they imply.
+_ROTATIONS = {'ROT_TWO': 2, 'ROT_THREE': 3}
+# Structural pattern matching, whose case bodies SymbolVisitor does visit.
+_MATCH = frozenset(['MATCH_CLASS', 'MATCH_MAPPING', 'MATCH_SEQUENCE', 'MATCH_KEYS'])
+_UNCONDITIONAL_JUMPS = frozenset(['JUMP_FORWARD', 'JUMP_ABSOLUTE', 'JUMP_BACKWARD', 'JUMP',
+                                  'JUMP_BACKWARD_NO_INTERRUPT', 'JUMP_NO_INTERRUPT'])
+_RETURNS = frozenset(['RETURN_VALUE', 'RETURN_CONST'])
+_JUMPS = frozenset(getattr(dis, 'hasjump', dis.hasjabs + dis.hasjrel))
+_ASYNC_FLAGS = getattr(inspect, 'CO_COROUTINE', 0) | getattr(inspect, 'CO_ASYNC_GENERATOR', 0)
+
+
+def bytecode_symbols(filename, source):
+    """Extract top-level symbols from the cached bytecode of filename.
+
+    :param source: The source of filename, which the bytecode must be
+        compiled from.
+    :returns: A list of (name, score, exported) tuples.
+    :raises Ambiguous: If there's no usable bytecode, or it needs a full
+        parse.
+    """
+    return code_symbols(load_bytecode(filename, source))
+
+
+def load_bytecode(filename, source):
+    """Load the module code object cached for filename.
+
+    The .pyc is only used if it was written by this interpreter and is
+    still valid for source, by the same rules the import system uses.
+
+    :raises Ambiguous: If there's no such .pyc, or it is stale.
+    """
+    if sys.version_info < (3, 7) or not isinstance(source, bytes):
+        raise Ambiguous('no bytecode cache for source')
+    try:
+        cached = cache_from_source(filename)
+    except (NotImplementedError, ValueError) as e:
+        raise Ambiguous('no bytecode cache: %s' % e)
+    try:
+        with open(cached, 'rb') as fd:
+            data = fd.read()
+        st = os.stat(filename)
+    except (IOError, OSError) as e:
+        raise Ambiguous('no bytecode: %s' % e)
+    if len(data) < 16 or data[:4] != MAGIC_NUMBER:
+        raise Ambiguous('bytecode is from another interpreter')
+    flags = struct.unpack('<I', data[4:8])[0]
+    if flags & 1:
+        if data[8:16] != source_hash(source):
+            raise Ambiguous('bytecode is stale')
+    else:
+        mtime, size = struct.unpack('<II', data[8:16])
+        if mtime != int(st.st_mtime) & 0xFFFFFFFF or size != st.st_size & 0xFFFFFFFF:
+            raise Ambiguous('bytecode is stale')
+    try:
+        return marshal.loads(data[16:])
+    except (EOFError, ValueError, TypeError) as e:
+        raise Ambiguous('bad bytecode: %s' % e)
+
+
+def code_symbols(code):
+    """Extract top-level symbols from a module code object.
+
+    :returns: A list of (name, score, exported) tuples.
+    :raises Ambiguous: If the module needs a full parse.
+    """
+    for const in code.co_consts:
+        # SymbolVisitor descends into the bodies of async functions.
+        if inspect.iscode(const) and const.co_flags & _ASYNC_FLAGS:
+            raise Ambiguous('async function')
+    instructions, index = _instructions(code)
+    opaque = _opaque(instructions, index)
+    symbols = []
+    # Whether the next store binds a target SymbolVisitor ignores, and the
+    # number of ignored stores left in a tuple unpacking.
+    binding = False
+    unpacking = 0
+    for i, instruction in enumerate(instructions):
+        opname = instruction.opname
+        if opname in _MATCH:
+            raise Ambiguous('match statement')
+        if opname == 'IMPORT_NAME' and not opaque[i]:
+            fromlist = instructions[i - 1].argval
+            if fromlist is None:
+                names = [instruction.argval]
+            else:
+                names = [name for name in fromlist if name != '*']
+            symbols.extend((name, 0.25, False) for name in names if not name.startswith('_'))
+        if opname.startswith('UNPACK_'):
+            if binding:
+                binding = False
+            elif unpacking:
+                unpacking -= 1
+            if opname == 'UNPACK_EX':
+                unpacking += (instruction.arg & 0xFF) + 1 + (instruction.arg >> 8)
+            else:
+                unpacking += instruction.arg
+            continue
+        if opname.startswith('STORE_'):
+            if binding:
+                binding = False
+                continue
+            if unpacking:
+                unpacking -= 1
+                continue
+            if opname not in ('STORE_NAME', 'STORE_GLOBAL') or opaque[i] or _is_ignored_store(instructions, i):
+                continue
+            name = instruction.argval
+            if name == '__all__':
+                symbols.extend((export, 1.2, True) for export in _exports(instructions, i))
+            elif not name.startswith('_'):
+                symbols.append((name, 1.1, False))
+            continue
+        if opname in _BINDING or _is_exception_match(instruction):
+            binding = True
+        elif binding and (opname in _BINDING_SKIPPED or _is_conditional_jump(opname)):
+            pass
+        else:
+            binding = False
+            unpacking += _rotated_targets(instructions, i)
+    return symbols
+
+
+def _is_ignored_store(instructions, i):
+    """Whether the store at i is an assignment SymbolVisitor ignores."""
+    previous = instructions[i - 1]
+    # x += 1
+    if previous.opname.startswith('INPLACE_') or \
+            (previous.opname == 'BINARY_OP' and previous.argrepr.endswith('=')):
+        return True
+    # type X = int
+    if previous.argrepr == 'INTRINSIC_TYPEALIAS':
+        return True
+    name = instructions[i].argval
+    following = instructions[i + 1] if i + 1 < len(instructions) else None
+    # if (x := f()): ..., which is the only way a store can be tested.
+    if following is not None and following.opname == 'TO_BOOL':
+        following = instructions[i + 2]
+    if following is not None and _is_conditional_jump(following.opname):
+        return True
+    # The "e = None; del e" that ends an "except ... as e" clause.
+    if following is not None and following.opname == 'DELETE_NAME' and following.argval == name:
+        return True
+    # x: int = 1, which stores the annotation once the value is stored.
+    for j in range(i + 1, len(instructions)):
+        if instructions[j].opname.startswith('STORE_'):
+            return instructions[j].opname == 'STORE_SUBSCR' and \
+                instructions[j - 1].argval == name and \
+                instructions[j - 2].argval == '__annotations__'
+    return False
+
+
+def _exports(instructions, i):
+    """The names in a list literal stored to __all__ at i."""
+    previous = instructions[i - 1]
+    if previous.opname == 'BUILD_LIST':
+        elements = instructions[i - 1 - previous.arg:i - 1] if previous.arg else []
+        if any(element.opname not in ('LOAD_CONST', 'LOAD_NAME') for element in elements):
+            raise Ambiguous('__all__ is not a list of names')
+        return [element.argval for element in elements
+                if element.opname == 'LOAD_CONST' and isinstance(element.argval, str)]
+    if previous.opname == 'LIST_EXTEND':
+        # Longer constant lists are built by extending an empty list with a tuple.
+        const, build = instructions[i - 2], instructions[i - 3]
+        if const.opname != 'LOAD_CONST' or build.opname != 'BUILD_LIST' or build.arg:
+            raise Ambiguous('__all__ is not a list of names')
+        return [name for name in const.argval if isinstance(name, str)]
+    if previous.opname == 'LIST_APPEND':
+        raise Ambiguous('__all__ is not a list of names')
+    # Not a list literal, so SymbolVisitor ignores it too.
+    return []
+
+
+def _rotated_targets(instructions, i):
+    """The number of targets assigned in "a, b = c, d" by the rotations at i."""
+    if _is_rotation(instructions[i - 1]):
+        return 0
+    count = 0
+    while True:
+        instruction = instructions[i]
+        if instruction.opname == 'SWAP':
+            count = max(count, instruction.arg)
+        elif instruction.opname in _ROTATIONS:
+            count = max(count, _ROTATIONS[instruction.opname])
+        else:
+            break
+        i += 1
+    # Comprehensions inlined into the module restore their variables with
+    # STORE_FAST.
+    if count and instruction.opname.startswith('STORE_') and instruction.opname != 'STORE_FAST':
+        return count
+    return 0
+
+
+def _is_rotation(instruction):
+    return instruction.opname == 'SWAP' or instruction.opname in _ROTATIONS
+
+
+def _is_conditional_jump(opname):
+    return 'JUMP' in opname and '_IF_' in opname
+
+
+def _is_exception_match(instruction):
+    return instruction.opname == 'COMPARE_OP' and instruction.argval == 'exception match'
+
+
+def _instructions(code):
+    """Disassemble code.
+
+    :returns: A tuple of (instructions without their EXTENDED_ARG prefixes, a
+        dict mapping each offset to the index of the instruction there).
+    """
+    instructions = []
+    index = {}
+    for instruction in dis.get_instructions(code):
+        index[instruction.offset] = len(instructions)
+        if instruction.opname != 'EXTENDED_ARG':
+            instructions.append(instruction)
+    return instructions, index
+
+
+def _opaque(instructions, index):
+    """Find the instructions inside if statements.
+
+    :returns: A list of booleans, one for each instruction.
+    """
+    opaque = [False] * len(instructions)
+    for i, instruction in enumerate(instructions):
+        if not _is_conditional_jump(instruction.opname) or instruction.opname == 'JUMP_IF_NOT_EXC_MATCH':
+            continue
+        previous = instructions[i - 1]
+        if previous.opname == 'CHECK_EXC_MATCH' or _is_exception_match(previous):
+            # Choosing an except clause, whose body SymbolVisitor visits.
+            continue
+        target = index.get(instruction.argval)
+        if target is None:
+            continue
+        if target > i:
+            end = target
+            # The test of a while loop, which is jumped back to from the end
+            # of the loop, or repeated there to jump back to its body. Jumps
+            # back to a for loop are continue statements, and unconditional
+            # ones back to the body are nested "while True" loops.
+            body = instructions[i + 1].offset
+            if any(jump.opcode in _JUMPS and jump.argval <= body and
+                   instructions[index.get(jump.argval, 0)].opname != 'FOR_ITER' and
+                   (jump.argval < body or _is_conditional_jump(jump.opname))
+                   for jump in instructions[i + 1:end]):
+                continue
+            # Skip the else clause too, which ends where the body jumps to,
+            # or where it ends the same way the body does when the body was
+            # the last thing in a loop or the module.
+            last = instructions[end - 1]
+            if last.opname in _UNCONDITIONAL_JUMPS and last.argval > instruction.argval:
+                end = index.get(last.argval, end)
+            elif last.opname in _UNCONDITIONAL_JUMPS or last.opname in _RETURNS:
+                for j in range(end, len(instructions)):
+                    if instructions[j].opname == last.opname and instructions[j].argval == last.argval:
+                        end = j
+                        break
+        else:
+            # An if statement in a loop body, whose test jumps straight back
+            # to the top of the loop, as does the end of its body.
+            end = None
+            for j in range(i + 1, len(instructions)):
+                if instructions[j].opname in _UNCONDITIONAL_JUMPS and \
+                        instructions[j].argval == instruction.argval:
+                    end = j
+                    break
+            if end is None:
+                continue
+        for j in range(i + 1, end):
+            opaque[j] = True
+    return opaque
@@ -0,0 +1,98 @@
+from __future__ import absolute_import
+
+import os
+import py_compile
+import sys
+from textwrap import dedent
+
+import pytest
+
+from importmagic.bytecode import bytecode_symbols
+from importmagic.index import DEFAULT_BLACKLIST_RE, SymbolIndex, extract_symbols
+from importmagic.index_test import NO_BLACKLIST_RE
+from importmagic.scanner import Ambiguous
+
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 7), reason='requires Python 3.7')
+
+
+def compiled(tmpdir, src):
+    module = tmpdir.join('mod.py')
+    module.write(src)
+    py_compile.compile(str(module), doraise=True)
+    with open(str(module), 'rb') as fd:
+        return str(module), fd.read()
+
+
+def test_bytecode_matches_symbol_visitor(tmpdir):
+    filename, source = compiled(tmpdir, dedent('''
+        import os.path, sys as system
+        import a.b.c as d
+        from . import (e, _f, g as h)
+        from i import *
+        __all__ = ['j', 'k', 'l', 'm']
+
+        def j(x=lambda y=1: y):
+            z = 2
+        @decorator
+        class K(object): pass
+        if condition:
+            n = 3
+        elif other:
+            o = 4
+        else:
+            p = 5
+        try:
+            import q
+        except ImportError as e:
+            q = None
+        for r in s:
+            if r:
+                continue
+        for r in s:
+            if r:
+                t = 6
+            rr = 6
+        while u:
+            v = 7
+        with w as x:
+            y = 8
+        z, aa = 9, 10
+        bb, (cc, dd) = ee
+        ff = gg = 11
+        ff += 12
+        ii = jj if kk else ll
+        hh: int = 13
+        '''))
+    assert set(bytecode_symbols(filename, source)) == set(extract_symbols(filename, source))
+
+
+def test_bytecode_is_ambiguous_when_stale(tmpdir):
+    filename, source = compiled(tmpdir, 'a = 1\n')
+    st = os.stat(filename)
+    os.utime(filename, (st.st_atime, st.st_mtime + 10))
+    with pytest.raises(Ambiguous):
+        bytecode_symbols(filename, source)
+
+
+def test_bytecode_matches_symbol_visitor_on_stdlib():
+    stdlib = os.path.dirname(os.__file__)
+    filenames = sorted(name for name in os.listdir(stdlib) if name.endswith('.py'))
+    for name in filenames[::10]:
+        filename = os.path.join(stdlib, name)
+        if DEFAULT_BLACKLIST_RE.search(filename):
+            continue
+        with open(filename, 'rb') as fd:
+            source = fd.read()
+        try:
+            symbols = bytecode_symbols(filename, source)
+        except Ambiguous:
+            continue
+        assert set(symbols) == set(extract_symbols(filename, source)), filename
+
+
+def test_index_with_bytecode_falls_back_to_ast(tmpdir):
+    tmpdir.join('mod.py').write('a = 1\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, scanner='bytecode')
+    tree.index_file('mod', str(tmpdir.join('mod.py')))
+    assert sorted(tree.find('mod')._tree) == ['a']
@@ -0,0 +1,414 @@
+"""Caches shared by every project on the machine."""
+
+import os
+import sys
+
+import hashlib
+import json
+import logging
+import platform
+import tempfile
+
+
+logger = logging.getLogger(__name__)
+
+INTERPRETER = '{}-{}.{}'.format(platform.python_implementation(),
+                                sys.version_info.major, sys.version_info.minor)
+
+
+def default_cache_dir():
+    """Return the per-user directory importmagic caches are stored in."""
+    if sys.platform == 'win32':
+        base = os.environ.get('LOCALAPPDATA') or os.path.expanduser('~')
+    elif sys.platform == 'darwin':
+        base = os.path.expanduser('~/Library/Caches')
+    else:
+        base = os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache')
+    return os.path.join(base, 'importmagic')
+
+
+def _write_json(filename, data):
+    """Atomically replace filename with data serialized as JSON."""
+    _write_file(filename, lambda fp: json.dump(data, fp))
+
+
+def _write_file(filename, write):
+    """Atomically replace filename with what write(fp) writes to fp."""
+    dir = os.path.dirname(filename)
+    if not os.path.isdir(dir):
+        os.makedirs(dir)
+    fd, tmp = tempfile.mkstemp(dir=dir, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as fp:
+            write(fp)
+        if os.path.exists(filename) and sys.platform == 'win32':
+            os.unlink(filename)
+        os.rename(tmp, filename)
+    except Exception:
+        os.unlink(tmp)
+        raise
+
+
+def _read_lines(fd):
+    with fd:
+        for line in fd:
+            yield json.loads(line)
+
+
+class SubtreeCache(object):
+    """Index subtrees built from whole search paths, shared between projects.
+
+    Entries are keyed by interpreter and path, and are only used while the
+    stamp they were stored with still matches. SymbolIndex stamps a path with
+    its directory's mtime, so installing or removing a package, which touches
+    site-packages, invalidates its entry.
+
+    Each entry is stored as a line of JSON per top-level package, so neither
+    building nor loading one holds more than a package at a time.
+
+    :param directory: Where to store entries. Defaults to a subdirectory of
+        default_cache_dir().
+    :param locations: Location codes of the search paths to cache.
+    :param refresh: Ignore existing entries, but still store new ones.
+    """
+
+    # Bump when the format of entries changes.
+    VERSION = 2
+
+    def __init__(self, directory=None, locations=('S', '3'), refresh=False):
+        self.directory = directory or os.path.join(default_cache_dir(), 'subtrees')
+        self.locations = frozenset(locations)
+        self.refresh = refresh
+
+    def holds(self, path, stamp):
+        """Whether there is an entry for path that is still current."""
+        fd = self._open(path, stamp)
+        if fd is None:
+            return False
+        fd.close()
+        return True
+
+    def load(self, path, stamp):
+        """Return an iterator over the cached top-level entries for path, or None.
+
+        Entries are read one line at a time, as they are iterated over.
+        """
+        fd = self._open(path, stamp)
+        if fd is None:
+            return None
+        return _read_lines(fd)
+
+    def store(self, path, stamp, lines):
+        """Store the index of path, given as lines of JSON, one per top-level entry."""
+        def write(fp):
+            fp.write(json.dumps({'path': path, 'stamp': stamp}) + '\n')
+            for line in lines:
+                fp.write(line)
+
+        try:
+            _write_file(self._filename(path), write)
+        except (IOError, OSError) as e:
+            logger.debug('failed to cache index for %s: %s', path, e)
+
+    def _open(self, path, stamp):
+        """Open the entry for path, positioned after its header, unless it is stale."""
+        if self.refresh:
+            return None
+        try:
+            fd = open(self._filename(path))
+        except (IOError, OSError):
+            return None
+        try:
+            header = json.loads(fd.readline())
+        except ValueError:
+            header = {}
+        if header.get('stamp') != stamp:
+            logger.debug('cached index for %s is stale', path)
+            fd.close()
+            return None
+        return fd
+
+    def _filename(self, path):
+        key = json.dumps([INTERPRETER, sys.executable, os.path.abspath(path)])
+        return os.path.join(self.directory, '%s-v%d.json' % (
+            hashlib.sha1(key.encode('utf-8')).hexdigest(), self.VERSION))
+
+
+class SubtreeStore(object):
+    """Index subtrees stored once each, under a hash of their content.
+
+    Virtualenvs tend to contain identical copies of the same packages. A
+    project index written with a store refers to the store's copy of each
+    of its large top-level entries in the given locations, rather than
+    containing them, and distributions installed from the same RECORD are
+    indexed only once between all environments.
+
+    Entries are never changed once written. prune() deletes the least
+    recently used ones once the store grows past max_size. That, or
+    deleting the store's directory, is safe, but makes the indexes that
+    refer to the deleted entries unreadable, so that they are rebuilt.
+
+    :param directory: Where to store entries. Defaults to a subdirectory of
+        default_cache_dir().
+    :param locations: Location codes of the top-level entries to store.
+    :param min_size: Entries smaller than this many bytes of JSON are kept
+        in the index itself.
+    :param max_size: How many bytes of entries prune() keeps, or 0 to keep
+        them all.
+    """
+
+    def __init__(self, directory=None, locations=('S', '3'), min_size=1024,
+                 max_size=1024 * 1024 * 1024):
+        self.directory = directory or os.path.join(default_cache_dir(), 'store')
+        self.locations = frozenset(locations)
+        self.min_size = min_size
+        self.max_size = max_size
+        # Digests of the entries read or written through this store, which
+        # prune() keeps.
+        self._used = set()
+
+    @staticmethod
+    def digest(text):
+        """Return the key text is stored under."""
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    def get(self, digest):
+        """Return the data stored under digest, or None."""
+        filename = self._filename(digest)
+        try:
+            with open(filename) as fd:
+                data = json.load(fd)
+        except (IOError, OSError, ValueError):
+            return None
+        self._use(digest, filename)
+        return data
+
+    def put(self, digest, text):
+        """Store text, a JSON document, under digest unless it is already there."""
+        filename = self._filename(digest)
+        if os.path.exists(filename):
+            self._use(digest, filename)
+            return
+        dir = os.path.dirname(filename)
+        try:
+            if not os.path.isdir(dir):
+                os.makedirs(dir)
+            fd, tmp = tempfile.mkstemp(dir=dir, suffix='.tmp')
+        except (IOError, OSError) as e:
+            logger.debug('failed to store subtree %s: %s', digest, e)
+            return
+        try:
+            with os.fdopen(fd, 'w') as fp:
+                fp.write(text)
+            # Another process may have stored the same content meanwhile,
+            # which on Windows makes the rename fail.
+            os.rename(tmp, filename)
+        except (IOError, OSError) as e:
+            logger.debug('failed to store subtree %s: %s', digest, e)
+            os.unlink(tmp)
+            return
+        self._used.add(digest)
+
+    def prune(self):
+        """Delete the least recently used entries until the store fits in max_size.
+
+        Entries this store has read or written are kept, as the index being
+        written may refer to them.
+
+        :returns: The number of entries deleted.
+        """
+        if not self.max_size:
+            return 0
+        total = 0
+        entries = []
+        for dir, _, filenames in os.walk(self.directory):
+            for name in filenames:
+                filename = os.path.join(dir, name)
+                try:
+                    st = os.stat(filename)
+                except OSError:
+                    continue
+                total += st.st_size
+                digest, ext = os.path.splitext(name)
+                if ext == '.json' and digest not in self._used:
+                    entries.append((st.st_mtime, st.st_size, filename))
+        deleted = 0
+        for _, size, filename in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.unlink(filename)
+            except OSError:
+                continue
+            total -= size
+            deleted += 1
+        if deleted:
+            logger.debug('pruned %d entries from the subtree store', deleted)
+        return deleted
+
+    def _use(self, digest, filename):
+        """Mark an entry as recently used, for prune()."""
+        self._used.add(digest)
+        try:
+            os.utime(filename, None)
+        except OSError:
+            pass
+
+    def _filename(self, digest):
+        return os.path.join(self.directory, digest[:2], digest + '.json')
+
+
+class SymbolCache(object):
+    """Symbols extracted from source files, keyed by a hash of their content.
+
+    Identical files are only ever parsed once, whether they are vendored
+    copies, the same package installed in several environments, or a file
+    that is unchanged since the last build. Entries are kept per interpreter,
+    since what parses depends on it, and the least recently used entries are
+    evicted once there are more than max_entries.
+
+    Entries are loaded on first use and written back by save().
+
+    :param directory: Where to store entries. Defaults to a subdirectory of
+        default_cache_dir().
+    :param max_entries: Maximum number of entries to keep.
+    """
+
+    # Bump when the format of extracted symbols, or what a scanner extracts,
+    # changes.
+    VERSION = 2
+
+    def __init__(self, directory=None, max_entries=50000):
+        self.directory = directory or os.path.join(default_cache_dir(), 'symbols')
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = None
+        self._clock = 0
+        self._dirty = False
+
+    def get(self, key, default=None):
+        entry = self._load().get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        self._clock += 1
+        entry[0] = self._clock
+        self._dirty = True
+        return entry[1]
+
+    def put(self, key, symbols):
+        self._clock += 1
+        self._load()[key] = [self._clock, symbols]
+        self._dirty = True
+
+    def save(self):
+        """Write entries back, evicting the least recently used."""
+        if not self._dirty:
+            return
+        entries = self._entries
+        if len(entries) > self.max_entries:
+            keep = sorted(entries, key=lambda key: entries[key][0])[-self.max_entries:]
+            entries = dict((key, entries[key]) for key in keep)
+            self._entries = entries
+        try:
+            _write_json(self._filename(), entries)
+        except (IOError, OSError) as e:
+            logger.debug('failed to save symbol cache: %s', e)
+            return
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self._filename()) as fd:
+                    self._entries = json.load(fd)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+            self._clock = max([entry[0] for entry in self._entries.values()] or [0])
+        return self._entries
+
+    def _filename(self):
+        return os.path.join(self.directory, '%s-v%d.json' % (INTERPRETER, self.VERSION))
+
+
+class Quarantine(object):
+    """Modules that are too big, too slow or impossible to parse.
+
+    Builds skip a quarantined file without reading it, for as long as its
+    mtime and size are the ones it was quarantined with. Like a SymbolCache,
+    entries are kept per interpreter, loaded on first use and written back
+    by save().
+
+    Parsing can't be interrupted, so a file that goes over max_seconds is
+    still indexed by the build that finds it, and skipped by later ones.
+
+    :param directory: Where to store entries. Defaults to a subdirectory of
+        default_cache_dir().
+    :param max_size: Files larger than this many bytes are quarantined
+        without being read.
+    :param max_seconds: Files that take longer than this to extract symbols
+        from are quarantined.
+    """
+
+    VERSION = 1
+
+    def __init__(self, directory=None, max_size=2 * 1024 * 1024, max_seconds=2.0):
+        self.directory = directory or os.path.join(default_cache_dir(), 'quarantine')
+        self.max_size = max_size
+        self.max_seconds = max_seconds
+        self._entries = None
+        self._dirty = False
+
+    def holds(self, filename, stamp):
+        """Whether filename, with stamp [mtime, size], is quarantined.
+
+        Files over max_size are quarantined as a side effect, and stale
+        entries are dropped.
+        """
+        entries = self._load()
+        entry = entries.get(filename)
+        if entry is not None:
+            if entry[0] == stamp:
+                return True
+            del entries[filename]
+            self._dirty = True
+        if self.max_size and stamp[1] > self.max_size:
+            self.add(filename, stamp, 'larger than %d bytes' % self.max_size)
+            return True
+        return False
+
+    def check(self, filename, stamp, symbols, seconds):
+        """Quarantine filename if it failed to parse or took too long."""
+        if symbols is None:
+            self.add(filename, stamp, 'failed to parse')
+        elif self.max_seconds and seconds > self.max_seconds:
+            self.add(filename, stamp, 'took %.1fs to parse' % seconds)
+
+    def add(self, filename, stamp, reason):
+        logger.debug('quarantining %s, which %s', filename, reason)
+        self._load()[filename] = [list(stamp), reason]
+        self._dirty = True
+
+    def save(self):
+        if not self._dirty:
+            return
+        try:
+            _write_json(self._filename(), self._entries)
+        except (IOError, OSError) as e:
+            logger.debug('failed to save quarantine: %s', e)
+            return
+        self._dirty = False
+
+    def _load(self):
+        if self._entries is None:
+            try:
+                with open(self._filename()) as fd:
+                    self._entries = json.load(fd)
+            except (IOError, OSError, ValueError):
+                self._entries = {}
+        return self._entries
+
+    def _filename(self):
+        return os.path.join(self.directory, '%s-v%d.json' % (INTERPRETER, self.VERSION))
@@ -0,0 +1,327 @@
+import json
+import os
+import re
+import zipfile
+
+import pytest
+
+import importmagic.index
+from importmagic.cache import Quarantine, SubtreeCache, SubtreeStore, SymbolCache
+from importmagic.index import SymbolIndex
+from importmagic.index_test import make_distribution
+from importmagic.report import BuildReport
+from importmagic.six import StringIO
+
+
+NO_BLACKLIST_RE = re.compile('^$')
+
+
+@pytest.fixture
+def site(tmpdir):
+    site = tmpdir.mkdir('site')
+    pkg = site.mkdir('pkg')
+    pkg.join('__init__.py').write('class Cls:\n pass\n')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    return site
+
+
+def build(paths, cache):
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index(paths, cache=cache)
+    return tree
+
+
+def test_subtree_cache_skips_parsing_cached_paths(tmpdir, site, monkeypatch):
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+    first = build([str(site)], cache)
+    assert first.find('pkg.mod') is not None
+
+    def fail(filename):
+        raise AssertionError('parsed %s' % filename)
+
+    monkeypatch.setattr(importmagic.index, '_extract_file_symbols', fail)
+    second = build([str(site)], cache)
+    assert second.serialize() == first.serialize()
+
+
+def test_subtree_cache_rebuilds_stale_paths(tmpdir, site):
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+    build([str(site)], cache)
+    site.join('new.py').write('def added():\n pass\n')
+    assert build([str(site)], cache).find('new') is not None
+
+
+def test_subtree_cache_keys_paths_on_build_options(tmpdir, site):
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+    site.join('pkg', 'sub').mkdir().join('__init__.py').write('def deepfunc():\n pass\n')
+    lazy = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, lazy=True)
+    lazy.build_index([str(site)], cache=cache)
+    eager = build([str(site)], cache)
+    assert eager.find('pkg')._tree['sub']._unexpanded is None
+    assert eager.symbol_scores('deepfunc')
+
+
+def test_subtree_cache_stores_a_line_per_package(tmpdir, site):
+    site.join('other.py').write('value = 1\n')
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+    expected = build([str(site)], None)
+    # The first build stores the entry, the second loads it.
+    for _ in range(2):
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+        spill = StringIO()
+        report = BuildReport(top=1000)
+        tree.build_index([str(site)], cache=cache, spill=spill, report=report)
+        assert tree.find('pkg') is None
+        assert [name for _, name in report.largest_subtrees].count('pkg') == 1
+        loaded = SymbolIndex.deserialize(StringIO(spill.getvalue()), NO_BLACKLIST_RE)
+        assert json.loads(loaded.serialize()) == json.loads(expected.serialize())
+    entries = cache.load(str(site), tree._path_stamp(str(site)))
+    lines = [list(entry) for entry in entries]
+    assert ['pkg'] in lines and ['other'] in lines
+
+
+def test_symbol_cache_skips_parsing_known_content(tmpdir, site, monkeypatch):
+    site.join('copy.py').write('def func():\n pass\n')
+    cache = SymbolCache(str(tmpdir.join('cache')))
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(site)], symbol_cache=cache)
+    # pkg/mod.py and copy.py have the same content.
+    assert cache.hits == 1
+
+    def fail(filename, *args):
+        raise AssertionError('parsed %s' % filename)
+
+    monkeypatch.setattr(importmagic.index, 'extract_symbols', fail)
+    second = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    second.build_index([str(site)], symbol_cache=SymbolCache(str(tmpdir.join('cache'))))
+    assert second.serialize() == tree.serialize()
+
+
+def test_symbol_cache_evicts_least_recently_used(tmpdir):
+    cache = SymbolCache(str(tmpdir), max_entries=2)
+    cache.put('a', [])
+    cache.put('b', [])
+    cache.put('c', None)
+    cache.get('a')
+    cache.save()
+    cache = SymbolCache(str(tmpdir), max_entries=2)
+    assert cache.get('a') == []
+    assert cache.get('b', 'missing') == 'missing'
+    assert cache.get('c', 'missing') is None
+
+
+def test_subtree_cache_keys_archives_on_their_stamp(tmpdir, monkeypatch):
+    wheel = str(tmpdir.join('dist-1.0-py2.py3-none-any.whl'))
+    with zipfile.ZipFile(wheel, 'w') as archive:
+        archive.writestr('pkg/__init__.py', 'class Cls:\n pass\n')
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=())
+    first = build([wheel], cache)
+    assert first.find('pkg') is not None
+
+    def fail(path):
+        raise AssertionError('opened %s' % path)
+
+    monkeypatch.setattr(importmagic.index, 'ZipArchive', fail)
+    assert build([wheel], cache).serialize() == first.serialize()
+
+
+def test_subtree_cache_keys_distributions_on_name_and_version(tmpdir, monkeypatch):
+    site = tmpdir.mkdir('site')
+    make_distribution(site, 'first', ['first.py'])
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+
+    def build_site():
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, metadata=True)
+        tree.build_index([str(site)], cache=cache)
+        return tree
+
+    build_site()
+    # Installing a distribution invalidates the whole directory, but the
+    # distributions that were already installed are still cached.
+    make_distribution(site, 'second', ['second.py'])
+    parsed = []
+    extract = importmagic.index._extract_file_symbols
+
+    def record(filename, *args):
+        parsed.append(filename)
+        return extract(filename, *args)
+
+    monkeypatch.setattr(importmagic.index, '_extract_file_symbols', record)
+    tree = build_site()
+    assert parsed == [str(site.join('second.py'))]
+    assert tree.find('first') is not None
+
+
+def test_quarantine_skips_files_until_they_change(tmpdir, site, monkeypatch):
+    site.join('broken.py').write('def func(:\n')
+    site.join('huge.py').write('table = [%s]\n' % ', '.join(['1'] * 1000))
+    directory = str(tmpdir.join('quarantine'))
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(site)], quarantine=Quarantine(directory, max_size=1000))
+    assert tree.find('huge') is None
+
+    parsed = []
+    extract = importmagic.index._extract_file_symbols
+
+    def record(filename, *args):
+        parsed.append(filename)
+        return extract(filename, *args)
+
+    monkeypatch.setattr(importmagic.index, '_extract_file_symbols', record)
+    site.join('broken.py').write('def func():\n pass\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(site)], quarantine=Quarantine(directory, max_size=1000))
+    assert str(site.join('huge.py')) not in parsed
+    assert tree.find('broken') is not None
+    # Incremental updates leave quarantined files alone too.
+    del parsed[:]
+    assert tree.update_index([str(site)]) == 0
+    assert parsed == []
+
+
+def without_mtimes(tree):
+    data = json.loads(tree.serialize())
+    data['.fingerprints'] = dict((filename, fingerprint[:1] + fingerprint[2:])
+                                 for filename, fingerprint in data['.fingerprints'].items())
+    return data
+
+
+def test_subtree_store_shares_identical_subtrees(tmpdir):
+    store = SubtreeStore(str(tmpdir.join('store')), min_size=0)
+    written = []
+    for env in ('one', 'two'):
+        site = tmpdir.mkdir(env).mkdir('site-packages')
+        site.join('shared.py').write('def func():\n pass\n')
+        site.join('%s.py' % env).write('%s = 1\n' % env)
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, store=store)
+        tree.build_index([str(site)])
+        fd = StringIO()
+        tree.serialize(fd)
+        written.append((tree, fd.getvalue()))
+    refs = [dict((name, value['.ref']) for line in text.splitlines()[1:]
+                 for name, value in json.loads(line).items() if '.ref' in value)
+            for _, text in written]
+    assert refs[0]['shared'] == refs[1]['shared']
+    assert refs[0]['one'] != refs[1]['two']
+    # Fingerprints are stored with their entries, relative to the search path.
+    assert '".fingerprints"' not in written[1][1]
+    assert list(store.get(refs[1]['shared'])['.fingerprints']) == ['shared.py']
+    for tree, text in written:
+        loaded = SymbolIndex.deserialize(StringIO(text), NO_BLACKLIST_RE, store)
+        # A shared entry has the mtimes of the files it was stored from.
+        assert without_mtimes(loaded) == without_mtimes(tree)
+    with pytest.raises(ValueError):
+        SymbolIndex.deserialize(StringIO(written[0][1]), NO_BLACKLIST_RE)
+
+
+def test_subtree_store_keeps_fingerprints_of_copied_entries(tmpdir):
+    store = SubtreeStore(str(tmpdir.join('store')), min_size=0)
+    site = tmpdir.mkdir('site-packages')
+    site.join('one.py').write('def one():\n pass\n')
+    site.join('two.py').write('def two():\n pass\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, store=store)
+    tree.build_index([str(site)])
+    old = StringIO()
+    tree.serialize(old)
+    site.join('two.py').write('def changed():\n pass\n')
+    tree.update_index([str(site)])
+    new = StringIO()
+    tree.rewrite(StringIO(old.getvalue()), new, tree.take_touched())
+    assert '".fingerprints"' not in new.getvalue()
+    loaded = SymbolIndex.deserialize(StringIO(new.getvalue()), NO_BLACKLIST_RE, store)
+    assert loaded._fingerprints == tree._fingerprints
+    assert loaded.symbol_scores('changed')
+
+
+def test_subtree_store_shares_lazy_packages(tmpdir):
+    store = SubtreeStore(str(tmpdir.join('store')), min_size=0)
+    refs = []
+    for env in ('one', 'two'):
+        site = tmpdir.mkdir(env).mkdir('site-packages')
+        site.mkdir('pkg').join('__init__.py').write('')
+        site.join('pkg').mkdir('sub').join('__init__.py').write('def deep():\n pass\n')
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, lazy=True, store=store)
+        tree.build_index([str(site)])
+        fd = StringIO()
+        tree.serialize(fd)
+        loaded = SymbolIndex.deserialize(StringIO(fd.getvalue()), NO_BLACKLIST_RE, store)
+        assert loaded.find('pkg')._tree['sub']._unexpanded == str(site.join('pkg', 'sub'))
+        refs.extend(json.loads(line)['pkg'] for line in fd.getvalue().splitlines()
+                    if line.startswith('{"pkg"'))
+    assert refs[0]['.ref'] == refs[1]['.ref']
+
+
+def test_subtree_store_takes_fingerprints_of_cached_paths(tmpdir, site):
+    cache = SubtreeCache(str(tmpdir.join('cache')), locations=('L',))
+    store = SubtreeStore(str(tmpdir.join('store')), locations=('L',), min_size=0)
+    # The first build stores the cache entry, the second loads it.
+    for _ in range(2):
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, store=store)
+        spill = StringIO()
+        tree.build_index([str(site)], cache=cache, spill=spill)
+        assert 'mod.py' not in ''.join(line for line in spill.getvalue().splitlines()
+                                       if line.startswith('{".fingerprints"'))
+        loaded = SymbolIndex.deserialize(StringIO(spill.getvalue()), NO_BLACKLIST_RE, store)
+        assert str(site.join('pkg', 'mod.py')) in loaded._fingerprints
+
+
+def test_subtree_store_prunes_least_recently_used(tmpdir):
+    store = SubtreeStore(str(tmpdir), max_size=25)
+    for digest in ('a', 'b', 'c'):
+        store.put(digest, '"%s"' % ('x' * 8))
+    # Entries this store used are kept, however big.
+    assert store.prune() == 0
+    store = SubtreeStore(str(tmpdir), max_size=25)
+    os.utime(store._filename('a'), (0, 0))
+    store.get('c')
+    assert store.prune() == 1
+    assert store.get('a') is None
+    assert store.get('b') == 'x' * 8
+
+
+def test_subtree_store_indexes_identical_distributions_once(tmpdir, monkeypatch):
+    store = SubtreeStore(str(tmpdir.join('store')))
+    sites = []
+    for env in ('one', 'two'):
+        site = tmpdir.mkdir(env).mkdir('site')
+        make_distribution(site, 'dist', ['dist.py'])
+        site.join('dist-1.0.dist-info', 'RECORD').write(
+            'dist.py,sha256=abc,20\ndist-1.0.dist-info/RECORD,,\n')
+        sites.append(site)
+    parsed = []
+    extract = importmagic.index._extract_file_symbols
+
+    def record(filename, *args):
+        parsed.append(filename)
+        return extract(filename, *args)
+
+    monkeypatch.setattr(importmagic.index, '_extract_file_symbols', record)
+    trees = []
+    for site in sites:
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, metadata=True, store=store)
+        tree.build_index([str(site)])
+        trees.append(tree)
+    assert parsed == [str(sites[0].join('dist.py'))]
+    assert sorted(trees[1].find('dist')._tree) == ['dist']
+    assert list(trees[1]._fingerprints) == [str(sites[1].join('dist.py'))]
+
+
+def test_subtree_store_keeps_distributions_in_their_own_directory(tmpdir):
+    store = SubtreeStore(str(tmpdir.join('store')))
+    files = ['pkg/__init__.py', 'pkg/sub/__init__.py', 'pkg/sub/deep.py']
+
+    def build_site(env, lazy):
+        site = tmpdir.mkdir(env).mkdir('site')
+        make_distribution(site, 'dist', files)
+        site.join('dist-1.0.dist-info', 'RECORD').write(
+            ''.join('%s,sha256=%d,20\n' % (path, i) for i, path in enumerate(files)))
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, metadata=True, lazy=lazy, store=store)
+        tree.build_index([str(site)])
+        return site, tree
+
+    build_site('lazy', True)
+    _, eager = build_site('eager', False)
+    assert eager.find('pkg.sub')._unexpanded is None
+    assert eager.symbol_scores('pkg_sub_deep')
+    site, lazy = build_site('other', True)
+    assert lazy.find('pkg')._tree['sub']._unexpanded == str(site.join('pkg', 'sub'))
@@ -0,0 +1,134 @@
+"""Find the modules installed by distributions from their metadata.
+
+Installers record every file they install in the distribution's
+.dist-info/RECORD. Listing modules from there rather than walking the
+directories they were installed into skips data files, documentation and
+anything else that can't be imported, without having to stat or list it.
+"""
+
+import os
+
+import csv
+import hashlib
+import json
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+MODULE_EXTENSIONS = ('.py', '.pyi', '.so', '.pyd', '.dll')
+
+
+class Distribution(object):
+    """The module files of one installed distribution.
+
+    :ivar key: The name of its .dist-info directory without the extension,
+        which is the distribution's name and version.
+    :ivar files: Paths of its module files, relative to the directory it was
+        installed into.
+    :ivar digest: A hash of the paths and content hashes its RECORD lists
+        for its module files, which is the same wherever it is installed, or
+        None if the RECORD doesn't hash them all.
+    """
+
+    def __init__(self, key, files, digest=None):
+        self.key = key
+        self.files = files
+        self.digest = digest
+
+    @property
+    def top_level(self):
+        """Names of the entries it installed directly into the directory."""
+        return set(path.split(os.path.sep, 1)[0] for path in self.files)
+
+    @classmethod
+    def read(cls, dir, dist_info):
+        """Read a distribution's metadata.
+
+        :returns: A Distribution, or None if it has no readable RECORD.
+        """
+        metadata = os.path.join(dir, dist_info)
+        try:
+            with open(os.path.join(metadata, 'RECORD')) as fd:
+                rows = list(csv.reader(fd))
+        except (IOError, OSError, csv.Error) as e:
+            logger.debug('failed to read RECORD of %s: %s', dist_info, e)
+            return None
+        top_level = None
+        try:
+            with open(os.path.join(metadata, 'top_level.txt')) as fd:
+                top_level = set(line.strip() for line in fd if line.strip())
+        except (IOError, OSError):
+            pass
+        files = []
+        hashes = []
+        for row in rows:
+            if not row:
+                continue
+            parts = row[0].split('/')
+            if '..' in parts or os.path.isabs(row[0]) or '__pycache__' in parts:
+                continue
+            if os.path.splitext(parts[-1])[1].lower() not in MODULE_EXTENSIONS:
+                continue
+            if top_level is not None and parts[0].split('.', 1)[0] not in top_level:
+                continue
+            files.append(os.path.join(*parts))
+            hashes.append([row[0], row[1] if len(row) > 1 else ''])
+        digest = None
+        if all(hash for _, hash in hashes):
+            digest = hashlib.sha1(json.dumps(sorted(hashes)).encode('utf-8')).hexdigest()
+        return cls(os.path.splitext(dist_info)[0], files, digest)
+
+
+def read_distributions(dir, names):
+    """Read the distributions installed into dir.
+
+    :param names: The names of the entries in dir.
+    :returns: A list of Distribution.
+    """
+    distributions = []
+    for name in names:
+        if name.endswith('.dist-info'):
+            distribution = Distribution.read(dir, name)
+            if distribution is not None:
+                distributions.append(distribution)
+    return distributions
+
+
+class DistributionListing(object):
+    """Directory listings of the module files owned by distributions.
+
+    Only directories that hold a distribution's modules are covered. Each
+    lists just the module files and subdirectories the distributions
+    recorded, in the same (name, path, is_dir, is_file) form as
+    index._scan().
+    """
+
+    def __init__(self, dir, distributions):
+        self._dirs = {}
+        self._files = set()
+        for distribution in distributions:
+            for file in distribution.files:
+                parent = dir
+                parts = file.split(os.path.sep)
+                for i, part in enumerate(parts):
+                    path = os.path.join(parent, part)
+                    if i == len(parts) - 1:
+                        if path not in self._files:
+                            self._files.add(path)
+                            self._dirs.setdefault(parent, []).append((part, path, False, True))
+                    elif path not in self._dirs:
+                        self._dirs[path] = []
+                        self._dirs.setdefault(parent, []).append((part, path, True, False))
+                    parent = path
+        # The installation directory itself is still listed for real.
+        self._dirs.pop(dir, None)
+
+    def covers(self, dir):
+        return dir in self._dirs
+
+    def scan(self, dir):
+        return list(self._dirs[dir])
+
+    def isfile(self, path):
+        return path in self._files
@@ -0,0 +1,120 @@
+"""Recognise modules written by code generators, without parsing them.
+
+Protocol buffer and gRPC stubs, SWIG wrappers and Django migrations are
+often a large share of a tree's modules while rarely being imported from
+directly. They are recognised by their filename, or by the marker their
+generator writes near the top of the file.
+"""
+
+import ast
+import re
+
+
+# How much of the start of a file is searched for markers.
+SNIFF_BYTES = 512
+GENERATED_MARKERS_RE = re.compile(br'''
+    Generated\ by\ the\ protocol\ buffer\ compiler
+    | Generated\ by\ the\ gRPC\ Python\ protocol\ compiler
+    | This\ file\ was\ automatically\ generated\ by\ SWIG
+    | ^\#\ Generated\ by\ Django\ \d
+    | @generated\b
+''', re.VERBOSE | re.MULTILINE)
+GENERATED_FILENAME_RE = re.compile(r'_pb2(?:_grpc)?\.pyi?$|[\\/]migrations[\\/]\d{4}_\w+\.py$')
+
+# What to do with a generated module: index it like any other, only index
+# its __all__ or, failing that, the public names it defines at the top level,
+# or leave it out.
+GENERATED_POLICIES = ('index', 'exports', 'skip')
+# Policies by location. Project code is indexed as usual, since its
+# generated modules are the ones most likely to be imported from.
+DEFAULT_GENERATED = {'L': 'index', 'S': 'exports', '3': 'exports'}
+
+_DEFINITION_RE = re.compile(r'^(?:(?:class|def)[ \t]+([^\W\d]\w*)|([^\W\d]\w*)[ \t]*=(?!=))',
+                            re.MULTILINE | re.UNICODE)
+# Current protoc output creates its messages at import time from a
+# serialized FileDescriptorProto, so their names are only found in there.
+_SERIALIZED_FILE_RE = re.compile(br'''AddSerializedFile\(\s*(b'(?:[^'\\]|\\.)*'|b"(?:[^"\\]|\\.)*")''')
+# FileDescriptorProto's message_type and enum_type fields, and the name and
+# value fields of their messages.
+_MESSAGE_TYPE, _ENUM_TYPE, _NAME, _ENUM_VALUE = 4, 5, 1, 2
+
+
+def is_generated(filename, source):
+    """Whether filename, with source as bytes, is a generated module."""
+    return bool(GENERATED_FILENAME_RE.search(filename) or
+                GENERATED_MARKERS_RE.search(source[:SNIFF_BYTES]))
+
+
+def public_names(source):
+    """Find the public names source defines at the top level, without parsing it.
+
+    That is classes, functions and assignments, and the messages and enums
+    of protocol buffer modules, whose names are only in their serialized
+    descriptor.
+
+    :param source: Python source, as bytes.
+    :returns: A list of (name, score, exported) tuples, as extract_symbols()
+        returns.
+    """
+    text = source.decode('utf-8', 'replace')
+    names = [definition or assignment for definition, assignment in _DEFINITION_RE.findall(text)]
+    for literal in _SERIALIZED_FILE_RE.findall(source):
+        names.extend(_descriptor_names(literal))
+    seen = set()
+    symbols = []
+    for name in names:
+        if not name.startswith('_') and name not in seen:
+            seen.add(name)
+            symbols.append((name, 1.1, False))
+    return symbols
+
+
+def _descriptor_names(literal):
+    """Return the names of the top-level messages, enums and enum values of a serialized file."""
+    try:
+        serialized = ast.literal_eval(literal.decode('latin-1'))
+        names = []
+        for field, value in _fields(serialized):
+            if field not in (_MESSAGE_TYPE, _ENUM_TYPE):
+                continue
+            for subfield, subvalue in _fields(value):
+                if subfield == _NAME:
+                    names.append(subvalue.decode('utf-8'))
+                elif subfield == _ENUM_VALUE and field == _ENUM_TYPE:
+                    names.extend(name.decode('utf-8') for number, name in _fields(subvalue)
+                                 if number == _NAME)
+        return names
+    except (ValueError, SyntaxError, IndexError, UnicodeDecodeError):
+        return []
+
+
+def _fields(message):
+    """Yield (field number, bytes) for the length-delimited fields of a protocol buffer message."""
+    data = bytearray(message)
+    i = 0
+    while i < len(data):
+        key, i = _varint(data, i)
+        wire_type = key & 7
+        if wire_type == 0:
+            _, i = _varint(data, i)
+        elif wire_type == 1:
+            i += 8
+        elif wire_type == 2:
+            length, i = _varint(data, i)
+            yield key >> 3, bytes(data[i:i + length])
+            i += length
+        elif wire_type == 5:
+            i += 4
+        else:
+            raise ValueError('unsupported wire type %d' % wire_type)
+
+
+def _varint(data, i):
+    value = shift = 0
+    while True:
+        byte = data[i]
+        value |= (byte & 0x7f) << shift
+        i += 1
+        if not byte & 0x80:
+            return value, i
+        shift += 7
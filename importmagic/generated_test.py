@@ -0,0 +1,113 @@
+from __future__ import absolute_import
+
+import pytest
+
+from importmagic.generated import is_generated, public_names
+from importmagic.index import SymbolIndex
+from importmagic.index_test import NO_BLACKLIST_RE
+
+
+# As written by protoc 3.20 and later, which creates messages and enums at
+# import time.
+PB2 = br'''# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: service.proto
+"""Generated protocol buffer code."""
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rservice.proto\"\"\n\x07Request\x12\x17\n\x07user_id\x18\x01 \x01(\tR\x06userId*\x10\n\x05\x43olor\x12\x07\n\x03RED\x10\x00\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'service_pb2', _globals)
+if _descriptor._USE_C_DESCRIPTORS == False:
+  DESCRIPTOR._options = None
+  _globals['_COLOR']._serialized_start=52
+  _globals['_COLOR']._serialized_end=70
+  _globals['_REQUEST']._serialized_start=23
+  _globals['_REQUEST']._serialized_end=50
+# @@protoc_insertion_point(module_scope)
+'''
+# As written by earlier versions of protoc.
+OLD_PB2 = b'''# Generated by the protocol buffer compiler.  DO NOT EDIT!
+from google.protobuf import reflection as _reflection
+from google.protobuf.internal import enum_type_wrapper
+
+_COLOR = _descriptor.EnumDescriptor(name='Color', full_name='Color')
+Color = enum_type_wrapper.EnumTypeWrapper(_COLOR)
+RED = 0
+
+_REQUEST = _descriptor.Descriptor(name='Request', full_name='Request')
+Request = _reflection.GeneratedProtocolMessageType('Request', (_message.Message,), {
+  'DESCRIPTOR' : _REQUEST,
+  '__module__' : 'service_pb2'
+  })
+_sym_db.RegisterMessage(Request)
+'''
+
+
+def test_is_generated():
+    assert is_generated('/src/service_pb2.py', b'')
+    assert is_generated('/src/app/migrations/0001_initial.py', b'')
+    assert is_generated('/src/wrapper.py', PB2)
+    assert is_generated('/src/wrapper.py', b'# This file was automatically generated by SWIG\n')
+    assert not is_generated('/src/migrations/helpers.py', b'# This file is not generated\n')
+    # Markers past the first few hundred bytes don't count.
+    assert not is_generated('/src/wrapper.py', b'\n' * 1024 + PB2)
+
+
+def test_public_names():
+    names = ['DESCRIPTOR', 'Request', 'Color', 'RED']
+    assert public_names(PB2) == [(name, 1.1, False) for name in names]
+    assert sorted(name for name, _, _ in public_names(OLD_PB2)) == ['Color', 'RED', 'Request']
+    assert public_names(b'class Migration(migrations.Migration):\n    pass\n'
+                        b'def _private():\n    pass\nif a == b:\n    pass\n') == [
+        ('Migration', 1.1, False)]
+
+
+@pytest.mark.parametrize('processes', [0, 2])
+def test_index_applies_generated_policy_by_location(tmpdir, processes, monkeypatch):
+    site = tmpdir.mkdir('site-packages')
+    site.join('service.py').write_binary(PB2)
+    site.join('exported.py').write_binary(PB2 + b"__all__ = ['DESCRIPTOR']\n")
+    project = tmpdir.mkdir('project')
+    project.join('local.py').write_binary(PB2)
+    project.join('skipped.py').write_binary(PB2)
+
+    determine = SymbolIndex._determine_location_for
+    classified = []
+
+    def determine_location_for(self, path):
+        classified.append(path)
+        return determine(self, path)
+
+    monkeypatch.setattr(SymbolIndex, '_determine_location_for', determine_location_for)
+
+    def build(generated):
+        tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, generated=generated)
+        tree.build_index([str(project), str(site)], processes=processes)
+        # Policies follow the location of the directory being walked.
+        assert not [path for path in classified if path.endswith('.py')]
+        return tree
+
+    tree = build({'L': 'index', '3': 'exports'})
+    assert sorted(tree.find('service')._tree) == ['Color', 'DESCRIPTOR', 'RED', 'Request']
+    assert sorted(tree.find('exported')._tree) == ['DESCRIPTOR']
+    local = ['DESCRIPTOR', 'builder', 'descriptor', 'descriptor_pool', 'symbol_database']
+    assert sorted(tree.find('local')._tree) == local
+    tree = build({'L': 'skip'})
+    assert tree.find('local') is None
+    assert tree.find('skipped') is None
+    assert sorted(tree.find('service')._tree) == local
+
+
+def test_index_rejects_unknown_generated_policy():
+    with pytest.raises(ValueError):
+        SymbolIndex(generated={'L': 'ignore'})
@@ -0,0 +1,128 @@
+"""Decide which directories and files to leave out of an index.
+
+Rules follow .gitignore syntax: a pattern without a slash matches a name at
+any depth, one with a slash is anchored to the directory it was read from,
+a trailing slash only matches directories, "**" matches any number of
+directories and a leading "!" re-includes what an earlier pattern excluded.
+The last matching pattern wins, and patterns from a subdirectory's ignore
+files take precedence over those of its parents.
+"""
+
+import os
+
+import logging
+import re
+
+
+logger = logging.getLogger(__name__)
+
+# Directories that never hold importable project code.
+DEFAULT_EXCLUDES = (
+    '.git/', '.hg/', '.svn/', '.tox/', '.nox/', '.venv/', 'venv/', 'node_modules/',
+    '__pycache__/', 'build/', 'dist/', '*.egg-info/',
+)
+# Files rules are read from in every directory that is walked.
+IGNORE_FILES = ('.gitignore', '.ignore')
+
+
+class IgnoreRules(object):
+    """The exclude patterns in effect in one directory.
+
+    :param dir: The directory anchored patterns are relative to.
+    :param patterns: Patterns in .gitignore syntax.
+    :param parent: The rules of an enclosing directory, which are checked
+        first.
+    """
+
+    def __init__(self, dir, patterns=(), parent=None):
+        self.dir = dir
+        self.parent = parent
+        self._rules = [rule for rule in map(_compile, patterns) if rule is not None]
+
+    def enter(self, dir, names):
+        """Return the rules in effect in a subdirectory.
+
+        :param names: The names of the entries in dir, which are checked for
+            ignore files without any further filesystem calls.
+        """
+        patterns = []
+        for name in IGNORE_FILES:
+            if name in names:
+                try:
+                    with open(os.path.join(dir, name)) as fd:
+                        patterns.extend(fd.read().splitlines())
+                except (IOError, OSError, UnicodeDecodeError) as e:
+                    logger.debug('failed to read %s: %s', os.path.join(dir, name), e)
+        if not patterns:
+            return self
+        return IgnoreRules(dir, patterns, self)
+
+    def is_excluded(self, path, is_dir):
+        """Whether path, inside dir or one of its subdirectories, is excluded."""
+        excluded = False
+        if self.parent is not None:
+            excluded = self.parent.is_excluded(path, is_dir)
+        relative = path[len(self.dir):].lstrip(os.path.sep).replace(os.path.sep, '/')
+        name = relative.rsplit('/', 1)[-1]
+        for negated, dir_only, anchored, regex in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if regex.match(relative if anchored else name):
+                excluded = not negated
+        return excluded
+
+
+def _compile(pattern):
+    """:returns: A tuple of (negated, dir_only, anchored, regex), or None."""
+    pattern = pattern.rstrip()
+    if not pattern or pattern.startswith('#'):
+        return None
+    negated = pattern.startswith('!')
+    if negated:
+        pattern = pattern[1:]
+    elif pattern.startswith('\\'):
+        pattern = pattern[1:]
+    dir_only = pattern.endswith('/')
+    pattern = pattern.rstrip('/')
+    anchored = '/' in pattern
+    pattern = pattern.lstrip('/')
+    if not pattern:
+        return None
+    return negated, dir_only, anchored, re.compile(_translate(pattern) + r'\Z', re.DOTALL)
+
+
+def _translate(pattern):
+    """Translate a glob to a regular expression, where only "**" crosses slashes."""
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if pattern.startswith('**/', i):
+            out.append('(?:.*/)?')
+            i += 3
+        elif pattern.startswith('/**', i) and i + 3 == len(pattern):
+            out.append('/.*')
+            i += 3
+        elif pattern.startswith('**', i):
+            out.append('.*')
+            i += 2
+        elif c == '*':
+            out.append('[^/]*')
+            i += 1
+        elif c == '?':
+            out.append('[^/]')
+            i += 1
+        elif c == '[' and ']' in pattern[i + 2:]:
+            end = pattern.index(']', i + 2)
+            body = pattern[i + 1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            out.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif c == '\\' and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i + 1]))
+            i += 2
+        else:
+            out.append(re.escape(c))
+            i += 1
+    return ''.join(out)
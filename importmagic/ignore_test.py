@@ -0,0 +1,38 @@
+from __future__ import absolute_import
+
+import os
+
+import pytest
+
+from importmagic.ignore import IgnoreRules
+
+
+@pytest.mark.parametrize('pattern,path,is_dir,excluded', [
+    ('build/', 'build', True, True),
+    ('build/', 'build', False, False),
+    ('build/', 'src/build', True, True),
+    ('/build', 'src/build', True, False),
+    ('src/*.py', 'src/mod.py', False, True),
+    ('src/*.py', 'src/pkg/mod.py', False, False),
+    ('src/**/*.py', 'src/pkg/mod.py', False, True),
+    ('**/gen', 'a/b/gen', True, True),
+    ('*.egg-info/', 'foo.egg-info', True, True),
+    ('mod?.py', 'mod1.py', False, True),
+    ('mod[0-9].py', 'moda.py', False, False),
+    ('# comment', '# comment', False, False),
+])
+def test_ignore_rules_match_like_gitignore(pattern, path, is_dir, excluded):
+    rules = IgnoreRules('/root', [pattern])
+    assert rules.is_excluded(os.path.join('/root', *path.split('/')), is_dir) == excluded
+
+
+def test_ignore_rules_last_match_wins_and_nest(tmpdir):
+    tmpdir.join('.gitignore').write('*.py\n!keep.py\n')
+    sub = tmpdir.mkdir('sub')
+    sub.join('.ignore').write('keep.py\n')
+    rules = IgnoreRules(str(tmpdir)).enter(str(tmpdir), ['.gitignore', 'sub'])
+    assert rules.is_excluded(str(tmpdir.join('mod.py')), False)
+    assert not rules.is_excluded(str(tmpdir.join('keep.py')), False)
+    nested = rules.enter(str(sub), ['.ignore'])
+    assert nested.is_excluded(str(sub.join('keep.py')), False)
+    assert rules.enter(str(sub), []) is rules
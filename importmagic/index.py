@@ -4,15 +4,40 @@ import os
 import sys
 
 import ast
+import functools
+import hashlib
 import json
 import logging
+import multiprocessing
 import re
+import shutil
+import tempfile
+import time
+import zipfile
+from collections import Counter
 from contextlib import contextmanager
 from distutils import sysconfig
 
+from importmagic.archive import ZipArchive, is_archive
+from importmagic.bytecode import bytecode_symbols
+from importmagic.cache import INTERPRETER
+from importmagic.distributions import DistributionListing, read_distributions
+from importmagic.generated import DEFAULT_GENERATED, GENERATED_POLICIES, is_generated, public_names
+from importmagic.ignore import DEFAULT_EXCLUDES, IGNORE_FILES, IgnoreRules
+from importmagic.scanner import Ambiguous, scan_symbols
+from importmagic.stdlib import module_name, stdlib_modules
 from importmagic.util import parse_ast
 
 
+try:
+    from os import scandir
+except ImportError:
+    try:
+        from scandir import scandir
+    except ImportError:
+        scandir = None
+
+
 LIB_LOCATIONS = sorted(set((
     (sysconfig.get_python_lib(standard_lib=True), 'S'),
     (sysconfig.get_python_lib(plat_specific=True), '3'),
@@ -30,6 +55,20 @@ DEFAULT_BLACKLIST_RE = re.compile(r'\btest[s]?|test[s]?\b', re.I)
 # modules. The simplest way of dealing with that is just to import it and use
 # vars() on it.
 BUILTIN_MODULES = sys.builtin_module_names + ('os',)
+# Filename extensions of compiled extension modules.
+EXTENSION_EXTENSIONS = ('.dll', '.so', '.pyd')
+# Alternatives to a full parse for extracting symbols from source, by name.
+# Each takes the filename and source and returns what extract_symbols()
+# would, or raises Ambiguous if the source needs a full parse after all.
+SCANNERS = {
+    'scan': lambda filename, source: scan_symbols(source),
+    'bytecode': bytecode_symbols,
+}
+
+# The order build_index() indexes search paths and builtin modules in, so that
+# the names a project is most likely to need are available soonest.
+BUILD_PHASES = ('local', 'builtins', 'stdlib', 'third-party')
+_LOCATION_PHASES = {'L': 'local', 'S': 'stdlib'}
 
 _PYTHON_VERSION = 'python{}.{}'.format(sys.version_info.major, sys.version_info.minor)
 
@@ -45,6 +84,9 @@ LOCATION_BOOSTS = {
 
 logger = logging.getLogger(__name__)
 
+# Stands in for a symbol cache miss, as None means a module failed to parse.
+_MISSING = object()
+
 
 class JSONEncoder(json.JSONEncoder):
     def default(self, o):
@@ -52,8 +94,18 @@ class JSONEncoder(json.JSONEncoder):
             d = o._tree.copy()
             d.update(('.' + name, getattr(o, name))
                      for name in SymbolIndex._SERIALIZED_ATTRIBUTES)
-            if o._lib_locations is not None:
+            if o._unexpanded is not None:
+                d['.unexpanded'] = o._unexpanded
+            if o._exports:
+                # Lets a package merged from several spilled lines be pruned
+                # the same way as one built in memory.
+                d['.exports'] = o._exports
+            if o._parent is None:
                 d['.lib_locations'] = o._lib_locations
+                if o.lazy:
+                    d['.lazy'] = True
+                if o._fingerprints:
+                    d['.fingerprints'] = o._fingerprints
             return d
         return super(JSONEncoder, self).default(o)
 
@@ -75,11 +127,20 @@ class SymbolIndex(object):
     _SERIALIZED_ATTRIBUTES = {'score': 1.0, 'location': '3'}
 
     def __init__(self, name=None, parent=None, score=1.0, location='L',
-                 blacklist_re=None, locations=None):
+                 blacklist_re=None, locations=None, lazy=False, scanner='ast', metadata=False,
+                 exclude=None, generated=None, store=None):
+        if scanner != 'ast' and scanner not in SCANNERS:
+            raise ValueError('unknown scanner %r' % scanner)
+        if generated is not None:
+            for policy in generated.values():
+                if policy not in GENERATED_POLICIES:
+                    raise ValueError('unknown policy for generated modules %r' % policy)
         self._name = name
         self._tree = {}
         self._exports = {}
         self._parent = parent
+        # Directory of a package whose indexing was deferred by lazy mode.
+        self._unexpanded = None
         if blacklist_re:
             self._blacklist_re = blacklist_re
         elif parent:
@@ -88,16 +149,72 @@ class SymbolIndex(object):
             self._blacklist_re = DEFAULT_BLACKLIST_RE
         self.score = score
         self.location = location
-        if parent is None:
-            self._lib_locations = locations or LIB_LOCATIONS
-        else:
-            self._lib_locations = None
-        if parent is None:
-            self._merge_aliases()
-            with self.enter('__future__', location='F'):
-                pass
-            with self.enter('__builtin__', location='S'):
-                pass
+        if parent is not None:
+            # Everything else is root-only options and build state, which
+            # subtrees reach through _root() rather than each carrying a copy.
+            return
+        self._lib_locations = locations or LIB_LOCATIONS
+        # Maps filename to [module path, mtime, size, sha1 of content].
+        self._fingerprints = {}
+        # The [search path, mtime, {top-level entry: mtime}] stamps the root was
+        # last brought up to date with, in search order, or None if they
+        # aren't known.
+        self._stamps = None
+        # The sys.version of the interpreter that built the index, which is
+        # written along with its stamps.
+        self._python = sys.version
+        # Top-level entries changed in place since take_touched() was last
+        # called.
+        self._touched = set()
+        # When lazy, subpackages of top-level packages are only indexed once a
+        # lookup reaches them, and dirty is set whenever that happens.
+        self.lazy = lazy
+        self.dirty = False
+        # How modules are parsed: "ast", or the name of one of SCANNERS.
+        self.scanner = scanner
+        # Whether to list the modules of installed distributions from their
+        # RECORD files, rather than by walking their directories.
+        self.metadata = metadata
+        # Patterns in .gitignore syntax for directories and files to leave out
+        # of local search paths, on top of their own .gitignore and .ignore
+        # files.
+        self.exclude = DEFAULT_EXCLUDES if exclude is None else tuple(exclude)
+        # Maps location to what to do with generated modules found there, one
+        # of GENERATED_POLICIES. Locations that aren't listed are indexed as
+        # usual.
+        self.generated = dict(DEFAULT_GENERATED if generated is None else generated)
+        # The importmagic.cache.SubtreeStore large top-level entries are
+        # written to and read back from by reference, and distributions are
+        # shared through, if any.
+        self.store = store
+        # Filesystem calls made while walking, by kind: scandir, stat and open.
+        self.syscalls = Counter()
+        # Build state.
+        self._collecting = None
+        self._builtins = None
+        self._parsed = None
+        # Maps module name to the names found by an Introspector, or None.
+        self._introspected = None
+        self._symbol_cache = None
+        self._quarantine = None
+        self._report = None
+        # The ZipArchive being indexed, if any.
+        self._archive = None
+        # The DistributionListing of the directory being indexed, if any,
+        # and the SubtreeCache distributions are cached in.
+        self._listing = None
+        self._distribution_cache = None
+        # Paths of the directories _scan() found to be symlinks.
+        self._links = set()
+        # The file finished top-level packages are written to, if spilling,
+        # and whether the BuildReport counts them as they leave.
+        self._spill = None
+        self._spill_reported = True
+        self._merge_aliases()
+        with self.enter('__future__', location='F'):
+            pass
+        with self.enter('__builtin__', location='S'):
+            pass
 
     @property
     def lib_locations(self):
@@ -106,46 +223,146 @@ class SymbolIndex(object):
         return self._lib_locations
 
     @classmethod
-    def deserialize(self, file):
-        def load(tree, data, parent_location):
-            for key, value in data.items():
-                if isinstance(value, dict):
-                    score = value.pop('.score', 1.0)
-                    location = value.pop('.location', parent_location)
-                    with tree.enter(key, score=score, location=location) as subtree:
-                        load(subtree, value, location)
-                else:
-                    assert isinstance(value, float), '%s expected to be float was %r' % (key, value)
-                    tree.add(key, value)
+    def deserialize(self, file, blacklist_re=None, store=None):
+        """Load an index written by serialize(), one line at a time.
+
+        Every line after the first is merged into the index as it is read,
+        so only one top-level package is ever held as raw JSON.
 
-        data = json.load(file)
+        :param store: The SubtreeStore the index was written with, if any.
+        :raises ValueError: If the index refers to a subtree that isn't in
+            store.
+        """
+        data = json.loads(file.readline())
+        tree = SymbolIndex(locations=data.pop('.lib_locations', LIB_LOCATIONS),
+                           lazy=data.pop('.lazy', False), blacklist_re=blacklist_re,
+                           store=store)
+        tree._stamps = data.pop('.paths', None)
+        tree._python = data.pop('.python', sys.version)
+        tree._attach(data)
+        for line in file:
+            if line.strip():
+                tree._attach(json.loads(line))
+        return tree
+
+    def _attach(self, data):
+        """Merge serialized index data into this root node."""
         data.pop('.location', None)
         data.pop('.score', None)
-        tree = SymbolIndex(locations=data.pop('.lib_locations', LIB_LOCATIONS))
-        load(tree, data, 'L')
-        return tree
+        data.pop('.lib_locations', None)
+        data.pop('.lazy', None)
+        data.pop('.python', None)
+        data.pop('.paths', None)
+        data.pop('.exports', None)
+        self._fingerprints.update(data.pop('.fingerprints', {}))
+        for key, value in list(data.items()):
+            if isinstance(value, dict) and '.ref' in value:
+                data[key] = self._resolve(value)
+        self._load(data, 'L')
+
+    def _resolve(self, ref):
+        """Return the subtree a serialized top-level entry refers to, taking its fingerprints."""
+        digest = ref['.ref']
+        data = self.store.get(digest) if self.store is not None else None
+        if data is None:
+            raise ValueError('stored subtree %s is missing' % digest)
+        if '.base' in ref:
+            # Paths are stored relative to the search path the files are in.
+            base = ref['.base']
+            self._fingerprints.update((os.path.join(base, filename), fingerprint)
+                                      for filename, fingerprint in data.pop('.fingerprints', {}).items())
+            if self.lazy:
+                data = _rebase(data, lambda path: os.path.join(base, path))
+        return data
+
+    def _load(self, data, parent_location):
+        for key, value in data.items():
+            if isinstance(value, dict):
+                score = value.pop('.score', 1.0)
+                location = value.pop('.location', parent_location)
+                unexpanded = value.pop('.unexpanded', None)
+                exports = value.pop('.exports', None)
+                with self.enter(key, score=score, location=location) as subtree:
+                    subtree._load(value, location)
+                    if unexpanded is not None:
+                        subtree._unexpanded = unexpanded
+                    if exports:
+                        subtree._exports.update(exports)
+            else:
+                assert isinstance(value, float), '%s expected to be float was %r' % (key, value)
+                self.add(key, value)
 
     def index_source(self, filename, source):
-        try:
-            st = parse_ast(source, filename)
-        except Exception as e:
-            logger.debug('failed to parse %s: %s', filename, e)
+        symbols = extract_symbols(filename, source, self._root().scanner)
+        if symbols is None:
             return False
-        visitor = SymbolVisitor(self)
-        visitor.visit(st)
+        self._add_symbols(symbols)
         return True
 
-    def index_file(self, module, filename):
+    def index_file(self, module, filename, location=None):
+        root = self._root()
         if self._blacklist_re.search(filename):
+            if root._report is not None:
+                root._report.skipped += 1
             return
-        logger.debug('parsing Python module %s for indexing', filename)
-        with open(filename, 'rb') as fd:
-            source = fd.read()
-        with self.enter(module, location=self._determine_location_for(filename)) as subtree:
-            success = subtree.index_source(filename, source)
+        if location is None:
+            location = self._determine_location_for(filename)
+        if root._collecting is not None:
+            root._collecting.append((self.path(), module, filename, location))
+            return
+        module_path = '.'.join(filter(None, [self.path(), module]))
+        # Archive members can't be stat()ed, and are small enough not to need it.
+        quarantine = root._quarantine if root._archive is None else None
+        if root._parsed is not None and filename in root._parsed:
+            fingerprint, symbols = root._parsed[filename]
+        else:
+            if quarantine is not None and root._is_quarantined(filename, module_path):
+                return
+            logger.debug('parsing Python module %s for indexing', filename)
+            root.syscalls['open'] += 1
+            root.syscalls['stat'] += 1
+            stats = Counter()
+            read = root._archive.read if root._archive is not None else None
+            try:
+                fingerprint, symbols = _extract_file_symbols(filename, root.scanner,
+                                                             root._symbol_cache, stats, read,
+                                                             root.generated.get(location, 'index'))
+            except (IOError, OSError) as e:
+                # Such as a module a distribution's RECORD lists, but which
+                # has since been deleted.
+                logger.debug('failed to read %s: %s', filename, e)
+                return
+            if root._report is not None:
+                root._report.add_file(filename, fingerprint[1], symbols is None, stats)
+            if quarantine is not None and not stats['skipped']:
+                quarantine.check(filename, fingerprint[:2], symbols, _parse_seconds(stats))
+        if root._archive is None:
+            # Archives are only ever rebuilt whole, so their members are
+            # left out of incremental updates.
+            root._fingerprints[filename] = [module_path] + fingerprint
+        with self.enter(module, location=location) as subtree:
+            success = symbols is not None
+            if success:
+                subtree._add_symbols(symbols)
         if not success:
             self._tree.pop(module, None)
 
+    def _is_quarantined(self, filename, module_path):
+        """Whether the Quarantine says to skip filename.
+
+        A skipped file is fingerprinted without a content hash, so that
+        incremental updates leave it alone until its mtime or size changes.
+        """
+        self.syscalls['stat'] += 1
+        stamp = _stamp(filename)
+        if stamp is None or not self._quarantine.holds(filename, stamp):
+            return False
+        logger.debug('skipping quarantined module %s', filename)
+        if self._report is not None:
+            self._report.quarantined += 1
+        self._fingerprints[filename] = [module_path] + stamp + [None]
+        return True
+
     def index_path(self, root):
         """Index a path.
 
@@ -155,56 +372,943 @@ class SymbolIndex(object):
         if os.path.splitext(basename)[0] != '__init__' and basename.startswith('_'):
             return
         location = self._determine_location_for(root)
+        parent = os.path.dirname(root)
+        rules = self._ignore_rules(parent, location, [
+            name for name in IGNORE_FILES if os.path.isfile(os.path.join(parent, name))])
         if os.path.isfile(root):
-            self._index_module(root, location)
-        elif os.path.isdir(root) and os.path.exists(os.path.join(root, '__init__.py')):
-            self._index_package(root, location)
+            if rules is None or not rules.is_excluded(root, False):
+                self._index_module(root, location)
+        elif os.path.isdir(root):
+            if self._is_excluded_dir(root, rules):
+                return
+            package = self._enter_package(basename, root, rules)
+            if package is not None:
+                self._walk(root, *package)
 
-    def _index_package(self, root, location):
-        basename = os.path.basename(root)
-        with self.enter(basename, location=location) as subtree:
-            for filename in os.listdir(root):
-                subtree.index_path(os.path.join(root, filename))
+    def _index_dir(self, dir):
+        """Index the modules and packages in dir into this node."""
+        try:
+            entries = self._scan(dir)
+        except OSError:
+            return
+        location = self._determine_location_for(dir)
+        if location == 'S':
+            modules = stdlib_modules(dir)
+            if modules is not None:
+                entries = [entry for entry in entries if module_name(entry[0]) in modules]
+        names = [name for name, _, _, _ in entries]
+        rules = self._ignore_rules(dir, location, names)
+        if self.metadata and self._archive is None:
+            distributions = read_distributions(dir, names)
+            if distributions:
+                self._index_distributions(dir, entries, distributions, location, rules)
+                return
+        self._walk(dir, self, _prefer_stubs(entries), location, False, rules)
+
+    def _ignore_rules(self, dir, location, names):
+        """Create the IgnoreRules for a search path.
+
+        :param names: The names of the entries in dir.
+        :returns: The rules, or None if dir is not local, as exclude rules
+            only apply to the project itself.
+        """
+        root = self._root()
+        if location != 'L' or root._archive is not None:
+            return None
+        return IgnoreRules(dir, root.exclude).enter(dir, names)
+
+    def _is_excluded_dir(self, dir, rules):
+        """Whether to skip dir without looking inside it."""
+        if rules is not None and rules.is_excluded(dir, True):
+            return True
+        # Every file below a blacklisted directory would be blacklisted too.
+        return bool(self._blacklist_re.search(os.path.join(dir, '')))
+
+    def _index_distributions(self, dir, entries, distributions, location, rules=None):
+        """Index dir, listing the modules of distributions from their metadata.
+
+        Entries no distribution owns are walked as usual.
+        """
+        self.syscalls['open'] += len(distributions)
+        cache = self._distribution_cache
+        if cache is not None or self.store is not None:
+            owned = set()
+            for distribution in distributions:
+                owned.update(distribution.top_level)
+                self._index_distribution(dir, entries, distribution, location, cache)
+            entries = [entry for entry in entries if entry[0] not in owned]
+            distributions = []
+        self._listing = DistributionListing(dir, distributions)
+        try:
+            self._walk(dir, self, _prefer_stubs(entries), location, False, rules)
+        finally:
+            self._listing = None
+
+    def _index_distribution(self, dir, entries, distribution, location, cache):
+        """Index one distribution's modules.
+
+        They are keyed in the store on the file hashes in its RECORD, so that
+        identical installations share an entry, and in cache on its name and
+        version.
+        """
+        store = self.store if distribution.digest is not None else None
+        if store is not None:
+            digest = store.digest(json.dumps(['distribution', INTERPRETER, distribution.digest] +
+                                             self._build_options(), sort_keys=True))
+            data = store.get(digest)
+            if data is not None:
+                # Paths are stored relative to the directory.
+                self._attach(_rebase(data, lambda path: os.path.join(dir, path)))
+                return
+        key = os.path.join(dir, distribution.key + '.dist-info')
+        stamp = self._build_options()
+        cached = cache.load(key, stamp) if cache is not None else None
+        if cached is not None:
+            data = {}
+            for entry in cached:
+                data.update(entry)
+        else:
+            logger.debug('indexing distribution %s', distribution.key)
+            index = self._subindex()
+            index._listing = DistributionListing(dir, [distribution])
+            top_level = distribution.top_level
+            index._walk(dir, index, _prefer_stubs([entry for entry in entries if entry[0] in top_level]),
+                        location, False)
+            self.syscalls.update(index.syscalls)
+            data = json.loads(index.serialize())
+            if cache is not None:
+                # Distributions are small, and are stored whole.
+                cache.store(key, stamp, [json.dumps(data) + '\n'])
+        if store is not None:
+            store.put(digest, json.dumps(_rebase(data, lambda path: os.path.relpath(path, dir))))
+        self._attach(data)
+
+    def _walk(self, top, node, entries, location, is_package, rules=None):
+        """Index directory entries into node, descending into packages.
+
+        The walk keeps its own stack rather than recursing. File types come
+        from the scandir() results, and each directory is classified once.
+        Excluded directories are skipped before anything inside them is
+        looked at, as are symlinks to directories the walk has already been
+        through.
+
+        :param top: The directory the walk starts in.
+        :param rules: The IgnoreRules in effect, if any.
+        """
+        # Real paths of the directories the walk reached through symlinks,
+        # resolved on the first symlink it meets.
+        followed = None
+        stack = [(node, iter(entries), location, is_package, rules)]
+        while stack:
+            node, entries, location, is_package, rules = stack[-1]
+            for name, path, is_dir, is_file in entries:
+                if len(stack) == 1 and node._parent is None and node._spill is not None:
+                    node._spill_finished()
+                if os.path.splitext(name)[0] != '__init__' and name.startswith('_'):
+                    continue
+                if is_file:
+                    if rules is None or not rules.is_excluded(path, False):
+                        node._index_module(path, location)
+                elif is_dir:
+                    if node._is_excluded_dir(path, rules):
+                        continue
+                    if path in self._root()._links:
+                        if followed is None:
+                            followed = set([os.path.realpath(top)])
+                        if node._is_cycle(path, followed):
+                            continue
+                    package = node._enter_package(name, path, rules)
+                    if package is not None:
+                        stack.append(package)
+                        break
+            else:
+                stack.pop()
+                if is_package:
+                    node._prune_unexported()
+
+    def _is_cycle(self, link, followed):
+        """Whether the symlinked directory link leads back into the walk.
+
+        :param followed: Real paths of the directories the walk started in
+            and reached through symlinks, which link's target is added to
+            unless it is skipped.
+        """
+        real = os.path.realpath(link)
+        parent = os.path.realpath(os.path.dirname(link))
+        if real not in followed and not os.path.join(parent, '').startswith(os.path.join(real, '')):
+            followed.add(real)
+            return False
+        logger.debug('not following symlink %s to %s, which was already walked', link, real)
+        report = self._root()._report
+        if report is not None:
+            report.duplicates.append((link, real))
+        return True
+
+    def _enter_package(self, name, dir, rules=None):
+        """Create the node for the package in dir, if it is one.
+
+        :returns: A _walk() stack frame for the package's contents, or None if
+            there is nothing to walk.
+        """
+        root = self._root()
+        init = '__init__.py'
+        if name.endswith('-stubs'):
+            # A stub-only distribution of the package, as in PEP 561.
+            name, init = name[:-len('-stubs')], '__init__.pyi'
+        # Checking for __init__.py first avoids listing large directories
+        # that are not packages, such as data or node_modules.
+        if root._archive is not None:
+            if not root._archive.isfile(os.path.join(dir, init)):
+                return None
+        elif root._listing is not None and root._listing.covers(dir):
+            if not root._listing.isfile(os.path.join(dir, init)):
+                return None
+        else:
+            root.syscalls['stat'] += 1
+            if not os.path.isfile(os.path.join(dir, init)):
+                return None
+        location = self._determine_location_for(dir)
+        if self._parent is not None and root.lazy and root._archive is None:
+            self._child(name, location=location)._unexpanded = dir
+            return None
+        try:
+            entries = self._scan(dir)
+        except OSError:
+            return None
+        if rules is not None:
+            rules = rules.enter(dir, [entry[0] for entry in entries])
+        return (self._child(name, location=location), iter(_prefer_stubs(entries)), location, True,
+                rules)
+
+    def _expand(self):
+        """Index a package that was deferred by lazy mode.
+
+        :returns: False if the package's directory is gone, in which case
+            the package is dropped from the index, otherwise True.
+        """
+        root = self._unexpanded
+        if root is None:
+            return True
+        self._unexpanded = None
+        logger.debug('expanding lazily indexed package %s', self.path())
+        try:
+            entries = self._scan(root)
+        except OSError as e:
+            logger.debug('failed to expand %s: %s', root, e)
+            self._parent._tree.pop(self._name, None)
+            self._root().dirty = True
+            return False
+        location = self._determine_location_for(root)
+        # The rules of the directories above the package are not known here.
+        rules = self._ignore_rules(root, location, [entry[0] for entry in entries])
+        self._walk(root, self, _prefer_stubs(entries), location, True, rules)
+        self._root().dirty = True
+        return True
 
     def _index_module(self, root, location):
         basename, ext = os.path.splitext(os.path.basename(root))
         if basename == '__init__':
             basename = None
         ext = ext.lower()
+        if ext in EXTENSION_EXTENSIONS:
+            # Strip ABI tags, as in "foo.cpython-36m-x86_64-linux-gnu.so".
+            basename = basename.split('.', 1)[0]
         import_path = '.'.join(filter(None, [self.path(), basename]))
         if import_path in BUILTIN_MODULES:
             return
-        if ext == '.py':
-            self.index_file(basename, root)
-        elif ext in ('.dll', '.so'):
+        if ext in ('.py', '.pyi'):
+            self.index_file(basename, root, location)
+        elif ext in EXTENSION_EXTENSIONS and self._root()._archive is None:
+            # zipimport can't load extension modules, so those in archives are
+            # never importable.
             self.index_builtin(import_path, location=location)
 
+    def _scan(self, dir):
+        root = self._root()
+        if root._archive is not None:
+            return root._archive.scan(dir)
+        if root._listing is not None and root._listing.covers(dir):
+            return root._listing.scan(dir)
+        return _scan(dir, root.syscalls, root._links)
+
     def index_builtin(self, name, location):
         basename = name.rsplit('.', 1)[-1]
         if basename.startswith('_'):
             return
-        logger.debug('importing builtin module %s for indexing', name)
-        try:
-            module = __import__(name, fromlist=['.'])
-        except Exception:
-            logger.debug('failed to index builtin module %s', name)
+        root = self._root()
+        if root._collecting is not None:
+            root._builtins.append(name)
             return
+        if root._introspected is not None and name in root._introspected:
+            names = root._introspected[name]
+            if names is None:
+                return
+        else:
+            logger.debug('importing builtin module %s for indexing', name)
+            start = time.time()
+            try:
+                module = __import__(name, fromlist=['.'])
+            except Exception:
+                logger.debug('failed to index builtin module %s', name)
+                return
+            finally:
+                if root._report is not None:
+                    root._report.timings['import'] += time.time() - start
+            names = [key for key in vars(module) if not key.startswith('_')]
 
         with self.enter(basename, location=location) as subtree:
-            for key, value in vars(module).items():
-                if not key.startswith('_'):
-                    subtree.add(key, 1.1)
+            for key in names:
+                subtree.add(key, 1.1)
+
+    def build_index(self, paths, processes=None, cache=None, introspector=None,
+                    symbol_cache=None, report=None, progress=None, spill=None,
+                    quarantine=None):
+        """Index all modules and packages under paths, and builtin modules.
 
-    def build_index(self, paths):
-        for builtin in BUILTIN_MODULES:
-            self.index_builtin(builtin, location='S')
+        The build goes through BUILD_PHASES in order: local paths, builtin
+        modules, the standard library, then everything else. Within a phase,
+        paths are indexed in the order given.
+
+        :param paths: Directories to search, typically sys.path. Paths that
+            lead to the same directory as an earlier one are skipped.
+        :param processes: If greater than 1, parse modules in a pool of this
+            many worker processes. The resulting index is identical to the
+            one produced by a serial build.
+        :param cache: An optional importmagic.cache.SubtreeCache. Paths with
+            a location it caches are loaded from it when their stamp is
+            unchanged, and stored in it otherwise.
+        :param introspector: An optional importmagic.introspect.Introspector.
+            If given, builtin and extension modules are imported by its
+            worker processes rather than by this one.
+        :param symbol_cache: An optional importmagic.cache.SymbolCache. Files
+            whose content it has seen before are not parsed, and it is saved
+            once the build is done.
+        :param report: An optional importmagic.report.BuildReport to fill in.
+        :param progress: An optional callable, called with the name of each
+            phase once it is done. The index can be queried, or copied with
+            snapshot(), from inside the call.
+        :param spill: An optional file to stream the index to, as
+            serialize() would, while it is built. Each top-level package is
+            written out and dropped from this index as soon as it is
+            finished, so peak memory is bounded by the largest top-level
+            package rather than by the whole index, plus the parse results
+            of one phase when processes is greater than 1 and the entries of
+            symbol_cache. Read the file back with deserialize() to query it.
+        :param quarantine: An optional importmagic.cache.Quarantine. Files it
+            holds are skipped, files that are over its budgets or fail to
+            parse are added to it, and it is saved once the build is done.
+        """
+        start = time.time()
+        self._symbol_cache = symbol_cache
+        self._quarantine = quarantine
+        self._report = report
+        paths, duplicates = unique_paths(paths)
+        if report is not None:
+            report.duplicates.extend(duplicates)
+        # Stamped up front, so that changes made while building show up.
+        self._stamps = _path_stamps(paths)
+        self._python = sys.version
+        phases = dict((phase, []) for phase in BUILD_PHASES)
+        for path in paths:
+            path = path or '.'
+            location = self._determine_location_for(path)
+            phases[_LOCATION_PHASES.get(location, 'third-party')].append(path)
+        cached = {}
+        if spill is not None:
+            self._spill = spill
+            self._write_header(spill)
+        if cache is not None:
+            for path in paths:
+                path = path or '.'
+                if is_archive(path) or (self._determine_location_for(path) in cache.locations and
+                                        os.path.isdir(path)):
+                    cached[path] = cache.holds(path, self._path_stamp(path))
+        try:
+            for phase in BUILD_PHASES:
+                logger.debug('building index phase %s', phase)
+                if phase == 'builtins':
+                    self._prepare([], list(BUILTIN_MODULES), processes, introspector)
+                    for builtin in BUILTIN_MODULES:
+                        self.index_builtin(builtin, location='S')
+                else:
+                    uncached = [path for path in phases[phase] if not cached.get(path)]
+                    self._prepare(uncached, [], processes, introspector)
+                    for path in phases[phase]:
+                        self._build_path(path, cached, cache)
+                        if spill is not None:
+                            self._spill_finished()
+                if progress is not None:
+                    progress(phase)
+            if spill is not None:
+                self._write_entries(spill, list(self._tree))
+        finally:
+            self._spill = None
+            self._parsed = None
+            self._introspected = None
+            self._symbol_cache = None
+            self._quarantine = None
+            self._report = None
+            if quarantine is not None:
+                quarantine.save()
+            if symbol_cache is not None:
+                logger.debug('symbol cache had %d hits and %d misses',
+                             symbol_cache.hits, symbol_cache.misses)
+                symbol_cache.save()
+        logger.debug('indexing made %d scandir, %d stat and %d open calls',
+                     self.syscalls['scandir'], self.syscalls['stat'], self.syscalls['open'])
+        if report is not None:
+            report.finish(self, time.time() - start)
+
+    def _prepare(self, paths, builtins, processes, introspector):
+        """Parse and import ahead of a phase what its walk would otherwise do itself.
+
+        :param paths: The paths the phase walks.
+        :param builtins: Builtin modules the phase indexes.
+        """
+        self._parsed = None
+        self._introspected = None
+        parallel = processes and processes > 1
+        if not parallel and introspector is None:
+            return
+        scratch = self._collect(paths, self.lazy)
+        if parallel:
+            # What to do with each file if it turns out to be generated.
+            policies = dict((filename, self.generated.get(location, 'index'))
+                            for _, _, filename, location in scratch._collecting)
+            filenames = [filename for _, _, filename, _ in scratch._collecting]
+            if self._quarantine is not None:
+                # Left for index_file() to skip.
+                self.syscalls['stat'] += len(filenames)
+                stamps = [_stamp(filename) for filename in filenames]
+                filenames = [filename for filename, stamp in zip(filenames, stamps)
+                             if stamp is None or not self._quarantine.holds(filename, stamp)]
+            self._parsed = self._parse_in_pool(filenames, policies, processes)
+        names = builtins + scratch._builtins
+        if introspector is not None and names:
+            start = time.time()
+            self._introspected = introspector.introspect(names)
+            if self._report is not None:
+                self._report.timings['import'] += time.time() - start
+
+    def _build_path(self, path, cached, cache):
+        """Index a search path, or load it from the SubtreeCache if it is in cached.
+
+        Paths in cached are built into a scratch index that spills each
+        top-level package as it is finished, and the cache entry is then
+        attached, and spilled if this index is spilling, a batch of packages
+        at a time.
+        """
+        if path not in cached:
+            self._index_paths([path])
+            return
+        stamp = self._path_stamp(path)
+        # The entry may have gone stale since it was checked.
+        entries = cache.load(path, stamp) if cached[path] else None
+        if entries is not None:
+            if self._report is not None:
+                self._report.cached_paths.append(path)
+            self._attach_entries(entries, not is_archive(path))
+            return
+        logger.debug('indexing %s for the shared cache', path)
+        scratch = self._subindex()
+        if self.metadata:
+            scratch._distribution_cache = cache
+        # The packages are counted once they are attached here.
+        scratch._spill_reported = False
+        with tempfile.TemporaryFile('w+') as spill:
+            scratch._spill = spill
+            scratch._index_paths([path])
+            scratch._write_entries(spill, list(scratch._tree))
+            self.syscalls.update(scratch.syscalls)
+            spill.seek(0)
+            cache.store(path, stamp, spill)
+            spill.seek(0)
+            self._attach_entries((json.loads(line) for line in spill), not is_archive(path))
+
+    def _attach_entries(self, entries, batched):
+        """Attach serialized top-level entries, spilling them if spilling.
+
+        :param batched: Whether entries come in batches followed by the
+            fingerprints of their files, as spilled. A batch is only spilled
+            once its fingerprints are attached, so that they are stored
+            along with it.
+        """
+        for data in entries:
+            finished = not batched or '.fingerprints' in data
+            self._attach(data)
+            if self._spill is not None and finished:
+                self._spill_finished()
+        if self._spill is not None:
+            self._spill_finished()
+
+    def snapshot(self):
+        """Return a copy of this index that later changes to it don't affect."""
+        copy = SymbolIndex(blacklist_re=self._blacklist_re, locations=self.lib_locations,
+                           lazy=self.lazy, scanner=self.scanner, metadata=self.metadata,
+                           exclude=self.exclude, generated=self.generated, store=self.store)
+        copy._attach(json.loads(self.serialize()))
+        copy._stamps = json.loads(json.dumps(self._stamps))
+        copy._python = self._python
+        copy.dirty = self.dirty
+        return copy
+
+    def _build_options(self):
+        """Everything besides the files themselves that changes what a build produces."""
+        return [self._blacklist_re.pattern, self.generated, self.lazy, self.scanner, self.metadata]
+
+    def _path_stamp(self, path):
+        options = self._build_options()
+        if stdlib_modules(path) is not None:
+            # The standard library only changes along with the interpreter.
+            return [sys.version, list(self.exclude)] + options
+        st = os.stat(path)
+        if is_archive(path):
+            return [st.st_mtime, st.st_size] + options
+        return [st.st_mtime, list(self.exclude)] + options
+
+    def update_index(self, paths):
+        """Incrementally bring the index up to date with the modules in paths.
+
+        Only modules that were added, changed or deleted since they were last
+        indexed are re-parsed, and their subtrees are patched in place.
+        Builtin modules are left alone.
+
+        :returns: The number of modules that were re-indexed or removed.
+        """
+        self._restamp(paths, paths, keep=True)
+        prefixes = tuple(os.path.join(path or '.', '') for path in paths)
+        return self._update_collected(self._collect_files(paths),
+                                      lambda filename: filename.startswith(prefixes))
+
+    def _refresh_entries(self, entries):
+        """Bring the index up to date with some top-level modules and packages.
+
+        :param entries: Top-level modules and package directories of search
+            paths, as stale_paths() returns, which may also have been added
+            or deleted.
+        :returns: The number of modules that were re-indexed or removed.
+        """
+        scratch = self._scratch()
+        for entry in entries:
+            if os.path.exists(entry):
+                scratch.index_path(entry)
+        self.syscalls.update(scratch.syscalls)
+        files = set(entries)
+        prefixes = tuple(os.path.join(entry, '') for entry in entries)
+        return self._update_collected(
+            scratch._collecting, lambda filename: filename in files or filename.startswith(prefixes))
+
+    def _update_collected(self, entries, covers):
+        """Patch the index for the files a walk collected.
+
+        :param entries: What the walk collected, as _collect_files() returns.
+        :param covers: Whether the walk covered a filename, so that it is
+            deleted if it wasn't collected.
+        :returns: The number of modules that were re-indexed or removed.
+        """
+        current = dict((filename, (package, module)) for package, module, filename, _ in entries)
+        deleted = [filename for filename in self._fingerprints
+                   if filename not in current and covers(filename)]
+        for filename in deleted:
+            # Removing a package's __init__ also forgets its submodules.
+            if filename in self._fingerprints:
+                self._remove_file(filename)
+        updated = 0
+        for package, module, filename, _ in entries:
+            fingerprint = self._fingerprints.get(filename)
+            if fingerprint is not None and not self._file_changed(filename, fingerprint):
+                continue
+            if self._is_deferred(package):
+                # Indexed when the package is expanded.
+                continue
+            logger.debug('re-indexing changed module %s', filename)
+            self._reindex_file(package, module, filename)
+            updated += 1
+        return len(deleted) + updated
+
+    def remove_paths(self, paths):
+        """Forget the modules indexed from paths, such as search paths that were dropped.
+
+        :returns: The number of modules that were removed.
+        """
+        prefixes = tuple(os.path.join(path or '.', '') for path in paths)
+        removed = 0
+        for filename in [f for f in self._fingerprints if f.startswith(prefixes)]:
+            # Removing a package's __init__ also forgets its submodules.
+            if filename in self._fingerprints:
+                self._remove_file(filename)
+                removed += 1
+        if self._stamps is not None:
+            self._stamps = [stamp for stamp in self._stamps if stamp[0] not in paths]
+        return removed
+
+    def _restamp(self, paths, refreshed, keep=False):
+        """Stamp the refreshed search paths, and drop the stamps of paths that aren't in paths.
+
+        :param keep: Keep the stamps of paths that aren't in paths instead,
+            after those of paths.
+        """
+        old = dict((stamp[0], stamp) for stamp in self._stamps or [])
+        new = dict((stamp[0], stamp) for stamp in _path_stamps(refreshed))
+        stamps = [new.get(path) or old[path] for path in paths if path in new or path in old]
+        if keep:
+            stamps += [stamp for stamp in self._stamps or [] if stamp[0] not in paths]
+        self._stamps = stamps
+
+    def refresh_paths(self, paths, changed, removed):
+        """Bring the index up to date with the search paths stale_paths() found.
+
+        Only the top-level modules and packages that changed are looked at
+        again, unless a whole search path is new. Modules in archives aren't
+        fingerprinted, so a changed or removed search path that isn't a
+        directory has its whole location rebuilt with rebuild_locations()
+        instead.
+
+        :param paths: The search paths the index is built from now.
+        :param changed: Search paths that are new or changed, and top-level
+            entries of search paths that changed.
+        :param removed: Search paths that are no longer searched.
+        :returns: The number of modules that were re-indexed or removed, plus
+            the number of top-level entries that were rebuilt.
+        """
+        searched = set(paths)
+        entries = [entry for entry in changed if entry not in searched]
+        changed = [path for path in changed if path in searched]
+        archives = [path for path in changed + removed if not os.path.isdir(path or '.')]
+        locations = set(self._determine_location_for(path or '.') for path in archives)
+        count = self.remove_paths([path for path in removed if path not in archives])
+        if locations:
+            count += len(self.rebuild_locations(paths, locations))
+        changed = [path for path in changed
+                   if self._determine_location_for(path or '.') not in locations]
+        if changed:
+            count += self.update_index(changed)
+        if entries:
+            count += self._refresh_entries(entries)
+            parents = set(os.path.dirname(entry) for entry in entries)
+            self._restamp(paths, [path for path in paths
+                                  if os.path.dirname(os.path.join(path or '.', '')) in parents])
+        return count
+
+    def update_files(self, filenames, paths):
+        """Patch the index for individual files that changed on disk.
+
+        :param filenames: Files or directories that were created, modified or
+            deleted.
+        :param paths: The paths the index was built from, used to place new
+            modules in the tree.
+        :returns: The number of modules that were re-indexed or removed.
+        """
+        count = 0
+        added = {}
+        for filename in filenames:
+            fingerprint = self._fingerprints.get(filename)
+            if fingerprint is None:
+                if os.path.exists(filename):
+                    top = self._top_level_entry(filename, paths)
+                    if top is not None:
+                        added.setdefault(top, []).append(filename)
+                else:
+                    # Possibly a directory that was deleted or moved away.
+                    prefix = os.path.join(filename, '')
+                    for other in [f for f in self._fingerprints if f.startswith(prefix)]:
+                        if other in self._fingerprints:
+                            self._remove_file(other)
+                            count += 1
+            elif not os.path.exists(filename):
+                self._remove_file(filename)
+                count += 1
+            elif self._file_changed(filename, fingerprint):
+                package, _, module = fingerprint[0].rpartition('.')
+                if os.path.splitext(os.path.basename(filename))[0] == '__init__':
+                    package, module = fingerprint[0], None
+                self._reindex_file(package, module, filename)
+                count += 1
+        for top, names in added.items():
+            prefixes = tuple(os.path.join(name, '') for name in names)
+            scratch = self._scratch()
+            scratch.index_path(top)
+            for package, module, filename, _ in scratch._collecting:
+                if self._is_deferred(package):
+                    continue
+                if filename in names or filename.startswith(prefixes):
+                    self._reindex_file(package, module, filename)
+                    count += 1
+        return count
+
+    def rebuild_locations(self, paths, locations, introspector=None, symbol_cache=None,
+                          report=None, quarantine=None):
+        """Drop and re-index the top-level entries of some locations, keeping the rest.
+
+        Only the paths in those locations are walked again, along with
+        builtin modules for 'S'. Modules that were indexed into a dropped
+        entry from a path that isn't walked, such as __future__ ('F') from
+        the standard library, are re-indexed one by one.
+
+        :param paths: The paths the index was built from.
+        :param locations: Location codes, eg. ['L'] to rebuild only the
+            project's own code.
+        :param introspector, symbol_cache, report, quarantine: As for
+            build_index().
+        :returns: The names of the top-level entries that were rebuilt or
+            added to, for rewrite().
+        """
+        start = time.time()
+        locations = set(locations)
+        dropped = set(name for name, subtree in self._tree.items()
+                      if isinstance(subtree, SymbolIndex) and subtree.location in locations)
+        stragglers = []
+        for filename, fingerprint in list(self._fingerprints.items()):
+            if fingerprint[0].split('.')[0] in dropped:
+                stragglers.append((filename, fingerprint[0]))
+                del self._fingerprints[filename]
+        for name in dropped:
+            del self._tree[name]
+        kept = set(self._tree)
+        fingerprints = dict(self._fingerprints)
+        logger.debug('rebuilding %d top-level entries in locations %s',
+                     len(dropped), ''.join(sorted(locations)))
+        # Put back the nodes every root starts with.
+        self._merge_aliases()
+        with self.enter('__future__', location='F'):
+            pass
+        with self.enter('__builtin__', location='S'):
+            pass
+        paths = unique_paths(paths)[0]
+        self._restamp(paths, [path for path in paths
+                              if self._determine_location_for(path or '.') in locations])
+        self._symbol_cache = symbol_cache
+        self._quarantine = quarantine
+        self._report = report
+        try:
+            if 'S' in locations:
+                self._prepare([], list(BUILTIN_MODULES), None, introspector)
+                for builtin in BUILTIN_MODULES:
+                    self.index_builtin(builtin, location='S')
+            for path in paths:
+                path = path or '.'
+                if self._determine_location_for(path) in locations:
+                    self._prepare([path], [], None, introspector)
+                    self._index_paths([path])
+            for filename, module_path in stragglers:
+                if filename in self._fingerprints or not os.path.exists(filename):
+                    continue
+                package, _, module = module_path.rpartition('.')
+                if os.path.splitext(os.path.basename(filename))[0] == '__init__':
+                    package, module = module_path, None
+                node = self
+                for name in package.split('.') if package else []:
+                    with node.enter(name, location=self._determine_location_for(filename)) as node:
+                        pass
+                node.index_file(module, filename)
+        finally:
+            self._parsed = None
+            self._introspected = None
+            self._symbol_cache = None
+            self._quarantine = None
+            self._report = None
+            if quarantine is not None:
+                quarantine.save()
+            if symbol_cache is not None:
+                symbol_cache.save()
+        if report is not None:
+            report.finish(self, time.time() - start)
+        # Modules can also land in a package that was kept, such as a
+        # namespace package split across locations.
+        touched = dropped | (set(self._tree) - kept)
+        touched.update(fingerprint[0].split('.')[0]
+                       for filename, fingerprint in self._fingerprints.items()
+                       if fingerprint is not fingerprints.get(filename))
+        if 'S' in locations:
+            touched.update(name for name in BUILTIN_MODULES if name in self._tree)
+        self._touched.update(touched)
+        return sorted(touched)
+
+    def take_touched(self):
+        """Return the top-level entries patched since the last call, for rewrite().
+
+        These are the entries update_index(), update_files(), remove_paths()
+        and rebuild_locations() changed.
+        """
+        touched, self._touched = sorted(self._touched), set()
+        return touched
+
+    def _top_level_entry(self, filename, paths):
+        for path in paths:
+            prefix = os.path.join(path or '.', '')
+            if filename.startswith(prefix):
+                top = filename[len(prefix):].split(os.path.sep, 1)[0]
+                return os.path.join(path or '.', top)
+        return None
+
+    def _file_changed(self, filename, fingerprint):
+        try:
+            st = os.stat(filename)
+        except OSError:
+            return True
+        if [st.st_mtime, st.st_size] == fingerprint[1:3]:
+            return False
+        with open(filename, 'rb') as fd:
+            digest = hashlib.sha1(fd.read()).hexdigest()
+        if digest != fingerprint[3]:
+            return True
+        # Touched but not modified.
+        fingerprint[1:3] = [st.st_mtime, st.st_size]
+        return False
+
+    def _remove_file(self, filename):
+        module_path = self._fingerprints.pop(filename)[0]
+        self._touched.add(module_path.split('.')[0])
+        if os.path.splitext(os.path.basename(filename))[0] == '__init__':
+            # The whole package is gone, not just its __init__.
+            prefix = module_path + '.'
+            for other, fingerprint in list(self._fingerprints.items()):
+                if fingerprint[0].startswith(prefix):
+                    del self._fingerprints[other]
+        package, _, name = module_path.rpartition('.')
+        parent = self.find(package) if package else self
+        if parent is not None:
+            parent._tree.pop(name, None)
+
+    def _reindex_file(self, package, module, filename):
+        self._touched.add((package or module).split('.')[0])
+        node = self.find(package) if package else self
+        if node is None:
+            location = self._determine_location_for(filename)
+            node = self
+            for name in package.split('.'):
+                with node.enter(name, location=location) as node:
+                    pass
+        if module is None:
+            # A package's __init__ shares its node with the package's
+            # submodules, so only drop the symbols it defined.
+            for key, value in list(node._tree.items()):
+                if type(value) is float:
+                    del node._tree[key]
+            node._exports = {}
+        else:
+            node._tree.pop(module, None)
+        node.index_file(module, filename)
+        if module is not None:
+            # As a build would, drop submodules the package's __all__ leaves
+            # out.
+            node._prune_unexported()
+
+    def _index_paths(self, paths):
         for path in paths:
             # for the implicit "" entry in sys.path
             path = path or '.'
-            if os.path.isdir(path):
-                for filename in os.listdir(path):
-                    filename = os.path.join(path, filename)
-                    self.index_path(filename)
+            if not is_archive(path):
+                self._index_dir(path)
+            elif self._collecting is None:
+                # Files in archives are left out of collection, so that
+                # pool workers and incremental updates never try to open
+                # them.
+                self._index_archive(path)
+
+    def _index_archive(self, path):
+        logger.debug('indexing archive %s', path)
+        try:
+            archive = ZipArchive(path)
+        except (IOError, OSError, zipfile.BadZipfile) as e:
+            logger.debug('failed to open archive %s: %s', path, e)
+            return
+        self.syscalls['open'] += 1
+        self._archive = archive
+        try:
+            self._index_dir(path)
+        finally:
+            self._archive = None
+            archive.close()
+
+    def _collect_files(self, paths):
+        """Return the files a build of paths would parse, in build order.
+
+        :returns: A list of (package path, module, filename, location) tuples.
+        """
+        return self._collect(paths)._collecting
+
+    def _collect(self, paths, lazy=False):
+        """Walk paths into a scratch index, recording what a build would parse and import."""
+        scratch = self._scratch(lazy)
+        scratch._index_paths(paths)
+        self.syscalls.update(scratch.syscalls)
+        return scratch
+
+    def _scratch(self, lazy=False):
+        """Create an empty index that records the files it would parse."""
+        scratch = SymbolIndex(blacklist_re=self._blacklist_re, locations=self.lib_locations,
+                              lazy=lazy, scanner=self.scanner, metadata=self.metadata,
+                              exclude=self.exclude, generated=self.generated)
+        scratch._collecting = []
+        scratch._builtins = []
+        return scratch
+
+    def _subindex(self):
+        """Create an empty index with the same options and build state."""
+        index = SymbolIndex(blacklist_re=self._blacklist_re, locations=self.lib_locations,
+                            lazy=self.lazy, scanner=self.scanner, metadata=self.metadata,
+                            exclude=self.exclude, generated=self.generated)
+        index._parsed = self._parsed
+        index._introspected = self._introspected
+        index._symbol_cache = self._symbol_cache
+        index._quarantine = self._quarantine
+        index._report = self._report
+        return index
+
+    def _is_deferred(self, package):
+        """Whether package is, or is inside, a package lazy mode deferred."""
+        node = self
+        for name in package.split('.') if package else []:
+            node = node._tree.get(name)
+            if not isinstance(node, SymbolIndex):
+                return False
+            if node._unexpanded is not None:
+                return True
+        return False
+
+    def _parse_in_pool(self, filenames, policies, processes):
+        # Only parsing is farmed out. The tree itself is still built by a
+        # serial walk that replays the results in order, which is what keeps
+        # the output identical to a serial build.
+        parsed = {}
+        symbol_cache = self._symbol_cache
+        report = self._report
+        if symbol_cache is not None:
+            for filename in filenames:
+                fingerprint, source = _read_file(filename)
+                stats = Counter()
+                scanner = _choose_scanner(filename, source, self.scanner, policies[filename], stats)
+                if scanner is None:
+                    continue
+                symbols = symbol_cache.get(_symbol_key(scanner, fingerprint), _MISSING)
+                if symbols is not _MISSING:
+                    parsed[filename] = fingerprint, symbols
+                    if report is not None:
+                        stats['cached'] += 1
+                        report.add_file(filename, fingerprint[1], symbols is None, stats)
+            filenames = [filename for filename in filenames if filename not in parsed]
+        logger.debug('parsing %d modules in %d processes', len(filenames), processes)
+        chunksize = max(1, len(filenames) // (processes * 4))
+        pool = multiprocessing.Pool(processes)
+        try:
+            extract = functools.partial(_extract_file_stats, scanner=self.scanner)
+            results = pool.map(extract, [(filename, policies[filename]) for filename in filenames],
+                               chunksize)
+        finally:
+            pool.close()
+            pool.join()
+        for filename, (fingerprint, symbols, stats, scanner) in zip(filenames, results):
+            parsed[filename] = fingerprint, symbols
+            if report is not None:
+                report.add_file(filename, fingerprint[1], symbols is None, stats)
+            if scanner is None:
+                continue
+            if self._quarantine is not None:
+                self._quarantine.check(filename, fingerprint[:2], symbols, _parse_seconds(stats))
+            if symbol_cache is not None:
+                symbol_cache.put(_symbol_key(scanner, fingerprint), symbols)
+        return parsed
 
     def symbol_scores(self, symbol):
         """Find matches for symbol.
@@ -257,6 +1361,12 @@ class SymbolIndex(object):
         scores.sort(reverse=True)
         return scores
 
+    def _root(self):
+        node = self
+        while node._parent:
+            node = node._parent
+        return node
+
     def depth(self):
         depth = 0
         node = self
@@ -285,7 +1395,7 @@ class SymbolIndex(object):
             node = node._parent
         for name in path:
             node = node._tree.get(name, None)
-            if node is None or type(node) is float:
+            if node is None or type(node) is float or not node._expand():
                 return None
         return node
 
@@ -297,12 +1407,22 @@ class SymbolIndex(object):
             node = node._parent
         location = node.location
         for name in path:
+            if not node._expand():
+                return location
             tree = node._tree.get(name, None)
             if tree is None or type(tree) is float:
                 return location
             location = tree.location
+            node = tree
         return location
 
+    def _add_symbols(self, symbols):
+        for name, score, exported in symbols:
+            if exported:
+                self.add_explicit_export(name, score)
+            else:
+                self.add(name, score)
+
     def add(self, name, score):
         current_score = self._tree.get(name, 0.0)
         if isinstance(current_score, float) and score > current_score:
@@ -310,26 +1430,193 @@ class SymbolIndex(object):
 
     @contextmanager
     def enter(self, name, location='L', score=1.0):
-        if name is None:
-            tree = self
-        else:
-            tree = self._tree.get(name)
-            if not isinstance(tree, SymbolIndex):
-                tree = self._tree[name] = SymbolIndex(name, self, score=score, location=location)
-                if tree.path() in SymbolIndex._PACKAGE_ALIASES:
-                    alias_path, _ = SymbolIndex._PACKAGE_ALIASES[tree.path()]
-                    alias = self.find(alias_path)
-                    alias._tree = tree._tree
+        tree = self if name is None else self._child(name, location, score)
         yield tree
-        if tree._exports:
+        tree._prune_unexported()
+
+    def _child(self, name, location='L', score=1.0):
+        """Return the child node called name, creating it if necessary."""
+        tree = self._tree.get(name)
+        if not isinstance(tree, SymbolIndex):
+            tree = self._tree[name] = SymbolIndex(name, self, score=score, location=location)
+            if tree.path() in SymbolIndex._PACKAGE_ALIASES:
+                alias_path, _ = SymbolIndex._PACKAGE_ALIASES[tree.path()]
+                alias = self.find(alias_path)
+                alias._tree = tree._tree
+        return tree
+
+    def _prune_unexported(self):
+        if self._exports:
             # Delete unexported variables
-            for key in set(tree._tree) - set(tree._exports):
-                del tree._tree[key]
+            for key in set(self._tree) - set(self._exports):
+                del self._tree[key]
 
     def serialize(self, fd=None):
+        """Serialize the index as JSON, returned as a string or written to fd.
+
+        Written to fd, a root index is streamed as JSON lines instead of one
+        document: a line of its attributes, a line per top-level entry and a
+        line of fingerprints. The first line, which read_header() reads, also
+        has the interpreter and the stamps of the search paths the index was
+        built from. deserialize() reads either form.
+        """
         if fd is None:
             return json.dumps(self, cls=JSONEncoder)
-        return json.dump(self, fd, cls=JSONEncoder)
+        if self._parent is not None:
+            return json.dump(self, fd, cls=JSONEncoder)
+        self._write_header(fd)
+        self._write_entries(fd, list(self._tree))
+
+    def serialize_spilled(self, spilled, fd):
+        """Stream the index built so far to fd, while build_index() spills it.
+
+        :param spilled: The spill file given to build_index(), opened for
+            reading. What has been written to it is copied to fd, followed
+            by the entries that are still in memory.
+        """
+        shutil.copyfileobj(spilled, fd)
+        self._write_entries(fd, list(self._tree))
+
+    def rewrite(self, old, fd, names):
+        """Stream the index to fd, copying unchanged entries from an earlier serialization.
+
+        :param old: A file this index was last written to by serialize(fd).
+        :param names: The top-level entries that changed since, as
+            rebuild_locations() returns. Entries of old that are no longer
+            in the index are left out.
+        """
+        if read_header(old) is None:
+            # A single document, with nothing to copy line by line.
+            self.serialize(fd)
+            return
+        self._write_header(fd)
+        names = set(names)
+        copied = set()
+        stored = set()
+        decoder = json.JSONDecoder()
+        for line in old:
+            if not line.strip():
+                continue
+            # Each entry is a line of {name: subtree}, so only its name needs
+            # decoding.
+            name, end = decoder.raw_decode(line, line.index('"'))
+            if name.startswith('.') or name in names or name not in self._tree:
+                continue
+            fd.write(line if line.endswith('\n') else line + '\n')
+            copied.add(name)
+            if line.startswith('{".ref"', end + 2):
+                ref = json.loads(line)[name]
+                if '.base' in ref:
+                    stored.add((name, ref['.base']))
+        self._write_entries(fd, [name for name in self._tree if name not in copied], stored)
+
+    def _write_header(self, fd):
+        header = dict(('.' + name, getattr(self, name))
+                      for name in SymbolIndex._SERIALIZED_ATTRIBUTES)
+        header['.lib_locations'] = self._lib_locations
+        if self.lazy:
+            header['.lazy'] = True
+        if self._stamps is not None:
+            header['.python'] = self._python
+            header['.paths'] = self._stamps
+        fd.write(json.dumps(header) + '\n')
+
+    def _write_entries(self, fd, names, stored=()):
+        """Write top-level entries, and the fingerprints not in the store, as JSON lines.
+
+        Large entries in the store's locations are written to the store,
+        along with the fingerprints of their files, and referred to by their
+        digest.
+
+        :param stored: (name, search path) pairs of the stored entries
+            already written to fd, whose fingerprints are left out.
+        """
+        store = self.store
+        stored = set(stored)
+        # Fingerprints by the top-level entry they belong to.
+        grouped = {}
+        if store is not None:
+            for filename, fingerprint in self._fingerprints.items():
+                grouped.setdefault(fingerprint[0].split('.')[0], {})[filename] = fingerprint
+        for name in names:
+            subtree = self._tree[name]
+            shared = (store is not None and isinstance(subtree, SymbolIndex) and
+                      subtree.location in store.locations)
+            # Sorted, so that identical subtrees have identical digests.
+            text = json.dumps(subtree, cls=JSONEncoder, sort_keys=shared)
+            if shared:
+                ref = self._store_entry(text, grouped.get(name, {}))
+                if ref is not None:
+                    text = json.dumps(ref)
+                    if '.base' in ref:
+                        stored.add((name, ref['.base']))
+            fd.write('{%s: %s}\n' % (json.dumps(name), text))
+        fingerprints = self._fingerprints
+        if stored:
+            fingerprints = dict((filename, fingerprint) for filename, fingerprint in fingerprints.items()
+                                if (fingerprint[0].split('.')[0],
+                                    _search_path_of(filename, fingerprint[0])) not in stored)
+        if fingerprints:
+            fd.write(json.dumps({'.fingerprints': fingerprints}) + '\n')
+
+    def _store_entry(self, text, fingerprints):
+        """Write a serialized top-level entry to the store, and return a reference to it.
+
+        The fingerprints of its files are stored with it, and they and the
+        paths of its deferred packages are made relative to the search path
+        the files are in, which the reference records. Identical
+        installations then share an entry.
+
+        :returns: None, to keep the entry in the index, if it and its
+            fingerprints are smaller than the store's min_size, or its files
+            are in more than one search path.
+        """
+        store = self.store
+        bases = set(_search_path_of(filename, fingerprint[0])
+                    for filename, fingerprint in fingerprints.items())
+        if len(bases) > 1:
+            return None
+        if not bases:
+            if len(text) < store.min_size:
+                return None
+            digest = store.digest(text)
+            store.put(digest, text)
+            return {'.ref': digest}
+        base = bases.pop()
+
+        def relative(path):
+            return os.path.relpath(path, base)
+
+        if self.lazy:
+            text = json.dumps(_rebase(json.loads(text), relative), sort_keys=True)
+        fingerprints = dict((relative(filename), fingerprint)
+                            for filename, fingerprint in fingerprints.items())
+        fingerprints_text = json.dumps(fingerprints, sort_keys=True)
+        if len(text) + len(fingerprints_text) < store.min_size:
+            return None
+        # Installing the same files again gives them new mtimes, so they are
+        # left out of the digest.
+        key = dict((filename, fingerprint[:1] + fingerprint[2:])
+                   for filename, fingerprint in fingerprints.items())
+        digest = store.digest(json.dumps(key, sort_keys=True) + text)
+        store.put(digest, '{".fingerprints": %s, %s' % (fingerprints_text, text[1:]))
+        return {'.ref': digest, '.base': base}
+
+    def _spill_finished(self):
+        """Write the top-level packages built so far to the spill file and drop them."""
+        # Aliased packages are linked to from other nodes, so stay put.
+        aliased = set(path.split('.')[0] for path in SymbolIndex.PACKAGE_ALIASES)
+        names = [name for name, subtree in self._tree.items()
+                 if isinstance(subtree, SymbolIndex) and name not in aliased]
+        if not names and not self._fingerprints:
+            return
+        if self._report is not None and self._spill_reported:
+            for name in names:
+                self._report.add_subtree(name, self._tree[name])
+        self._write_entries(self._spill, names)
+        for name in names:
+            del self._tree[name]
+        self._fingerprints.clear()
 
     def boost(self):
         return LOCATION_BOOSTS.get(self.location, 1.0)
@@ -359,6 +1646,8 @@ class SymbolIndex(object):
         if type(value) is float:
             return [None, key[0]], key_score * scope.boost()
         else:
+            if len(key) > 1 and not value._expand():
+                return [], 0.0
             path, score = self._score_key(value, key[1:])
             return [key[0]] + path, (score + value.score) * scope.boost()
 
@@ -376,6 +1665,395 @@ class SymbolIndex(object):
         return 'L'
 
 
+def unique_paths(paths):
+    """Drop search paths that lead to the same directory as an earlier one.
+
+    Paths are compared by real path, and by device and inode, so symlinks,
+    bind mounts and prefixes such as /usr and /usr/local that share a
+    directory are all caught.
+
+    :returns: A tuple of (the remaining paths in their original order and
+        form, a list of (skipped path, path it duplicates) tuples).
+    """
+    unique = []
+    duplicates = []
+    seen = {}
+    for path in paths:
+        keys = [os.path.realpath(path or '.')]
+        try:
+            st = os.stat(path or '.')
+        except OSError:
+            pass
+        else:
+            if st.st_ino:
+                keys.append((st.st_dev, st.st_ino))
+        original = next((seen[key] for key in keys if key in seen), None)
+        if original is not None:
+            logger.debug('skipping search path %s, which is the same as %s', path, original)
+            duplicates.append((path, original))
+            continue
+        for key in keys:
+            seen[key] = path
+        unique.append(path)
+    return unique, duplicates
+
+
+def read_header(file):
+    """Read the first line of an index file, without loading the rest.
+
+    :returns: A dict of the index's attributes, including the interpreter
+        it was built with and the stamps of its search paths, or None if the
+        file is a single document, as written by older versions.
+    """
+    header = json.loads(file.readline())
+    if any(not key.startswith('.') for key in header):
+        return None
+    return header
+
+
+def stale_paths(header, paths, version=None):
+    """Compare the header of an index file with the search paths it would be built from now.
+
+    This costs a stat() per search path and per top-level module and
+    package in it, and a listing of the search paths whose own mtime
+    changed. Installing or removing a package changes the mtime of the
+    directory it was installed into, and adding or removing a module changes
+    the mtime of its package's directory.
+
+    :param header: As returned by read_header().
+    :param paths: The search paths the index would be built from now.
+    :param version: The sys.version of the interpreter that would build
+        the index, if not this one.
+    :returns: None if the index was built by another interpreter and
+        has to be rebuilt, otherwise a tuple of (paths that are new or changed
+        as a whole and the top-level modules and packages of other paths that
+        were added, changed or deleted, paths no longer searched). An index
+        without stamps is taken to be up to date.
+    """
+    if header is None or '.paths' not in header:
+        return [], []
+    if header.get('.python') != (version or sys.version):
+        return None
+    built = dict((stamp[0], stamp) for stamp in header['.paths'])
+    changed = []
+    for path in paths:
+        changed.extend(_stale_entries(built[path]) if path in built else [path])
+    removed = [path for path in built if path not in paths]
+    return changed, removed
+
+
+def _stale_entries(stamp):
+    """Return the top-level entries of a stamped search path that changed since.
+
+    :returns: A list of modules and package directories, or of the search
+        path itself if it changed as a whole.
+    """
+    path, mtime = stamp[:2]
+    dir = path or '.'
+    now = _mtime(dir)
+    if len(stamp) < 3 or now is None or not os.path.isdir(dir):
+        return [path] if now != mtime else []
+    entries = stamp[2]
+    names = set(entries)
+    if now != mtime:
+        # Entries were added or deleted.
+        names.update(_stamped_entries(dir))
+    return [os.path.join(dir, name) for name in sorted(names)
+            if _mtime(os.path.join(dir, name)) != entries.get(name)]
+
+
+def _stamped_entries(dir):
+    """Return the names of the modules and packages in dir that stamps cover.
+
+    Extension modules, which are imported rather than fingerprinted, and
+    directories that aren't packages, such as .dist-info directories, are
+    left out.
+    """
+    try:
+        listing = _scan(dir, Counter())
+    except OSError:
+        return []
+    names = []
+    for name, path, is_dir, is_file in listing:
+        if name.startswith('_') or name.startswith('.'):
+            continue
+        if is_dir:
+            init = '__init__.pyi' if name.endswith('-stubs') else '__init__.py'
+            if os.path.isfile(os.path.join(path, init)):
+                names.append(name)
+        elif is_file and os.path.splitext(name)[1] in ('.py', '.pyi'):
+            names.append(name)
+    return names
+
+
+def _path_stamps(paths):
+    """Return [path, mtime, {entry: mtime}] stamps for paths.
+
+    Adding or removing a module in a top-level package only changes the
+    mtime of the package's directory, and changing a top-level module only
+    its own, so the top-level modules and packages of each path are stamped
+    too, and stale_paths() can tell which of them changed. Paths that don't
+    exist have an mtime of None.
+    """
+    stamps = []
+    for path in paths:
+        dir = path or '.'
+        mtime = _mtime(dir)
+        entries = {}
+        if mtime is not None and os.path.isdir(dir):
+            for name in _stamped_entries(dir):
+                entries[name] = _mtime(os.path.join(dir, name))
+        stamps.append([path, mtime, entries])
+    return stamps
+
+
+def _mtime(path):
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def _scan(dir, syscalls, links=None):
+    """List a directory.
+
+    :param links: An optional set to add the paths of entries that are
+        symlinks to directories to.
+    :returns: A list of (name, path, is_dir, is_file) tuples.
+    """
+    syscalls['scandir'] += 1
+    if scandir is None:
+        entries = []
+        for name in os.listdir(dir):
+            path = os.path.join(dir, name)
+            syscalls['stat'] += 1
+            is_dir = os.path.isdir(path)
+            if not is_dir:
+                syscalls['stat'] += 1
+            elif links is not None and os.path.islink(path):
+                syscalls['stat'] += 1
+                links.add(path)
+            entries.append((name, path, is_dir, not is_dir and os.path.isfile(path)))
+        return entries
+    entries = []
+    for entry in scandir(dir):
+        is_link = entry.is_symlink()
+        if is_link:
+            # The entry's type is only known for the link itself.
+            syscalls['stat'] += 1
+        is_dir = entry.is_dir()
+        if is_link and is_dir and links is not None:
+            links.add(entry.path)
+        entries.append((entry.name, entry.path, is_dir, not is_dir and entry.is_file()))
+    return entries
+
+
+def extract_symbols(filename, source, scanner='ast', stats=None):
+    """Extract top-level symbols from Python source.
+
+    :param scanner: "ast" to always parse the source, "stub" to parse it as a
+        stub file, "exports" to only find its __all__ or classes, or the name
+        of one of SCANNERS to try first.
+    :param stats: An optional Counter to add the seconds spent in each phase
+        ("scan", "parse" and "visit") to.
+    :returns: A list of (name, score, exported) tuples in the order they were
+        found, or None if the source could not be parsed.
+    """
+    if stats is None:
+        stats = Counter()
+    if scanner == 'exports':
+        # Modules with an __all__ are parsed, as only their exports are
+        # kept anyway.
+        if b'__all__' not in source:
+            start = time.time()
+            symbols = public_names(source)
+            stats['scan'] += time.time() - start
+            return symbols
+        scanner = 'ast'
+    if scanner not in ('ast', 'stub'):
+        start = time.time()
+        try:
+            return SCANNERS[scanner](filename, source)
+        except Ambiguous as e:
+            logger.debug('falling back to parsing %s: %s', filename, e)
+        finally:
+            stats['scan'] += time.time() - start
+    start = time.time()
+    try:
+        st = parse_ast(source, filename)
+    except Exception as e:
+        logger.debug('failed to parse %s: %s', filename, e)
+        return None
+    finally:
+        stats['parse'] += time.time() - start
+    start = time.time()
+    collector = _SymbolCollector()
+    visitor = StubVisitor if scanner == 'stub' else SymbolVisitor
+    try:
+        visitor(collector).visit(st)
+    except RuntimeError as e:
+        # Such as exceeding the recursion limit on deeply nested expressions.
+        logger.debug('failed to visit %s: %s', filename, e)
+        return None
+    finally:
+        stats['visit'] += time.time() - start
+    return collector.symbols
+
+
+def _extract_file_symbols(filename, scanner='ast', symbol_cache=None, stats=None, read=None,
+                          generated='index'):
+    """Read and extract symbols from filename.
+
+    :param stats: An optional Counter, to which extract_symbols() adds its
+        timings, "cached" is added on a symbol cache hit, "generated" if
+        the file is generated and "skipped" if it is left out because of
+        that.
+    :param read: Reads the file, as _read_file() does, which is the default.
+    :param generated: What to do with the file if it is generated, one of
+        GENERATED_POLICIES.
+    :returns: A tuple of ([mtime, size, sha1 of content], symbols), where
+        symbols is None if the file failed to parse or was skipped.
+    """
+    if stats is None:
+        stats = Counter()
+    fingerprint, source = (read or _read_file)(filename)
+    scanner = _choose_scanner(filename, source, scanner, generated, stats)
+    if scanner is None:
+        return fingerprint, None
+    if symbol_cache is None:
+        return fingerprint, extract_symbols(filename, source, scanner, stats)
+    key = _symbol_key(scanner, fingerprint)
+    symbols = symbol_cache.get(key, _MISSING)
+    if symbols is _MISSING:
+        symbols = extract_symbols(filename, source, scanner, stats)
+        symbol_cache.put(key, symbols)
+    else:
+        stats['cached'] += 1
+    return fingerprint, symbols
+
+
+def _extract_file_stats(job, scanner='ast'):
+    """Like _extract_file_symbols(), also returning its stats and the scanner it used.
+
+    :param job: A tuple of (filename, policy for generated modules).
+    """
+    # Module level so that it can be pickled for pool workers.
+    filename, generated = job
+    stats = Counter()
+    fingerprint, source = _read_file(filename)
+    scanner = _choose_scanner(filename, source, scanner, generated, stats)
+    symbols = None
+    if scanner is not None:
+        symbols = extract_symbols(filename, source, scanner, stats)
+    return fingerprint, symbols, stats, scanner
+
+
+def _choose_scanner(filename, source, scanner, generated, stats):
+    """Pick the scanner to extract the symbols of filename with.
+
+    :returns: The scanner, or None if filename is to be skipped.
+    """
+    if filename.endswith('.pyi'):
+        scanner = 'stub'
+    if generated != 'index' and is_generated(filename, source):
+        stats['generated'] += 1
+        if generated == 'skip':
+            logger.debug('skipping generated module %s', filename)
+            stats['skipped'] += 1
+            return None
+        scanner = 'exports'
+    return scanner
+
+
+def _rebase(data, rebase):
+    """Copy serialized index data, passing the paths of files and deferred packages through rebase."""
+    copy = {}
+    for key, value in data.items():
+        if key == '.fingerprints':
+            value = dict((rebase(filename), fingerprint) for filename, fingerprint in value.items())
+        elif key == '.unexpanded':
+            value = rebase(value)
+        elif isinstance(value, dict):
+            value = _rebase(value, rebase)
+        copy[key] = value
+    return copy
+
+
+def _search_path_of(filename, module_path):
+    """The search path filename was found in, as the module module_path."""
+    levels = module_path.count('.') + 1
+    if os.path.splitext(os.path.basename(filename))[0] == '__init__':
+        levels += 1
+    for _ in range(levels):
+        filename = os.path.dirname(filename)
+    return filename
+
+
+def _prefer_stubs(entries):
+    """Drop the directory entries of modules better indexed from a sibling.
+
+    Stubs are indexed instead of extension modules, which would otherwise
+    have to be imported, but source modules are preferred over stubs.
+    """
+    if not any(name.endswith('.pyi') for name, _, _, _ in entries):
+        return entries
+    extensions = {}
+    for name, _, _, is_file in entries:
+        if is_file:
+            extensions.setdefault(name.split('.', 1)[0], set()).add(os.path.splitext(name)[1].lower())
+    preferred = []
+    for entry in entries:
+        name, _, _, is_file = entry
+        if is_file:
+            ext = os.path.splitext(name)[1].lower()
+            siblings = extensions[name.split('.', 1)[0]]
+            if ext == '.pyi' and '.py' in siblings:
+                continue
+            if ext in EXTENSION_EXTENSIONS and '.pyi' in siblings:
+                continue
+        preferred.append(entry)
+    return preferred
+
+
+def _read_file(filename):
+    """:returns: A tuple of ([mtime, size, sha1 of content], source)."""
+    with open(filename, 'rb') as fd:
+        source = fd.read()
+        st = os.fstat(fd.fileno())
+    return [st.st_mtime, st.st_size, hashlib.sha1(source).hexdigest()], source
+
+
+def _stamp(filename):
+    """:returns: [mtime, size] of filename, or None if it can't be stat()ed."""
+    try:
+        st = os.stat(filename)
+    except OSError:
+        return None
+    return [st.st_mtime, st.st_size]
+
+
+def _parse_seconds(stats):
+    """The seconds extract_symbols() spent on a file, from its stats."""
+    return stats['scan'] + stats['parse'] + stats['visit']
+
+
+def _symbol_key(scanner, fingerprint):
+    return '%s:%s' % (scanner, fingerprint[2])
+
+
+class _SymbolCollector(object):
+    """Stands in for a SymbolIndex, recording what SymbolVisitor adds."""
+
+    def __init__(self):
+        self.symbols = []
+
+    def add(self, name, score):
+        self.symbols.append((name, score, False))
+
+    def add_explicit_export(self, name, score):
+        self.symbols.append((name, score, True))
+
+
 class SymbolVisitor(ast.NodeVisitor):
     def __init__(self, tree):
         self._tree = tree
@@ -417,6 +2095,14 @@ class SymbolVisitor(ast.NodeVisitor):
         pass
 
 
+class StubVisitor(SymbolVisitor):
+    """Visits .pyi stubs, which declare module variables with annotations."""
+
+    def visit_AnnAssign(self, node):
+        if isinstance(node.target, ast.Name) and not node.target.id.startswith('_'):
+            self._tree.add(node.target.id, 1.1)
+
+
 if __name__ == '__main__':
     # print ast.dump(ast.parse(open('pyautoimp.py').read(), 'pyautoimp.py'))
     tree = SymbolIndex()
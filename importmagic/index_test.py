@@ -2,10 +2,16 @@ from __future__ import absolute_import
 
 import json
 import re
+import zipfile
 from textwrap import dedent
 
-from importmagic.index import SymbolIndex
-from importmagic.six import b
+from importmagic.index import SymbolIndex, read_header, stale_paths, unique_paths
+from importmagic.report import BuildReport
+from importmagic.six import StringIO, b
+
+
+# tmpdir paths contain the test name, which the default blacklist rejects.
+NO_BLACKLIST_RE = re.compile('^$')
 
 
 def serialize(tree):
@@ -62,7 +68,7 @@ def test_index_file_with_all():
     tree = SymbolIndex()
     with tree.enter('test') as subtree:
         subtree.index_source('test.py', src)
-    assert serialize(subtree) == {".location": "L", ".score": 1.0, "one": 1.2}
+    assert serialize(subtree) == {".location": "L", ".score": 1.0, ".exports": {"one": 1.2}, "one": 1.2}
 
 
 def test_index_if_name_main():
@@ -114,3 +120,406 @@ def test_encoding_score(index):
 def test_score_boosts_apply_to_scopes(index):
     print(index.symbol_scores('basename'))
     assert index.symbol_scores('basename')[0][1:] == ('os.path', 'basename')
+
+
+def test_index_parallel_build_matches_serial(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('class Cls:\n pass\n')
+    pkg.join('exported.py').write("__all__ = ['one']\none = 1\ntwo = 2\n")
+    pkg.join('syntaxerr.py').write('def func3():\n')
+    sub = pkg.mkdir('sub')
+    sub.join('__init__.py').write('from os import path\n')
+    for i in range(10):
+        sub.join('mod%d.py' % i).write('def func%d():\n pass\n' % i)
+    tmpdir.join('toplevel.py').write('import sys\nvalue = 1\n')
+    serial = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    serial.build_index([str(tmpdir)])
+    parallel = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    parallel.build_index([str(tmpdir)], processes=2)
+    assert parallel.serialize() == serial.serialize()
+    assert 'mod9' in parallel._tree['pkg']._tree['sub']._tree
+    assert 'syntaxerr' not in parallel._tree['pkg']._tree
+
+
+def test_index_update_patches_changed_modules(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('class Cls:\n pass\n')
+    pkg.join('changed.py').write('def before():\n pass\n')
+    pkg.join('deleted.py').write('def gone():\n pass\n')
+    pkg.join('unchanged.py').write('def same():\n pass\n')
+    gonepkg = tmpdir.mkdir('gonepkg')
+    gonepkg.join('__init__.py').write('x = 1\n')
+    gonepkg.join('mod.py').write('y = 1\n')
+    exporting = tmpdir.mkdir('exporting')
+    exporting.join('__init__.py').write('__all__ = ["x"]\nx = 1\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(tmpdir)])
+    assert str(pkg.join('changed.py')) in tree._fingerprints
+
+    pkg.join('changed.py').write('def after_the_change():\n pass\n')
+    pkg.join('deleted.py').remove()
+    gonepkg.remove()
+    pkg.join('added.py').write('def new():\n pass\n')
+    newpkg = tmpdir.mkdir('newpkg')
+    newpkg.join('__init__.py').write('z = 1\n')
+    # Left out of a package that only exports what its __all__ lists.
+    exporting.join('unlisted.py').write('y = 1\n')
+    assert tree.update_index([str(tmpdir)]) == 7
+    assert sorted(tree.find('exporting')._tree) == ['x']
+    assert tree.update_index([str(tmpdir)]) == 0
+
+    rebuilt = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    rebuilt.build_index([str(tmpdir)])
+    assert serialize(tree) == serialize(rebuilt)
+
+
+def test_index_update_files(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('changed.py').write('def before():\n pass\n')
+    pkg.join('deleted.py').write('def gone():\n pass\n')
+    paths = [str(tmpdir)]
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index(paths)
+    assert tree.take_touched() == []
+    old = StringIO()
+    tree.serialize(old)
+
+    pkg.join('changed.py').write('def after_the_change():\n pass\n')
+    pkg.join('deleted.py').remove()
+    pkg.join('added.py').write('def new():\n pass\n')
+    newpkg = tmpdir.mkdir('newpkg')
+    newpkg.join('__init__.py').write('z = 1\n')
+    newpkg.join('mod.py').write('y = 1\n')
+    changes = [str(pkg.join(name)) for name in ('changed.py', 'deleted.py', 'added.py')]
+    assert tree.update_files(changes + [str(newpkg)], paths) == 5
+    assert tree.symbol_scores('after_the_change')[0][1:] == ('pkg.changed', 'after_the_change')
+    assert tree.find('newpkg.mod') is not None
+    touched = tree.take_touched()
+    assert touched == ['newpkg', 'pkg']
+    assert tree.take_touched() == []
+
+    rebuilt = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    rebuilt.build_index(paths)
+    assert serialize(tree) == serialize(rebuilt)
+    # Rewriting only the touched entries gives the same index.
+    old.seek(0)
+    rewritten = StringIO()
+    tree.rewrite(old, rewritten, touched)
+    rewritten.seek(0)
+    assert serialize(SymbolIndex.deserialize(rewritten, NO_BLACKLIST_RE)) == serialize(rebuilt)
+
+
+def test_index_lazy_packages_expand_on_lookup(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('top.py').write('def toplevel():\n pass\n')
+    sub = pkg.mkdir('sub')
+    sub.join('__init__.py').write('')
+    sub.join('deep.py').write('def deepfunc():\n pass\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, lazy=True)
+    tree.build_index([str(tmpdir)])
+    assert tree.symbol_scores('toplevel')[0][1:] == ('pkg.top', 'toplevel')
+    assert tree._tree['pkg']._tree['sub']._unexpanded == str(sub)
+    assert not tree.symbol_scores('deepfunc')
+
+    # Expansion state survives a round trip through the index file.
+    loaded = SymbolIndex.deserialize(StringIO(tree.serialize()), NO_BLACKLIST_RE)
+    assert loaded.lazy
+    assert loaded.symbol_scores('pkg.sub.deep.deepfunc')[0][1:] == ('pkg.sub.deep', None)
+    assert loaded.dirty
+    assert serialize(loaded)['pkg']['sub']['deep'] == {
+        '.location': 'L', '.score': 1.0, 'deepfunc': 1.1}
+    reloaded = SymbolIndex.deserialize(StringIO(loaded.serialize()), NO_BLACKLIST_RE)
+    assert reloaded.find('pkg.sub.deep') is not None
+    assert not reloaded.dirty
+
+    # A deferred package that was deleted since is dropped on lookup.
+    sub.remove()
+    gone = SymbolIndex.deserialize(StringIO(tree.serialize()), NO_BLACKLIST_RE)
+    assert [score[1] for score in gone.symbol_scores('pkg.sub.deep')] == ['pkg']
+    assert gone.find('pkg.sub') is None
+    assert 'sub' not in gone.find('pkg')._tree
+
+
+def test_index_walk_counts_syscalls(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    node = pkg
+    for depth in range(5):
+        node = node.mkdir('sub%d' % depth)
+        node.join('__init__.py').write('')
+    data = tmpdir.mkdir('data')
+    for i in range(10):
+        data.join('file%d.txt' % i).write('')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(tmpdir)])
+    assert tree.find('pkg.sub0.sub1.sub2.sub3.sub4') is not None
+    # One listing for the root and each of the six packages, and one stat
+    # per candidate package; the data directory is never listed.
+    assert tree.syscalls['scandir'] == 7
+    assert tree.syscalls['stat'] - tree.syscalls['open'] == 7
+    # Counters and other build state are only kept on the root.
+    assert sorted(vars(tree.find('pkg.sub0'))) == [
+        '_blacklist_re', '_exports', '_name', '_parent', '_tree', '_unexpanded', 'location',
+        'score']
+
+
+def test_index_prefers_stubs_to_extension_modules(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    # Importing this would fail, so it must not be imported.
+    pkg.join('fast.cpython-36m-x86_64-linux-gnu.so').write('')
+    pkg.join('fast.pyi').write('def compute(x: int) -> int: ...\nVERSION: str\n')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    pkg.join('mod.pyi').write('def stubbed() -> None: ...\n')
+    stubs = tmpdir.mkdir('other-stubs')
+    stubs.join('__init__.pyi').write('class Thing: ...\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(tmpdir)])
+    assert sorted(tree.find('pkg.fast')._tree) == ['VERSION', 'compute']
+    assert sorted(tree.find('pkg.mod')._tree) == ['func']
+    assert sorted(tree.find('other')._tree) == ['Thing']
+
+
+def test_index_zip_archive(tmpdir):
+    egg = str(tmpdir.join('dist-1.0-py3.egg'))
+    with zipfile.ZipFile(egg, 'w') as archive:
+        archive.writestr('pkg/__init__.py', 'class Cls:\n pass\n')
+        archive.writestr('pkg/sub/__init__.py', '')
+        archive.writestr('pkg/sub/mod.py', 'def func():\n pass\n')
+        archive.writestr('notpkg/mod.py', 'def hidden():\n pass\n')
+        archive.writestr('EGG-INFO/PKG-INFO', '')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([egg])
+    assert sorted(tree.find('pkg')._tree) == ['Cls', 'sub']
+    assert sorted(tree.find('pkg.sub.mod')._tree) == ['func']
+    assert tree.find('notpkg') is None
+    # Archive members can't be updated incrementally.
+    assert tree._fingerprints == {}
+    assert tree.update_index([egg]) == 0
+
+
+def make_distribution(site, name, files):
+    dist_info = site.mkdir('%s-1.0.dist-info' % name)
+    records = ['%s,,' % path for path in files] + ['%s-1.0.dist-info/RECORD,,' % name]
+    dist_info.join('RECORD').write('\n'.join(records) + '\n')
+    for path in files:
+        site.join(path).write('def %s():\n pass\n' % path.replace('/', '_')[:-3], ensure=True)
+
+
+def test_index_lists_distribution_modules_from_metadata(tmpdir):
+    site = tmpdir.mkdir('site')
+    make_distribution(site, 'dist', ['pkg/__init__.py', 'pkg/mod.py'])
+    # Not recorded, so not importable as far as the index is concerned.
+    site.join('pkg', 'stray.py').write('def stray():\n pass\n')
+    site.join('loose.py').write('def loose():\n pass\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, metadata=True)
+    tree.build_index([str(site)])
+    assert sorted(tree.find('pkg')._tree) == ['mod', 'pkg___init__']
+    assert tree.find('loose') is not None
+    # Only the installation directory itself is listed.
+    assert tree.syscalls['scandir'] == 1
+
+
+def test_index_prunes_excluded_directories(tmpdir):
+    tmpdir.join('.gitignore').write('generated/\n/pkg/scratch.py\n')
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    pkg.join('scratch.py').write('def scratch():\n pass\n')
+    for name in ('generated', 'node_modules', 'mytests'):
+        excluded = pkg.mkdir(name)
+        excluded.join('__init__.py').write('')
+        excluded.join('mod.py').write('def hidden():\n pass\n')
+    kept = pkg.mkdir('kept')
+    kept.join('__init__.py').write('')
+    kept.join('.ignore').write('*.py\n!__init__.py\n')
+    kept.join('mod.py').write('def hidden():\n pass\n')
+    tree = SymbolIndex(blacklist_re=re.compile('mytests'), exclude=['node_modules/'])
+    tree.build_index([str(tmpdir)])
+    assert sorted(tree.find('pkg')._tree) == ['kept', 'mod']
+    assert tree.find('pkg.kept')._tree == {}
+    # Excluded directories are never listed or checked for __init__.py.
+    assert tree.syscalls['scandir'] == 3
+    assert tree.syscalls['stat'] - tree.syscalls['open'] == 2
+
+
+def test_index_skips_duplicate_paths_and_symlink_cycles(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    pkg.join('loop').mksymlinkto(tmpdir)
+    tmpdir.join('alias').mksymlinkto(tmpdir)
+    report = BuildReport()
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index([str(tmpdir), str(tmpdir.join('alias')), str(tmpdir) + '/'], report=report)
+    assert sorted(tree.find('pkg')._tree) == ['mod']
+    assert tree.find('alias') is None
+    assert [path for path, _ in report.duplicates] == [
+        str(tmpdir.join('alias')), str(tmpdir) + '/', str(tmpdir.join('alias')),
+        str(pkg.join('loop'))]
+    assert unique_paths([str(tmpdir), str(tmpdir.join('alias'))])[0] == [str(tmpdir)]
+
+
+def test_index_builds_in_phases(tmpdir):
+    project = tmpdir.mkdir('project')
+    project.join('app.py').write('def main():\n pass\n')
+    site = tmpdir.mkdir('site-packages')
+    site.join('lib.py').write('def helper():\n pass\n')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    snapshots = []
+
+    def progress(phase):
+        snapshots.append((phase, tree.snapshot()))
+
+    tree.build_index([str(site), str(project)], progress=progress)
+    assert [phase for phase, _ in snapshots] == ['local', 'builtins', 'stdlib', 'third-party']
+    local = snapshots[0][1]
+    assert sorted(local.find('app')._tree) == ['main']
+    assert local.find('lib') is None
+    assert local.find('sys') is None
+    assert snapshots[1][1].find('sys') is not None
+    assert snapshots[-1][1].serialize() == tree.serialize()
+
+
+def test_index_spills_finished_packages(tmpdir):
+    for name in ('one', 'two'):
+        pkg = tmpdir.mkdir(name)
+        pkg.join('__init__.py').write('')
+        pkg.join('mod.py').write('def func():\n pass\n')
+    tmpdir.join('three.py').write('value = 1\n')
+    expected = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    expected.build_index([str(tmpdir)])
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    spill = StringIO()
+    tree.build_index([str(tmpdir)], spill=spill)
+    assert tree.find('one') is None
+    lines = spill.getvalue().splitlines()
+    assert any(json.loads(line).keys() == {'one'} for line in lines)
+    loaded = SymbolIndex.deserialize(StringIO(spill.getvalue()), NO_BLACKLIST_RE)
+    assert serialize(loaded) == serialize(expected)
+    streamed = StringIO()
+    expected.serialize(streamed)
+    assert len(streamed.getvalue().splitlines()) > 1
+    assert serialize(SymbolIndex.deserialize(StringIO(streamed.getvalue()))) == serialize(expected)
+
+
+def test_index_spills_packages_merged_across_paths(tmpdir):
+    first = tmpdir.mkdir('a').mkdir('pkg')
+    first.join('__init__.py').write("__all__ = ['x']\nx = 1\n")
+    second = tmpdir.mkdir('b').mkdir('pkg')
+    second.join('__init__.py').write('y = 1\n')
+    second.join('mod.py').write('z = 1\n')
+    paths = [str(tmpdir.join('a')), str(tmpdir.join('b'))]
+    expected = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    expected.build_index(paths)
+    assert sorted(expected.find('pkg')._tree) == ['x']
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    spill = StringIO()
+    tree.build_index(paths, spill=spill)
+    loaded = SymbolIndex.deserialize(StringIO(spill.getvalue()), NO_BLACKLIST_RE)
+    assert sorted(loaded.find('pkg')._tree) == ['x']
+    assert serialize(loaded) == serialize(expected)
+
+
+def test_index_rebuilds_only_some_locations(tmpdir):
+    project = tmpdir.mkdir('project')
+    project.join('app.py').write('def old_app():\n pass\n')
+    site = tmpdir.mkdir('site-packages')
+    site.join('lib.py').write('def old_lib():\n pass\n')
+    paths = [str(project), str(site)]
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index(paths)
+    old = StringIO()
+    tree.serialize(old)
+    project.join('app.py').write('def new_app():\n pass\n')
+    project.join('extra.py').write('value = 1\n')
+    site.join('lib.py').write('def new_lib():\n pass\n')
+    names = tree.rebuild_locations(paths, ['L'])
+    assert names == ['app', 'extra']
+    assert tree.find('app')._tree == {'new_app': 1.1}
+    assert tree.find('extra')._tree == {'value': 1.1}
+    # Third-party code is left alone, however stale.
+    assert tree.find('lib')._tree == {'old_lib': 1.1}
+    assert tree.find('os.path') and tree.find('__future__')
+    assert sorted(fingerprint[0] for fingerprint in tree._fingerprints.values()) == \
+        ['app', 'extra', 'lib']
+    rewritten = StringIO()
+    old.seek(0)
+    tree.rewrite(old, rewritten, names)
+    lib_lines = [line for line in old.getvalue().splitlines() if line.startswith('{"lib"')]
+    assert lib_lines[0] in rewritten.getvalue().splitlines()
+    loaded = SymbolIndex.deserialize(StringIO(rewritten.getvalue()), NO_BLACKLIST_RE)
+    assert serialize(loaded) == serialize(tree)
+
+
+def test_index_header_finds_stale_paths(tmpdir):
+    project = tmpdir.mkdir('project')
+    project.join('app.py').write('value = 1\n')
+    pkg = project.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    site = tmpdir.mkdir('site-packages')
+    site.join('lib.py').write('value = 1\n')
+    upgraded = site.mkdir('upgraded')
+    upgraded.join('__init__.py').write('def old():\n pass\n')
+    site.mkdir('upgraded-1.0.dist-info').join('RECORD').write('')
+    site.mkdir('data').join('file.txt').write('')
+    old = tmpdir.mkdir('old')
+    old.join('gone.py').write('value = 1\n')
+    egg = tmpdir.join('dist-1.0-py3.egg')
+    with zipfile.ZipFile(str(egg), 'w') as archive:
+        archive.writestr('zipped.py', 'def old():\n pass\n')
+    paths = [str(project), str(site), str(old), str(egg)]
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE)
+    tree.build_index(paths)
+    fd = StringIO()
+    tree.serialize(fd)
+    fd.seek(0)
+    header = read_header(fd)
+    # Only top-level modules and packages are stamped.
+    assert sorted(header['.paths'][1][2]) == ['lib.py', 'upgraded']
+    assert stale_paths(header, paths) == ([], [])
+    assert stale_paths(dict(header, **{'.python': 'another'}), paths) is None
+    assert stale_paths(dict(header, **{'.python': 'another'}), paths, 'another') == ([], [])
+    # Saving an index keeps the interpreter it was built by.
+    another = StringIO(json.dumps(dict(header, **{'.python': 'another'})) + '\n')
+    resaved = StringIO()
+    SymbolIndex.deserialize(another, NO_BLACKLIST_RE).serialize(resaved)
+    assert read_header(StringIO(resaved.getvalue()))['.python'] == 'another'
+    # Installing a package changes the directory's mtime, and adding a
+    # module to a package that of the package's directory.
+    site.join('new.py').write('value = 1\n')
+    site.setmtime(header['.paths'][1][1] + 10)
+    pkg.join('added.py').write('value = 1\n')
+    pkg.setmtime(header['.paths'][0][2]['pkg'] + 10)
+    # As pip upgrades a package, by replacing its directory.
+    upgraded.remove()
+    upgraded = site.mkdir('upgraded')
+    upgraded.join('__init__.py').write('def new():\n pass\n')
+    upgraded.setmtime(header['.paths'][1][2]['upgraded'] + 10)
+    with zipfile.ZipFile(str(egg), 'w') as archive:
+        archive.writestr('zipped.py', 'def new():\n pass\n')
+    egg.setmtime(header['.paths'][3][1] + 10)
+    now = [str(project), str(site), str(egg)]
+    changed, removed = stale_paths(header, now)
+    # Only the entries that changed are refreshed, or whole paths that
+    # aren't directories.
+    entries = [str(pkg), str(site.join('new.py')), str(upgraded), str(egg)]
+    assert (changed, removed) == (entries, [str(old)])
+    fd.seek(0)
+    loaded = SymbolIndex.deserialize(fd, NO_BLACKLIST_RE)
+    loaded.refresh_paths(now, changed, removed)
+    assert loaded.find('new') and not loaded.find('gone')
+    assert loaded.find('pkg.added')
+    assert sorted(loaded.find('upgraded')._tree) == ['new']
+    # Archive members aren't fingerprinted, so the egg's location is rebuilt.
+    assert sorted(loaded.find('zipped')._tree) == ['new']
+    fd = StringIO()
+    loaded.serialize(fd)
+    fd.seek(0)
+    assert stale_paths(read_header(fd), now) == ([], [])
+    # Older single document indexes can't be checked.
+    assert read_header(StringIO(tree.serialize())) is None
+    assert stale_paths(None, now) == ([], [])
@@ -0,0 +1,176 @@
+"""Introspect builtin and extension modules in worker subprocesses.
+
+Extension modules can't be parsed, so the only way to find their symbols is
+to import them. Doing that in the indexing process loads every native
+library it finds into memory, and one that hangs or crashes takes the build
+with it. Introspector imports them in a small pool of worker processes
+instead, feeding each worker batches of module names and reading back only
+the names each module defines.
+"""
+
+import os
+import sys
+
+import json
+import logging
+import subprocess
+import threading
+
+from importmagic.six.moves import queue
+
+
+logger = logging.getLogger(__name__)
+
+
+# Run with "python -c", so that it works with any interpreter, whether or not
+# importmagic is importable there. Reads module names from stdin and writes a
+# JSON result for each one to stdout.
+_WORKER = r'''
+import json, os, sys
+# Keep whatever imported modules read or print away from the protocol.
+input = os.fdopen(os.dup(0), 'r')
+output = os.fdopen(os.dup(1), 'w')
+null = os.open(os.devnull, os.O_RDONLY)
+os.dup2(null, 0)
+os.dup2(2, 1)
+sys.stdout = sys.stderr
+while True:
+    name = input.readline()
+    if not name:
+        break
+    name = name.strip()
+    try:
+        module = __import__(name, fromlist=['.'])
+        result = {'name': name, 'names': [k for k in vars(module) if not k.startswith('_')]}
+    except BaseException as e:
+        result = {'name': name, 'error': '%s: %s' % (type(e).__name__, e)}
+    output.write(json.dumps(result) + '\n')
+    output.flush()
+'''
+
+
+class Introspector(object):
+    """Find the names defined by modules by importing them in subprocesses.
+
+    :param python: The interpreter to run workers with. Defaults to the
+        current one.
+    :param workers: Number of worker processes.
+    :param batch_size: Number of modules sent to a worker at a time.
+    :param timeout: Seconds to wait for a single module to import before
+        giving up on it and restarting the worker.
+    """
+
+    def __init__(self, python=None, workers=2, batch_size=50, timeout=10.0):
+        self.python = python or sys.executable
+        self.workers = max(1, workers)
+        self.batch_size = max(1, batch_size)
+        self.timeout = timeout
+
+    def introspect(self, names):
+        """Import each of names in a worker.
+
+        :returns: A dict mapping each module name to the list of public names
+            it defines, in definition order, or to None if it failed to
+            import, timed out or crashed its worker.
+        """
+        unique = []
+        for name in names:
+            if name not in unique:
+                unique.append(name)
+        batches = queue.Queue()
+        for i in range(0, len(unique), self.batch_size):
+            batches.put(unique[i:i + self.batch_size])
+        results = {}
+        threads = [threading.Thread(target=self._drive, args=(batches, results))
+                   for _ in range(min(self.workers, batches.qsize()))]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        logger.debug('introspected %d modules in %d workers, %d failed', len(unique),
+                     len(threads), sum(1 for value in results.values() if value is None))
+        return results
+
+    def _drive(self, batches, results):
+        """Feed batches to one worker, replacing it whenever a module hangs or crashes it."""
+        worker = None
+        try:
+            while True:
+                try:
+                    pending = batches.get_nowait()
+                except queue.Empty:
+                    return
+                while pending:
+                    if worker is None:
+                        worker = _Worker(self.python)
+                    worker.send(pending)
+                    while pending:
+                        name = pending.pop(0)
+                        result = worker.receive(self.timeout)
+                        if result is None or result.get('name') != name:
+                            logger.debug('worker failed while importing %s, restarting it', name)
+                            results[name] = None
+                            worker.kill()
+                            worker = None
+                            break
+                        if 'error' in result:
+                            logger.debug('failed to import %s: %s', name, result['error'])
+                        results[name] = result.get('names')
+        finally:
+            if worker is not None:
+                worker.kill()
+
+
+class _Worker(object):
+    def __init__(self, python):
+        self._devnull = open(os.devnull, 'wb')
+        self._process = subprocess.Popen([python, '-c', _WORKER], stdin=subprocess.PIPE,
+                                         stdout=subprocess.PIPE, stderr=self._devnull)
+        self._lines = queue.Queue()
+        # Reading on a thread is what allows receive() to time out.
+        reader = threading.Thread(target=self._read)
+        reader.daemon = True
+        reader.start()
+
+    def send(self, names):
+        try:
+            self._process.stdin.write(''.join(name + '\n' for name in names).encode('utf-8'))
+            self._process.stdin.flush()
+        except (IOError, OSError) as e:
+            # The worker has died. receive() will report that.
+            logger.debug('failed to send modules to worker: %s', e)
+
+    def receive(self, timeout):
+        """Return the next result, or None if the worker timed out or died."""
+        try:
+            line = self._lines.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if line is None:
+            return None
+        try:
+            return json.loads(line.decode('utf-8'))
+        except ValueError:
+            return None
+
+    def kill(self):
+        try:
+            self._process.kill()
+        except OSError:
+            pass
+        self._process.wait()
+        for pipe in (self._process.stdin, self._process.stdout):
+            try:
+                pipe.close()
+            except (IOError, OSError):
+                pass
+        self._devnull.close()
+
+    def _read(self):
+        try:
+            for line in iter(self._process.stdout.readline, b''):
+                self._lines.put(line)
+        except (IOError, OSError, ValueError):
+            pass
+        self._lines.put(None)
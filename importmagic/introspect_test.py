@@ -0,0 +1,28 @@
+from __future__ import absolute_import
+
+import json
+
+from importmagic.index import SymbolIndex
+from importmagic.introspect import Introspector
+
+
+def test_introspector_isolates_failing_modules(tmpdir, monkeypatch):
+    tmpdir.join('hang.py').write('import time\ntime.sleep(60)\n')
+    tmpdir.join('crash.py').write('import os\nos._exit(1)\n')
+    tmpdir.join('noisy.py').write('print("hello")\nvalue = 1\n_private = 2\n')
+    monkeypatch.setenv('PYTHONPATH', str(tmpdir))
+    introspector = Introspector(workers=1, timeout=2.0)
+    results = introspector.introspect(['hang', 'noisy', 'crash', 'missing', 'base64'])
+    assert results['hang'] is None
+    assert results['crash'] is None
+    assert results['missing'] is None
+    assert results['noisy'] == ['value']
+    assert 'b64encode' in results['base64']
+
+
+def test_index_with_introspector_matches_in_process_import():
+    tree = SymbolIndex()
+    tree.build_index([])
+    introspected = SymbolIndex()
+    introspected.build_index([], introspector=Introspector())
+    assert json.loads(introspected.serialize()) == json.loads(tree.serialize())
@@ -0,0 +1,167 @@
+"""Counters and timings collected while building an index."""
+
+import heapq
+import json
+from collections import Counter
+
+
+# Where build time goes. "scan" is time spent in an alternative scanner, and
+# "import" is time spent importing or introspecting builtin and extension
+# modules.
+PHASES = ('parse', 'visit', 'scan', 'import')
+
+
+class BuildReport(object):
+    """What SymbolIndex.build_index() did and where the time went.
+
+    Pass one to build_index(), then use format() or write() once it returns.
+
+    :param top: Number of slowest modules and largest subtrees to keep.
+    """
+
+    def __init__(self, top=10):
+        self.top = top
+        self.wall_time = 0.0
+        # Modules parsed, served by a SymbolCache, failed to parse, and
+        # skipped because they were blacklisted.
+        self.parsed = 0
+        self.cached = 0
+        self.failed = 0
+        self.skipped = 0
+        # Modules skipped because a Quarantine holds them.
+        self.quarantined = 0
+        # Modules recognised as generated, whether or not they were indexed.
+        self.generated = 0
+        # Search paths loaded from a SubtreeCache.
+        self.cached_paths = []
+        # Search paths and symlinked directories that were skipped, as
+        # (path, path of the same directory) tuples.
+        self.duplicates = []
+        self.bytes_read = 0
+        self.timings = Counter()
+        self.syscalls = Counter()
+        self.slowest_modules = []
+        self.largest_subtrees = []
+        self._modules = []
+        # Sizes of top-level packages that were spilled before the end.
+        self._subtrees = []
+
+    def add_file(self, filename, size, failed, stats):
+        """Record a module that was read.
+
+        :param stats: A Counter of seconds spent in each of PHASES, "cached"
+            if its symbols came from a SymbolCache, "generated" if it is
+            generated and "skipped" if it was left out because of that.
+        """
+        self.bytes_read += size
+        self.generated += stats['generated']
+        if stats['skipped']:
+            self.skipped += 1
+        elif stats['cached']:
+            self.cached += 1
+        elif failed:
+            self.failed += 1
+        else:
+            self.parsed += 1
+        seconds = 0.0
+        for phase in PHASES:
+            self.timings[phase] += stats[phase]
+            seconds += stats[phase]
+        self._modules.append((seconds, filename))
+
+    def add_subtree(self, name, subtree):
+        """Record a top-level package that is leaving the index before finish()."""
+        self._subtrees.append((_count_symbols(subtree), name))
+
+    def finish(self, index, wall_time):
+        """Summarise a finished build of index."""
+        self.wall_time = wall_time
+        self.syscalls.update(index.syscalls)
+        self.slowest_modules = heapq.nlargest(self.top, self._modules)
+        sizes = self._subtrees + [(_count_symbols(subtree), name)
+                                  for name, subtree in index._tree.items()
+                                  if not isinstance(subtree, float)]
+        self.largest_subtrees = heapq.nlargest(self.top, sizes)
+
+    def as_dict(self):
+        return {
+            'wall_time': self.wall_time,
+            'parsed': self.parsed,
+            'cached': self.cached,
+            'failed': self.failed,
+            'skipped': self.skipped,
+            'quarantined': self.quarantined,
+            'generated': self.generated,
+            'cached_paths': self.cached_paths,
+            'duplicates': [{'path': path, 'duplicate_of': original}
+                           for path, original in self.duplicates],
+            'bytes_read': self.bytes_read,
+            'timings': dict((phase, self.timings[phase]) for phase in PHASES),
+            'syscalls': dict(self.syscalls),
+            'slowest_modules': [{'filename': filename, 'seconds': seconds}
+                                for seconds, filename in self.slowest_modules],
+            'largest_subtrees': [{'name': name, 'symbols': count}
+                                 for count, name in self.largest_subtrees],
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        """Recreate a report from as_dict(), such as one sent by another process."""
+        report = cls(top=max(len(data['slowest_modules']), len(data['largest_subtrees'])))
+        for name in ('wall_time', 'parsed', 'cached', 'failed', 'skipped', 'quarantined',
+                     'generated', 'cached_paths', 'bytes_read'):
+            setattr(report, name, data[name])
+        report.duplicates = [(entry['path'], entry['duplicate_of'])
+                             for entry in data['duplicates']]
+        report.timings.update(data['timings'])
+        report.syscalls.update(data['syscalls'])
+        report.slowest_modules = [(entry['seconds'], entry['filename'])
+                                  for entry in data['slowest_modules']]
+        report.largest_subtrees = [(entry['symbols'], entry['name'])
+                                   for entry in data['largest_subtrees']]
+        return report
+
+    def write(self, filename):
+        with open(filename, 'w') as fd:
+            json.dump(self.as_dict(), fd, indent=2, sort_keys=True)
+
+    def format(self):
+        """Format the report for display on a console."""
+        lines = [
+            'Indexed in {0:.2f}s: {1} parsed, {2} cached, {3} failed, {4} skipped, '
+            '{5} quarantined, {6} generated, {7:.1f} MB read'
+            .format(self.wall_time, self.parsed, self.cached, self.failed, self.skipped,
+                    self.quarantined, self.generated, self.bytes_read / (1024.0 * 1024.0)),
+            'Time: ' + ', '.join('{0} {1:.2f}s'.format(phase, self.timings[phase])
+                                 for phase in PHASES),
+            'Syscalls: {0} scandir, {1} stat, {2} open'.format(
+                self.syscalls['scandir'], self.syscalls['stat'], self.syscalls['open']),
+        ]
+        if self.cached_paths:
+            lines.append('Loaded from the shared cache: ' + ', '.join(self.cached_paths))
+        if self.duplicates:
+            lines.append('Skipped duplicates:')
+            lines.extend('  {0} (same as {1})'.format(path, original)
+                         for path, original in self.duplicates)
+        if self.slowest_modules:
+            lines.append('Slowest modules:')
+            lines.extend('  {0:8.3f}s  {1}'.format(seconds, filename)
+                         for seconds, filename in self.slowest_modules)
+        if self.largest_subtrees:
+            lines.append('Largest subtrees:')
+            lines.extend('  {0:8d}  {1}'.format(count, name)
+                         for count, name in self.largest_subtrees)
+        return '\n'.join(lines)
+
+
+def _count_symbols(tree):
+    """Count the leaf symbols in a SymbolIndex subtree."""
+    count = 0
+    stack = [tree]
+    while stack:
+        for value in stack.pop()._tree.values():
+            if isinstance(value, float):
+                count += 1
+            else:
+                stack.append(value)
+    return count
@@ -0,0 +1,28 @@
+from __future__ import absolute_import
+
+import json
+import re
+
+from importmagic.index import SymbolIndex
+from importmagic.report import BuildReport
+
+
+def test_build_report_counts_modules(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('class Cls:\n pass\n')
+    pkg.join('mod.py').write('def func():\n pass\n')
+    pkg.join('broken.py').write('def func(:\n')
+    pkg.join('skipped.py').write('value = 1\n')
+    tree = SymbolIndex(blacklist_re=re.compile('skipped'))
+    report = BuildReport(top=2)
+    tree.build_index([str(tmpdir)], report=report)
+    assert (report.parsed, report.failed, report.skipped) == (2, 1, 1)
+    assert report.bytes_read == sum(len(pkg.join(name).read())
+                                    for name in ('__init__.py', 'mod.py', 'broken.py'))
+    assert report.timings['parse'] > 0
+    assert len(report.slowest_modules) == 2
+    assert 'Slowest modules:' in report.format()
+    report.write(str(tmpdir.join('report.json')))
+    data = json.loads(tmpdir.join('report.json').read())
+    assert data['parsed'] == 2
+    assert data['largest_subtrees'][0]['symbols'] >= data['largest_subtrees'][1]['symbols']
@@ -0,0 +1,296 @@
+"""Extract top-level symbols from Python source without building an AST.
+
+scan_symbols() produces the same (name, score, exported) tuples that
+SymbolVisitor records, in the same order. It masks out string literals and
+comments with a single regular expression, then walks the source one
+logical line at a time, only tokenizing the lines SymbolVisitor would look
+at. Anything it can't be sure about raises Ambiguous, and the caller is
+expected to fall back to a full parse.
+"""
+
+import ast
+import io
+import re
+import sys
+import tokenize
+
+
+class Ambiguous(Exception):
+    """The source can't be scanned reliably and needs a full parse."""
+
+
+# Compound statements whose bodies SymbolVisitor never looks into.
+_OPAQUE = frozenset(['if', 'elif', 'def', 'class'])
+# Compound statements whose bodies it visits as if they were top-level,
+# because ast.NodeVisitor.generic_visit() descends into them.
+_TRANSPARENT = frozenset(['while', 'for', 'try', 'except', 'finally', 'with'])
+# Statements that only exist in Python 2, which ast.parse() rejects.
+_PYTHON2_STATEMENTS = frozenset(['print', 'exec'])
+
+_OPEN = frozenset('([{')
+_CLOSE = frozenset(')]}')
+
+_STRING_OR_COMMENT_RE = re.compile(r'''
+    (?<![\w$])[rRbBuUfF]{0,2}
+    (?: \'\'\'[^'\\]*(?:(?:\\.|'(?!''))[^'\\]*)*\'\'\'
+      | """[^"\\]*(?:(?:\\.|"(?!""))[^"\\]*)*"""
+      | '[^'\\\n]*(?:\\.[^'\\\n]*)*'
+      | "[^"\\\n]*(?:\\.[^"\\\n]*)*"
+    )
+    | (?P<comment>\#[^\n]*)
+''', re.VERBOSE | re.DOTALL)
+# String literals are replaced by $<n> placeholders, which can't otherwise
+# occur in Python code.
+_TOKEN_RE = re.compile(r'''
+    \$\d+ | [^\W\d]\w* | \d[\w.]* | \.\.\. | \*\*= | //= | >>= | <<= | -> | :=
+    | [-+*/%&|^@<>=!]= | \*\* | // | << | >> | \S
+''', re.VERBOSE | re.UNICODE)
+
+
+def scan_symbols(source):
+    """Scan source for top-level symbols.
+
+    :param source: Python source, as bytes or text.
+    :returns: A list of (name, score, exported) tuples.
+    :raises Ambiguous: If the source needs a full parse.
+    """
+    if sys.version_info[0] < 3:
+        raise Ambiguous('scanning requires Python 3')
+    code, strings = _mask(_decode(source))
+    symbols = []
+    opaque_indent = None
+    expect_indent = None
+    headers = {}
+    for indent, text in _logical_lines(code):
+        if expect_indent is not None:
+            if indent <= expect_indent:
+                raise Ambiguous('expected an indented block')
+            expect_indent = None
+        if opaque_indent is not None:
+            if indent > opaque_indent:
+                continue
+            opaque_indent = None
+        line = _TOKEN_RE.findall(text)
+        keyword = line[0]
+        if keyword == '@':
+            continue
+        if keyword == 'async' and len(line) > 1:
+            # generic_visit() descends into async functions, so their
+            # bodies are visited like the body of a with statement.
+            keyword = line[1]
+            if keyword not in ('def', 'for', 'with'):
+                raise Ambiguous('unexpected async statement')
+            kind = 'with' if keyword == 'def' else keyword
+        elif keyword == 'else':
+            kind = {'if': 'if', 'for': 'for', 'while': 'for', 'try': 'try'}.get(headers.get(indent))
+            if kind is None:
+                raise Ambiguous('else without a known statement')
+        elif keyword in ('match', 'case') and line[-1] == ':' and len(line) > 2:
+            raise Ambiguous('match statement')
+        elif keyword in _OPAQUE or keyword in _TRANSPARENT:
+            kind = keyword
+        else:
+            for statement in _split(line, ';'):
+                _scan_statement(statement, strings, symbols)
+            continue
+
+        headers[indent] = 'if' if kind == 'elif' else 'try' if kind in ('except', 'finally') else kind
+        if kind in ('def', 'class'):
+            name = line[1]
+            if not name.startswith('_'):
+                symbols.append((name, 1.1, False))
+        if line[-1] != ':':
+            if kind in _TRANSPARENT:
+                raise Ambiguous('statement body on the same line')
+            continue
+        expect_indent = indent
+        if kind in _OPAQUE:
+            opaque_indent = indent
+    if expect_indent is not None:
+        raise Ambiguous('expected an indented block')
+    return symbols
+
+
+def _decode(source):
+    if not isinstance(source, bytes):
+        return source
+    try:
+        encoding, _ = tokenize.detect_encoding(io.BytesIO(source).readline)
+        return source.decode(encoding)
+    except (SyntaxError, LookupError, UnicodeDecodeError) as e:
+        raise Ambiguous(str(e))
+
+
+def _mask(source):
+    """Replace string literals with placeholders and drop comments.
+
+    :returns: A tuple of (code, list of string literals).
+    """
+    pieces = []
+    strings = []
+    end = 0
+    for match in _STRING_OR_COMMENT_RE.finditer(source):
+        pieces.append(source[end:match.start()])
+        if match.group('comment') is None:
+            pieces.append(' $%d ' % len(strings))
+            strings.append(match.group())
+        end = match.end()
+    pieces.append(source[end:])
+    code = ''.join(pieces)
+    if "'" in code or '"' in code or '`' in code:
+        raise Ambiguous('unterminated string or backquote')
+    return code, strings
+
+
+def _logical_lines(code):
+    """Yield (indentation width, text) for each logical line of code."""
+    text = None
+    nesting = 0
+    for line in code.split('\n'):
+        if text is None:
+            stripped = line.lstrip()
+            if not stripped or stripped == '\r':
+                continue
+            whitespace = line[:len(line) - len(stripped)]
+            if '\f' in whitespace:
+                # As in the tokenizer, a form feed resets the column.
+                whitespace = whitespace.rsplit('\f', 1)[1]
+            indent = len(whitespace.expandtabs(8))
+            text = [stripped]
+        else:
+            text.append(line)
+        nesting += line.count('(') + line.count('[') + line.count('{') \
+            - line.count(')') - line.count(']') - line.count('}')
+        if nesting < 0:
+            raise Ambiguous('unbalanced brackets')
+        if line.rstrip().endswith('\\'):
+            text[-1] = line.rstrip()[:-1]
+        elif nesting == 0:
+            yield indent, ' '.join(text)
+            text = None
+    if text is not None:
+        raise Ambiguous('unexpected end of source')
+
+
+def _split(tokens, separator):
+    """Split tokens on separator, ignoring separators inside brackets."""
+    parts = [[]]
+    nesting = 0
+    for token in tokens:
+        if token in _OPEN:
+            nesting += 1
+        elif token in _CLOSE:
+            nesting -= 1
+        elif token == separator and nesting == 0:
+            parts.append([])
+            continue
+        parts[-1].append(token)
+    return parts
+
+
+def _is_name(token):
+    return token[0] != '$' and token.isidentifier()
+
+
+def _scan_statement(tokens, strings, symbols):
+    if not tokens:
+        return
+    first = tokens[0]
+    if first == 'import':
+        for name in _split(tokens[1:], ','):
+            module = _dotted_name(name)
+            if not module.startswith('_'):
+                symbols.append((module, 0.25, False))
+        return
+    if first == 'from':
+        if 'import' not in tokens:
+            raise Ambiguous('from without import')
+        names = [token for token in tokens[tokens.index('import') + 1:]
+                 if token not in ('(', ')')]
+        for name in _split(names, ','):
+            if not name:
+                continue
+            if not _is_name(name[0]) and name[0] != '*':
+                raise Ambiguous('unexpected token in import')
+            if name[0] == '*' or name[0].startswith('_'):
+                continue
+            symbols.append((name[0], 0.25, False))
+        return
+    if first in _PYTHON2_STATEMENTS and len(tokens) > 1 and tokens[1] not in ('(', '=', '.'):
+        raise Ambiguous('Python 2 %s statement' % first)
+    if 'lambda' in tokens:
+        # Default arguments of a lambda look like assignments, but no
+        # target can follow one.
+        i = tokens.index('lambda')
+        segments = _split(tokens[:i], '=')
+        segments[-1] = segments[-1] + tokens[i:]
+    else:
+        segments = _split(tokens, '=')
+    if len(segments) < 2:
+        return
+    if len(_split(segments[0], ':')) > 1:
+        # An annotated assignment, which SymbolVisitor ignores.
+        return
+    value = segments[-1]
+    for target in segments[:-1]:
+        if not target:
+            raise Ambiguous('empty assignment target')
+        if target[0] in ('(', '['):
+            raise Ambiguous('bracketed assignment target')
+        if len(target) != 1 or not _is_name(target[0]):
+            continue
+        name = target[0]
+        if name == '__all__':
+            for export in _list_of_strings(value, strings):
+                symbols.append((export, 1.2, True))
+        elif not name.startswith('_'):
+            symbols.append((name, 1.1, False))
+
+
+def _dotted_name(tokens):
+    """Return the module name from the tokens of one "import x.y as z" clause."""
+    if not tokens:
+        raise Ambiguous('empty import')
+    parts = []
+    for token in tokens:
+        if token == 'as':
+            break
+        if token != '.' and not _is_name(token):
+            raise Ambiguous('unexpected token in import')
+        parts.append(token)
+    return ''.join(parts)
+
+
+def _list_of_strings(tokens, strings):
+    """Return the strings in a list display, as ast.List of ast.Str would have them.
+
+    Anything that isn't a single list display yields nothing, and so do
+    elements that aren't plain string literals, which includes the element of
+    a list comprehension.
+    """
+    if not tokens or tokens[0] != '[' or _closing_bracket(tokens) != len(tokens) - 1:
+        return []
+    values = []
+    for element in _split(tokens[1:-1], ','):
+        if not element or any(token[0] != '$' for token in element):
+            continue
+        try:
+            parts = [ast.literal_eval(strings[int(token[1:])]) for token in element]
+        except (ValueError, SyntaxError):
+            continue
+        if all(isinstance(part, str) for part in parts):
+            values.append(''.join(parts))
+    return values
+
+
+def _closing_bracket(tokens):
+    """Return the index of the bracket closing the one tokens start with."""
+    nesting = 0
+    for i, token in enumerate(tokens):
+        if token in _OPEN:
+            nesting += 1
+        elif token in _CLOSE:
+            nesting -= 1
+            if nesting == 0:
+                return i
+    return None
@@ -0,0 +1,76 @@
+from __future__ import absolute_import
+
+import os
+from textwrap import dedent
+
+import pytest
+
+from importmagic.index import DEFAULT_BLACKLIST_RE, SymbolIndex, extract_symbols
+from importmagic.scanner import Ambiguous, scan_symbols
+
+
+def test_scanner_matches_symbol_visitor():
+    src = dedent('''
+        """Docstring with a fake
+        x = 1
+        assignment in it."""
+        import os.path, sys as system
+        from . import (a, _b,
+                       c as d)
+        from e import *
+        __all__ = ['f', 'g' 'h', name]
+
+        def f(x=lambda y=1: y):
+            z = 2
+        class G(object): pass
+        if True:
+            i = 3
+        else:
+            j = 4
+        try:
+            k = 5
+        except ImportError:
+            l = m = 6
+        handler = lambda event=None: event
+        n: int = 7
+        o, p = 8, 9
+        q = {
+        'r': 1}  # s = 10
+        ''')
+    assert scan_symbols(src) == extract_symbols('<test>', src)
+
+
+@pytest.mark.parametrize('src', [
+    '(a, b) = 1, 2\n',
+    'for x in y: z = 1\n',
+    'print "hello"\n',
+    'match x:\n    case 1:\n        pass\n',
+    'x = "unterminated\n',
+    'def f():\n',
+])
+def test_scanner_is_ambiguous(src):
+    with pytest.raises(Ambiguous):
+        scan_symbols(src)
+
+
+def test_scanner_matches_symbol_visitor_on_stdlib():
+    stdlib = os.path.dirname(os.__file__)
+    filenames = sorted(name for name in os.listdir(stdlib) if name.endswith('.py'))
+    for name in filenames[::10]:
+        filename = os.path.join(stdlib, name)
+        if DEFAULT_BLACKLIST_RE.search(filename):
+            continue
+        with open(filename, 'rb') as fd:
+            source = fd.read()
+        try:
+            symbols = scan_symbols(source)
+        except Ambiguous:
+            continue
+        assert symbols == extract_symbols(filename, source), filename
+
+
+def test_index_with_scanner_falls_back_to_ast():
+    tree = SymbolIndex(scanner='scan')
+    with tree.enter('mod') as mod:
+        assert mod.index_source('<test>', 'for x in y: z = 1\nw = 2\n')
+    assert sorted(mod._tree) == ['w', 'z']
@@ -0,0 +1,44 @@
+"""Which modules of the running interpreter's standard library to index.
+
+Rather than indexing whatever happens to be in the standard library's
+directory, which includes its test suite and the odd build artefact, only
+the top-level modules the interpreter itself lists in
+sys.stdlib_module_names (Python 3.10 and later) are indexed. Older
+interpreters don't list them, so their standard library is walked as
+before.
+"""
+
+import os
+import sys
+
+from distutils import sysconfig
+
+
+# Listed standard library packages that are applications, data or jokes
+# rather than libraries.
+NON_LIBRARY_MODULES = frozenset([
+    'antigravity', 'ensurepip', 'idlelib', 'lib2to3', 'pydoc_data', 'this', 'turtledemo',
+])
+STDLIB_DIR = os.path.realpath(sysconfig.get_python_lib(standard_lib=True))
+# Where the standard library's extension modules live.
+DYNLOAD_DIR = os.path.join(STDLIB_DIR, 'lib-dynload')
+
+
+def stdlib_modules(dir):
+    """Return the names of the top-level modules to index in dir.
+
+    :returns: A frozenset of module names, or None if dir is not the running
+        interpreter's standard library, or it doesn't list its modules.
+    """
+    names = getattr(sys, 'stdlib_module_names', None)
+    if names is None or os.path.realpath(dir) not in (STDLIB_DIR, DYNLOAD_DIR):
+        return None
+    return frozenset(names) - NON_LIBRARY_MODULES
+
+
+def module_name(entry_name):
+    """The name of the top-level module a directory entry provides."""
+    name = entry_name.split('.', 1)[0]
+    if name.endswith('-stubs'):
+        name = name[:-len('-stubs')]
+    return name
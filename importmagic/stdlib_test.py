@@ -0,0 +1,35 @@
+from __future__ import absolute_import
+
+import os
+import sys
+
+import pytest
+
+import importmagic.stdlib
+from importmagic.index import SymbolIndex
+from importmagic.index_test import NO_BLACKLIST_RE
+from importmagic.stdlib import STDLIB_DIR, stdlib_modules
+
+
+pytestmark = pytest.mark.skipif(sys.version_info < (3, 10), reason='requires Python 3.10')
+
+
+def test_stdlib_modules():
+    modules = stdlib_modules(STDLIB_DIR)
+    assert 'json' in modules
+    assert 'idlelib' not in modules
+    assert 'test' not in modules
+    assert stdlib_modules(os.path.join(STDLIB_DIR, 'site-packages')) is None
+
+
+def test_index_only_walks_listed_stdlib_modules(tmpdir, monkeypatch):
+    monkeypatch.setattr(importmagic.stdlib, 'STDLIB_DIR', str(tmpdir))
+    tmpdir.join('json.py').write('def dumps():\n pass\n')
+    tmpdir.join('stray.py').write('def stray():\n pass\n')
+    idlelib = tmpdir.mkdir('idlelib')
+    idlelib.join('__init__.py').write('')
+    tree = SymbolIndex(blacklist_re=NO_BLACKLIST_RE, locations=[(str(tmpdir), 'S')])
+    tree.build_index([str(tmpdir)])
+    assert tree.find('json') is not None
+    assert tree.find('stray') is None
+    assert tree.find('idlelib') is None
@@ -0,0 +1,275 @@
+"""Watch project directories for changes to Python modules.
+
+Two change sources are provided with the same interface: InotifyWatcher,
+which uses the Linux inotify API via ctypes, and PollingWatcher, which
+compares stat() snapshots and works everywhere. Use watch() to get the best
+one available. Both only look at the roots and the packages below them that
+exclude rules, as SymbolIndex applies to a project, don't leave out.
+"""
+
+import os
+import sys
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import select
+import struct
+import threading
+import time
+
+from importmagic.ignore import DEFAULT_EXCLUDES, IgnoreRules
+
+logger = logging.getLogger(__name__)
+
+SOURCE_EXTENSIONS = ('.py', '.pyi')
+
+
+def _is_source(filename):
+    return os.path.splitext(filename)[1] in SOURCE_EXTENSIONS
+
+
+def _is_ignored_dir(name):
+    return name.startswith('.') or name == '__pycache__'
+
+
+def _is_package(path):
+    init = '__init__.pyi' if path.endswith('-stubs') else '__init__.py'
+    return os.path.isfile(os.path.join(path, init))
+
+
+def _is_watched_package(path, rules):
+    return (not _is_ignored_dir(os.path.basename(path)) and _is_package(path) and
+            not rules.is_excluded(path, True))
+
+
+class PollingWatcher(object):
+    """Detect changes by comparing stat() snapshots of the roots.
+
+    Only directories that could hold indexed modules are scanned: the roots
+    themselves and packages below them. poll() can be called directly, which
+    is what the tests do; start() calls it every interval seconds.
+
+    :param exclude: Patterns in .gitignore syntax for directories and files
+        to leave out, along with those of the ignore files found.
+    """
+
+    def __init__(self, roots, callback, interval=1.0, exclude=DEFAULT_EXCLUDES):
+        self._roots = list(roots)
+        self._exclude = exclude
+        self._callback = callback
+        self._interval = interval
+        self._stopped = threading.Event()
+        self._thread = None
+        self._files = self._snapshot()
+
+    def poll(self):
+        """Check for changes, passing any changed filenames to the callback.
+
+        :returns: A sorted list of files that were created, modified or deleted.
+        """
+        snapshot = self._snapshot()
+        changed = sorted(filename for filename in set(snapshot) | set(self._files)
+                         if snapshot.get(filename) != self._files.get(filename))
+        self._files = snapshot
+        if changed:
+            self._callback(changed)
+        return changed
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _run(self):
+        while not self._stopped.wait(self._interval):
+            try:
+                self.poll()
+            except Exception:
+                logger.exception('failed to poll for changes')
+
+    def _snapshot(self):
+        files = {}
+        stack = [(root, IgnoreRules(root, self._exclude)) for root in self._roots]
+        while stack:
+            dir, rules = stack.pop()
+            try:
+                names = os.listdir(dir)
+            except OSError:
+                continue
+            rules = rules.enter(dir, names)
+            for name in names:
+                path = os.path.join(dir, name)
+                if _is_source(name):
+                    if rules.is_excluded(path, False):
+                        continue
+                    try:
+                        st = os.stat(path)
+                    except OSError:
+                        continue
+                    files[path] = (st.st_mtime, st.st_size)
+                elif _is_watched_package(path, rules):
+                    stack.append((path, rules))
+        return files
+
+
+class InotifyWatcher(object):
+    """Receive change events from the kernel via inotify.
+
+    Events are batched for `delay` seconds before being passed to the
+    callback, so that a save that touches a file several times is reported
+    once. Watches are added to the roots and the packages below them, as
+    PollingWatcher scans, and to directories created in those.
+    """
+
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_IGNORED = 0x00008000
+    IN_ISDIR = 0x40000000
+    IN_NONBLOCK = 0x00000800
+    IN_CLOEXEC = 0x00080000
+
+    MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+    _EVENT = struct.Struct('iIII')
+
+    def __init__(self, roots, callback, delay=0.2, exclude=DEFAULT_EXCLUDES):
+        libc = self._libc()
+        if libc is None:
+            raise OSError(errno.ENOSYS, 'inotify is not available')
+        self._lib = libc
+        self._callback = callback
+        self._delay = delay
+        self._stopped = threading.Event()
+        self._thread = None
+        self._fd = libc.inotify_init1(self.IN_NONBLOCK | self.IN_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        # (directory, IgnoreRules) by watch descriptor.
+        self._watches = {}
+        for root in roots:
+            self._watch_tree(root, IgnoreRules(root, exclude))
+
+    @classmethod
+    def available(cls):
+        return cls._libc() is not None
+
+    @staticmethod
+    def _libc():
+        if not sys.platform.startswith('linux'):
+            return None
+        name = ctypes.util.find_library('c')
+        if not name:
+            return None
+        libc = ctypes.CDLL(name, use_errno=True)
+        if not hasattr(libc, 'inotify_init1'):
+            return None
+        return libc
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def _watch_tree(self, top, rules):
+        """Watch top, and the packages below it that rules don't exclude."""
+        stack = [(top, rules)]
+        while stack:
+            dir, rules = stack.pop()
+            try:
+                names = os.listdir(dir)
+            except OSError:
+                continue
+            rules = rules.enter(dir, names)
+            wd = self._lib.inotify_add_watch(self._fd, dir.encode(sys.getfilesystemencoding()),
+                                              self.MASK)
+            if wd < 0:
+                logger.debug('failed to watch %s: %s', dir, os.strerror(ctypes.get_errno()))
+                continue
+            self._watches[wd] = (dir, rules)
+            stack.extend((os.path.join(dir, name), rules) for name in names
+                         if _is_watched_package(os.path.join(dir, name), rules))
+
+    def _read_events(self):
+        changed = set()
+        try:
+            data = os.read(self._fd, 64 * 1024)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return changed
+            raise
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = self._EVENT.unpack_from(data, offset)
+            offset += self._EVENT.size
+            name = data[offset:offset + length].rstrip(b'\0').decode(sys.getfilesystemencoding())
+            offset += length
+            if mask & self.IN_IGNORED:
+                self._watches.pop(wd, None)
+                continue
+            if wd not in self._watches or not name:
+                continue
+            dir, rules = self._watches[wd]
+            path = os.path.join(dir, name)
+            if mask & self.IN_ISDIR:
+                if _is_ignored_dir(name) or rules.is_excluded(path, True):
+                    continue
+                if mask & (self.IN_CREATE | self.IN_MOVED_TO):
+                    # Watched even if it isn't a package yet, as its
+                    # __init__.py is usually created right after it.
+                    self._watch_tree(path, rules)
+                changed.add(path)
+            elif _is_source(name) and not rules.is_excluded(path, False):
+                changed.add(path)
+        return changed
+
+    def _run(self):
+        pending = set()
+        deadline = None
+        try:
+            while not self._stopped.is_set():
+                timeout = 0.5 if deadline is None else max(0.0, deadline - time.time())
+                readable, _, _ = select.select([self._fd], [], [], timeout)
+                if readable:
+                    events = self._read_events()
+                    if events:
+                        pending.update(events)
+                        if deadline is None:
+                            deadline = time.time() + self._delay
+                if pending and time.time() >= deadline:
+                    changed, pending, deadline = sorted(pending), set(), None
+                    try:
+                        self._callback(changed)
+                    except Exception:
+                        logger.exception('failed to handle changes')
+        finally:
+            os.close(self._fd)
+
+
+def watch(roots, callback, interval=1.0, exclude=DEFAULT_EXCLUDES):
+    """Start watching roots, calling callback with lists of changed files.
+
+    :param exclude: Patterns in .gitignore syntax to leave out, as
+        SymbolIndex's exclude.
+    :returns: A started watcher. Call its stop() method to stop watching.
+    """
+    watcher = None
+    if InotifyWatcher.available():
+        try:
+            watcher = InotifyWatcher(roots, callback, exclude=exclude)
+        except OSError as e:
+            logger.debug('falling back to polling: %s', e)
+    if watcher is None:
+        watcher = PollingWatcher(roots, callback, interval=interval, exclude=exclude)
+    watcher.start()
+    return watcher
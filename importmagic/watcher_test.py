@@ -0,0 +1,80 @@
+import threading
+
+import pytest
+
+from importmagic.watcher import InotifyWatcher, PollingWatcher
+
+
+def test_polling_watcher_reports_changes(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    pkg.join('mod.py').write('a = 1\n')
+    pkg.join('gone.py').write('b = 1\n')
+    tmpdir.mkdir('notapackage').join('ignored.py').write('')
+    tmpdir.mkdir('build').join('__init__.py').write('')
+    tmpdir.join('.gitignore').write('*_pb2.py\n')
+    changes = []
+    watcher = PollingWatcher([str(tmpdir)], changes.append)
+    assert watcher.poll() == []
+
+    pkg.join('mod.py').write('a = 10\n')
+    pkg.join('gone.py').remove()
+    pkg.join('new.py').write('')
+    tmpdir.join('notapackage', 'other.py').write('')
+    tmpdir.join('build', 'lib.py').write('')
+    pkg.join('service_pb2.py').write('')
+    expected = sorted(str(pkg.join(name)) for name in ('mod.py', 'gone.py', 'new.py'))
+    assert watcher.poll() == expected
+    assert changes == [expected]
+    assert watcher.poll() == []
+
+
+@pytest.mark.skipif(not InotifyWatcher.available(), reason='inotify is not available')
+def test_inotify_watcher_reports_changes(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    changes = []
+    changed = threading.Event()
+
+    def callback(filenames):
+        changes.extend(filenames)
+        changed.set()
+
+    watcher = InotifyWatcher([str(tmpdir)], callback, delay=0.05)
+    watcher.start()
+    try:
+        pkg.join('mod.py').write('a = 1\n')
+        assert changed.wait(5.0)
+    finally:
+        watcher.stop()
+    assert changes == [str(pkg.join('mod.py'))]
+
+
+@pytest.mark.skipif(not InotifyWatcher.available(), reason='inotify is not available')
+def test_inotify_watcher_only_watches_packages(tmpdir):
+    pkg = tmpdir.mkdir('pkg')
+    pkg.join('__init__.py').write('')
+    tmpdir.mkdir('notapackage').mkdir('deep')
+    tmpdir.mkdir('node_modules').join('__init__.py').write('')
+    tmpdir.join('.gitignore').write('*_pb2.py\n')
+    changes = []
+    changed = threading.Event()
+
+    def callback(filenames):
+        changes.extend(filenames)
+        changed.set()
+
+    watcher = InotifyWatcher([str(tmpdir)], callback, delay=0.05)
+    assert sorted(dir for dir, _ in watcher._watches.values()) == [str(tmpdir), str(pkg)]
+    watcher.start()
+    try:
+        tmpdir.join('node_modules', 'lib.py').write('')
+        pkg.join('service_pb2.py').write('')
+        new = tmpdir.mkdir('new')
+        assert changed.wait(5.0)
+        changed.clear()
+        new.join('__init__.py').write('')
+        assert changed.wait(5.0)
+    finally:
+        watcher.stop()
+    assert changes == [str(new), str(new.join('__init__.py'))]
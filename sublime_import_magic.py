@@ -7,14 +7,27 @@ if import_path not in sys.path:
     sys.path.insert(0, import_path)
 
 # importmagic: manage
+import json
+import subprocess
 import sublime
 import sublime_plugin
+import tempfile
 from distutils import sysconfig
-from threading import RLock, Thread
-
+from distutils.spawn import find_executable
+from contextlib import contextmanager
+from threading import Lock, RLock, Thread
+
+from importmagic.build import (BELOW_NORMAL_PRIORITY_CLASS, build, open_caches, open_store,
+                               rewrite_index, save_index)
+from importmagic.generated import DEFAULT_GENERATED
+from importmagic.ignore import DEFAULT_EXCLUDES
 from importmagic.importer import get_update
-from importmagic.index import LIB_LOCATIONS, SymbolIndex
+from importmagic.index import BUILD_PHASES, LIB_LOCATIONS, SymbolIndex, read_header, stale_paths, unique_paths
+from importmagic.introspect import Introspector
+from importmagic.report import BuildReport
+from importmagic.six import StringIO
 from importmagic.symbols import Scope
+from importmagic.watcher import watch
 
 
 def index_filename():
@@ -22,6 +35,96 @@ def index_filename():
     return settings.get('index_filename', '.importmagic.idx')
 
 
+# sys.version of interpreters, by path, or None for those that failed to run.
+_versions = {}
+
+
+def find_interpreter(settings):
+    """Return a standalone Python interpreter to run scripts with, or None.
+
+    Sublime's plugin host can't run scripts, so unless python_interpreter is
+    set, this is the interpreter running the plugin only if that is a
+    standalone Python, and otherwise the project's virtualenv's, or the
+    first python3 or python on PATH.
+    """
+    python = settings.get('python_interpreter')
+    if python:
+        return python if interpreter_version(python) else None
+    candidates = []
+    if 'python' in os.path.basename(sys.executable).lower():
+        candidates.append(sys.executable)
+    virtualenv = os.environ.get('VIRTUAL_ENV')
+    if virtualenv:
+        bin = os.path.join(virtualenv, 'Scripts' if sys.platform == 'win32' else 'bin')
+        candidates.append(find_executable('python', bin))
+    candidates += [find_executable('python3'), find_executable('python')]
+    for python in candidates:
+        if python and interpreter_version(python):
+            return python
+    return None
+
+
+def interpreter_version(python):
+    """Return the sys.version of python, or None if it can't be run."""
+    if python not in _versions:
+        try:
+            _versions[python] = subprocess.check_output(
+                [python, '-c', 'import sys; sys.stdout.write(sys.version)'],
+                stderr=subprocess.STDOUT, universal_newlines=True)
+        except (OSError, subprocess.CalledProcessError) as e:
+            log('Failed to run Python interpreter {0}: {1}', python, e)
+            _versions[python] = None
+    return _versions[python]
+
+
+def make_introspector(settings):
+    workers = settings.get('introspection_workers', 2)
+    python = find_interpreter(settings)
+    # Without a standalone interpreter, extension modules are imported
+    # in-process.
+    if not workers or python is None:
+        return None
+    return Introspector(python=python, workers=workers)
+
+
+def builder_interpreter(settings):
+    """Return the interpreter to build indexes in a child process with, or None."""
+    if not settings.get('build_in_subprocess', True):
+        return None
+    python = find_interpreter(settings)
+    if python is None:
+        log('No standalone Python interpreter found, building indexes in Sublime instead; '
+            'set python_interpreter to build them in a child process')
+    return python
+
+
+def make_build_config(settings, root, index_file, paths, locations, refresh):
+    """Translate settings into an importmagic.build config."""
+    report_file = settings.get('build_report_file')
+    return {
+        'index_file': index_file,
+        'paths': paths,
+        'locations': locations,
+        'lazy': settings.get('lazy_packages', False),
+        'scanner': settings.get('scanner', 'ast'),
+        'metadata': settings.get('distribution_metadata', False),
+        'exclude': settings.get('exclude'),
+        'generated': settings.get('generated_modules'),
+        'processes': settings.get('index_processes', 0),
+        'shared_cache': settings.get('shared_cache', True),
+        'refresh': refresh,
+        'shared_cache_dir': settings.get('shared_cache_dir'),
+        'subtree_store': settings.get('subtree_store', True),
+        'max_store_size': settings.get('max_store_size', 1024 * 1024 * 1024),
+        'symbol_cache_size': settings.get('symbol_cache_size', 50000),
+        'max_module_size': settings.get('max_module_size', 2 * 1024 * 1024),
+        'max_parse_seconds': settings.get('max_parse_seconds', 2.0),
+        'introspection_workers': settings.get('introspection_workers', 2),
+        'report_file': report_file and os.path.join(root, report_file),
+        'niceness': settings.get('builder_niceness', 10),
+    }
+
+
 def log(fmt, *args, **kwargs):
     text = fmt.format(*args, **kwargs)
     text = 'ImportMagic: {0}'.format(text)
@@ -34,12 +137,34 @@ class Indexer(object):
 
     def __init__(self):
         self._lock = RLock()
+        # Held while an index file is written or deleted, which is done
+        # outside _lock. Taken before _lock, never after.
+        self._save_lock = Lock()
         self._indexes = {}
         self._threads = {}
-
-    def rebuild(self, root):
+        self._paths = {}
+        self._watchers = {}
+        self._refresh = set()
+        self._reports = {}
+        # Snapshots of indexes that are still being built.
+        self._partial = {}
+        # Files the watcher reported while a copy of an index was being
+        # patched, by root.
+        self._changed = {}
+
+    def rebuild(self, root, locations=None):
+        """Rebuild the index for root from scratch, or only its entries in locations.
+
+        :param locations: Location codes, eg. ["L"] for the project's own
+            code. Everything else is kept as it is.
+        """
+        if locations:
+            Thread(target=self._rebuilder, args=(root, locations)).start()
+            with self._lock:
+                return self._indexes.get(root)
         log('Rebuilding index for {0}', root)
-        with self._lock:
+        with self._save_lock, self._lock:
+            self._unwatch(root)
             index_file = os.path.join(root, index_filename())
             try:
                 os.unlink(index_file)
@@ -49,14 +174,162 @@ class Indexer(object):
                 del self._indexes[root]
             except KeyError:
                 pass
+            self._refresh.add(root)
             log('Rebuilt index for {0}', root, status=True)
         return self.index(root)
 
+    def _rebuilder(self, root, locations):
+        # Load the index first, if it isn't already.
+        self.index(root)
+        with self._lock:
+            thread = self._threads.get(root)
+        if thread is not None:
+            thread.join()
+        log('Rebuilding {0} in index for {1}', ''.join(locations), root)
+        settings = sublime.load_settings('Python Import Magic.sublime-settings')
+        with self._lock:
+            paths = self._paths.get(root)
+        if paths is None:
+            log('No index to rebuild for {0}', root, status=True)
+            return
+        config = make_build_config(settings, root, None, paths, None, False)
+        _, symbol_cache, quarantine = open_caches(config)
+        report = BuildReport()
+
+        def rebuild(index):
+            return index.rebuild_locations(paths, locations,
+                                           introspector=make_introspector(settings),
+                                           symbol_cache=symbol_cache, report=report,
+                                           quarantine=quarantine)
+
+        names = self._patch(root, rebuild)
+        if names is not None:
+            with self._lock:
+                self._reports[root] = report
+            log('Rebuilt {0} top-level entries in index for {1}', len(names), root, status=True)
+
+    def _patch(self, root, patch, changed=()):
+        """Patch a copy of the index for root, save it, and swap it in once it is done.
+
+        Lookups are never held up by indexing or saving, as both happen
+        outside the lock, on a copy nothing else uses yet. Files the watcher
+        reports meanwhile are patched into the copy too. Only the top-level
+        entries that changed are written out again.
+
+        :param patch: Called with the copy, outside the lock.
+        :param changed: Files patch brings the index up to date with, which
+            are handed to the patch under way instead, if there is one.
+        :returns: What patch returned, or None if there was no index to patch,
+            another patch was under way or the index was replaced meanwhile.
+        """
+        with self._lock:
+            index = self._indexes.get(root)
+            if index is None:
+                return None
+            if root in self._changed:
+                self._changed[root].extend(changed)
+                return None
+            self._changed[root] = []
+            paths = self._paths[root]
+            copy = index.snapshot()
+        try:
+            result = patch(copy)
+            while True:
+                names = copy.take_touched()
+                with self._save_lock:
+                    with self._lock:
+                        if self._indexes.get(root) is not index:
+                            return None
+                    if names or copy.dirty:
+                        self._save(root, copy, names)
+                with self._lock:
+                    if self._indexes.get(root) is not index:
+                        return None
+                    changed, self._changed[root] = self._changed[root], []
+                    if not changed:
+                        self._indexes[root] = copy
+                        return result
+                copy.update_files(changed, paths)
+        finally:
+            with self._lock:
+                self._changed.pop(root, None)
+
+    def update(self, root):
+        if self.index(root) is None:
+            return
+        Thread(target=self._updater, args=(root,)).start()
+
+    def _updater(self, root):
+        log('Updating index for {0}', root)
+        with self._lock:
+            paths = self._paths.get(root)
+        count = self._patch(root, lambda index: index.update_index(paths))
+        if count is not None:
+            log('Updated {0} modules in index for {1}', count, root, status=True)
+
+    def _on_change(self, root, filenames):
+        with self._lock:
+            paths = self._paths.get(root)
+        if paths is None:
+            return
+        count = self._patch(root, lambda index: index.update_files(filenames, paths), filenames)
+        if count:
+            log('Updated {0} modules in index for {1}', count, root, status=True)
+
+    def _watch(self, root):
+        settings = sublime.load_settings('Python Import Magic.sublime-settings')
+        if not settings.get('watch_files', True) or root in self._watchers:
+            return
+        exclude = settings.get('exclude')
+        self._watchers[root] = watch([root], lambda filenames: self._on_change(root, filenames),
+                                     exclude=DEFAULT_EXCLUDES if exclude is None else tuple(exclude))
+
+    def _unwatch(self, root):
+        watcher = self._watchers.pop(root, None)
+        if watcher is not None:
+            watcher.stop()
+
+    def flush(self, root):
+        """Save the index for root in the background, if lookups expanded lazy packages."""
+        with self._lock:
+            index = self._indexes.get(root)
+            if index is None or not index.dirty:
+                return
+        Thread(target=self._patch, args=(root, lambda index: None)).start()
+
+    @contextmanager
+    def lookup(self, root):
+        """Hold the lock while the index for root, or None, is used for lookups.
+
+        Lookups expand lazily indexed packages, which changes the index, so
+        they can't overlap with the snapshots _patch() takes of it.
+        """
+        index = self.index(root)
+        with self._lock:
+            yield index
+
+    def report(self, root):
+        """Return the BuildReport from the last time root was indexed, if any."""
+        with self._lock:
+            return self._reports.get(root)
+
+    def _save(self, root, index, names):
+        """Write index to its file, copying the top-level entries not in names from it."""
+        index_file = os.path.join(root, index_filename())
+        if index.dirty:
+            # Lazily indexed packages were expanded, wherever lookups led.
+            save_index(index, index_file)
+        else:
+            rewrite_index(index, index_file, names)
+        index.dirty = False
+
     def index(self, root):
         with self._lock:
             if root in self._indexes:
                 return self._indexes[root]
             if root in self._threads:
+                if root in self._partial:
+                    return self._partial[root]
                 log('WARNING: Still loading index from {0}', root, status=True)
                 return None
             index_file = os.path.join(root, index_filename())
@@ -67,7 +340,9 @@ class Indexer(object):
             thread.join(2.0)
             self._lock.acquire()
             if not thread.is_alive():
-                return self._indexes[root]
+                return self._indexes.get(root)
+            if root in self._partial:
+                return self._partial[root]
             log('WARNING: Still loading index from {0}', root, status=True)
 
     def _indexer(self, root, index_file):
@@ -76,24 +351,140 @@ class Indexer(object):
         settings = sublime.load_settings('Python Import Magic.sublime-settings')
         locations = settings.get('python_path', LIB_LOCATIONS)
         print(locations)
+        # Builds are given every path, so that duplicates are reported; the
+        # index is stamped with and patched for the unique ones.
+        build_paths = self._make_python_path(root, locations=locations)
+        paths = unique_paths(build_paths)[0]
 
         sublime.status_message('Loading index {0}'.format(root))
+        python = builder_interpreter(settings)
+        stale = None
         if os.path.exists(index_file):
-            log('Loading index for {0}', root)
             with open(index_file) as fd:
-                index = SymbolIndex.deserialize(fd)
-        else:
-            index = SymbolIndex(locations=locations)
-            paths = self._make_python_path(root, locations=locations)
+                stale = stale_paths(read_header(fd), paths,
+                                    python and interpreter_version(python))
+            if stale is None:
+                log('Index for {0} was built by another Python, rebuilding', root)
+                os.unlink(index_file)
+        index = report = None
+        if os.path.exists(index_file):
+            log('Loading index for {0}', root)
+            store = open_store(make_build_config(settings, root, index_file, paths, locations,
+                                                 False))
+            try:
+                with open(index_file) as fd:
+                    index = SymbolIndex.deserialize(fd, store=store)
+            except ValueError as e:
+                log('Failed to load index for {0}, rebuilding: {1}', root, e)
+                os.unlink(index_file)
+                stale = None
+        if index is None:
             log('Indexing {0} with paths {1}',
                 root, os.path.pathsep.join(paths))
-            index.build_index(paths)
-            with open(index_file, 'w') as fd:
-                fd.write(index.serialize())
+            with self._lock:
+                refresh = root in self._refresh
+                self._refresh.discard(root)
+            config = make_build_config(settings, root, index_file, build_paths, locations,
+                                       refresh)
+            if python is not None:
+                index, report = self._build_in_child(root, config, python)
+            else:
+                index, report = self._build_in_thread(root, config, settings)
+            if index is None:
+                with self._lock:
+                    self._partial.pop(root, None)
+                    del self._threads[root]
+                return
+        index.scanner = settings.get('scanner', 'ast')
+        index.metadata = settings.get('distribution_metadata', False)
+        exclude = settings.get('exclude')
+        index.exclude = DEFAULT_EXCLUDES if exclude is None else tuple(exclude)
+        index.generated = settings.get('generated_modules') or DEFAULT_GENERATED
         with self._lock:
             self._indexes[root] = index
+            if report is not None:
+                self._reports[root] = report
+            self._paths[root] = paths
+            self._partial.pop(root, None)
             del self._threads[root]
+            self._watch(root)
         log('Ready for {0}', root, status=True)
+        if stale and (stale[0] or stale[1]):
+            self._refresh_stale(root, paths, *stale)
+
+    def _refresh_stale(self, root, paths, changed, removed):
+        """Patch a loaded index for the search paths that changed since it was saved."""
+        log('Updating index for {0} from {1}', root, os.path.pathsep.join(changed + removed))
+        count = self._patch(root, lambda index: index.refresh_paths(paths, changed, removed))
+        if count is not None:
+            log('Updated {0} modules in index for {1}', count, root, status=True)
+
+    def _build_in_thread(self, root, config, settings):
+        # Extension modules are imported by the configured interpreter, if
+        # any, as the plugin host can't run workers itself. For the same
+        # reason, modules are parsed serially.
+        config = dict(config, introspection_workers=0, processes=0)
+
+        def publish(phase, write):
+            # The finished index is published by _indexer().
+            if phase != BUILD_PHASES[-1]:
+                fd = StringIO()
+                write(fd)
+                fd.seek(0)
+                self._publish(root, phase, SymbolIndex.deserialize(fd, store=open_store(config)))
+
+        return build(config, publish, introspector=make_introspector(settings))
+
+    def _build_in_child(self, root, config, python):
+        """Build in a niced child process, so the plugin host never waits on the GIL."""
+        env = dict(os.environ)
+        env['PYTHONPATH'] = os.path.pathsep.join(filter(None, [import_path,
+                                                              env.get('PYTHONPATH')]))
+        kwargs = {}
+        if sys.platform == 'win32':
+            kwargs['creationflags'] = BELOW_NORMAL_PRIORITY_CLASS
+        stderr = tempfile.TemporaryFile()
+        try:
+            process = subprocess.Popen([python, '-m', 'importmagic.build'], env=env,
+                                       stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                       stderr=stderr, universal_newlines=True, **kwargs)
+        except OSError as e:
+            log('Failed to start index builder {0}: {1}', python, e, status=True)
+            stderr.close()
+            return None, None
+        process.stdin.write(json.dumps(dict(config, snapshots=True)))
+        process.stdin.close()
+        report = None
+        for line in process.stdout:
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if 'snapshot' in message:
+                with open(message['snapshot']) as fd:
+                    snapshot = SymbolIndex.deserialize(fd, store=open_store(config))
+                self._publish(root, message['phase'], snapshot)
+            if 'report' in message:
+                report = BuildReport.from_dict(message['report'])
+        process.wait()
+        stderr.seek(0)
+        errors = stderr.read().decode('utf-8', 'replace').strip().splitlines()
+        stderr.close()
+        try:
+            os.unlink(config['index_file'] + '.partial')
+        except OSError:
+            pass
+        if process.returncode != 0 or report is None:
+            log('Index builder for {0} failed with exit status {1}:\n{2}', root,
+                process.returncode, '\n'.join(errors[-10:]), status=True)
+            return None, None
+        with open(config['index_file']) as fd:
+            return SymbolIndex.deserialize(fd, store=open_store(config)), report
+
+    def _publish(self, root, phase, snapshot):
+        with self._lock:
+            self._partial[root] = snapshot
+        log('Indexed {0} modules for {1}', phase, root, status=True)
 
     def _make_python_path(self, root, locations):
         paths = [p[0] for p in locations]
@@ -121,17 +512,41 @@ class PythonImportMagic(sublime_plugin.EventListener):
 class UpdatePythonImports(sublime_plugin.TextCommand):
 
     def run(self, edit):
-        index = index_for_view(self.view)
-        if not index:
+        if not self.view.match_selector(0, 'source.python'):
             return
-
-        update_imports_for_view(edit, self.view, index)
+        root = get_project_root(self.view)
+        with indexer.lookup(root) as index:
+            if not index:
+                return
+            update_imports_for_view(edit, self.view, index)
+        indexer.flush(root)
 
 
 class RebuildPythonImportIndex(sublime_plugin.TextCommand):
 
+    def run(self, edit, locations=None):
+        indexer.rebuild(get_project_root(self.view), locations)
+
+
+class UpdatePythonImportIndex(sublime_plugin.TextCommand):
+
     def run(self, edit):
-        indexer.rebuild(get_project_root(self.view))
+        indexer.update(get_project_root(self.view))
+
+
+class ShowPythonImportIndexReport(sublime_plugin.WindowCommand):
+
+    def run(self):
+        root = self.window.folders()[0] if self.window.folders() else None
+        view = self.window.active_view()
+        if view is not None:
+            root = get_project_root(view)
+        report = indexer.report(root)
+        if report is None:
+            log('No index has been built for {0} since Sublime started', root, status=True)
+            return
+        log('Index report for {0}\n{1}', root, report.format())
+        self.window.run_command('show_panel', {'panel': 'console'})
 
 
 class ImportPythonSymbol(sublime_plugin.TextCommand):
@@ -158,13 +573,6 @@ class ImportPythonSymbol(sublime_plugin.TextCommand):
 indexer = Indexer()
 
 
-def index_for_view(view):
-    if not view.match_selector(0, 'source.python'):
-        return
-
-    return indexer.index(get_project_root(view))
-
-
 def get_project_root(view):
     # NOTE: It would be nice if this wasn't so difficult :\
     try:  # handle case with no open folder